@@ -1,14 +1,20 @@
+import asyncio
+import logging
+import threading
 from datetime import datetime, timedelta
-from groq import Groq
-from huggingface_hub import InferenceClient
+from django.conf import settings
+from django.core.cache import cache
 from channels.db import database_sync_to_async
+from analyzer.utils.db_executor import database_read_to_async
 
-@database_sync_to_async
-def get_correct_api():
+logger = logging.getLogger(__name__)
+
+
+def select_key():
     
     from analyzer.models import ApiKeys
 
-    keys = ApiKeys.objects.all()
+    keys = ApiKeys.objects.select_related('provider_company')
     for key in keys:
         company = key.provider_company.company_name.lower()
 
@@ -30,6 +36,9 @@ def get_correct_api():
     return None
 
 
+get_correct_api = database_read_to_async(select_key)
+
+
 @database_sync_to_async
 def rigister_key_sotp_datetime(key):
     
@@ -40,13 +49,116 @@ def rigister_key_sotp_datetime(key):
     db_key.save()
 
 
+# Bumped in the shared cache whenever a worker rotates away from a failed key,
+# so every worker reloads its key instead of hitting the same 429/401 itself
+KEY_VERSION_CACHE_KEY = 'llm_api_key_version'
+_active_key = {'key': None, 'version': None}
+
+
+def _bump_key_version():
+    try:
+        return cache.incr(KEY_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(KEY_VERSION_CACHE_KEY, 1, None)
+        return 1
+
+
+async def get_active_key():
+    """Key this worker uses, reloaded after any worker rotated keys"""
+    version = await asyncio.to_thread(cache.get, KEY_VERSION_CACHE_KEY, 0)
+    if _active_key['key'] is None or _active_key['version'] != version:
+        _active_key['key'] = await get_correct_api()
+        _active_key['version'] = version
+    return _active_key['key']
+
+
+async def rotate_key(key):
+    """Stop a failed key for all workers and return the next available key"""
+    await rigister_key_sotp_datetime(key)
+    version = await asyncio.to_thread(_bump_key_version)
+    _active_key['key'] = await get_correct_api()
+    _active_key['version'] = version
+    return _active_key['key']
+
+
 def initialize_client(key) -> tuple:
     
     company = key.provider_company.company_name.lower()
 
+    # Provider SDKs are imported on first use, they take a large share of the startup time
     if company == "groq":
+        from groq import Groq
         return Groq(api_key=key.api_key), key.provider_company.model_name
     elif company == "hf":
+        from huggingface_hub import InferenceClient
         return InferenceClient(api_key=key.api_key, provider="featherless-ai"), key.provider_company.model_name
+    elif company == "stub":
+        # Simulated provider for load tests, configured by model_name
+        from .stub_provider import StubClient
+        return StubClient(key.api_key, key.provider_company.model_name), key.provider_company.model_name
     else:
         raise ValueError(f"Unsupported company: {company}")
+
+
+# Idle provider clients per key. A client is taken for one call and only
+# given back after a successful call, so closing a client to abort a
+# cancelled call never affects another request, while the HTTP
+# connections of the idle clients are reused by the next calls.
+_idle_clients = {}
+_idle_lock = threading.Lock()
+
+
+def _client_key(key):
+    return (key.pk, key.api_key, key.provider_company.company_name.lower(), key.provider_company.model_name)
+
+
+def acquire_client(key) -> tuple:
+    """An idle (client, model) for the key, or a new one"""
+    with _idle_lock:
+        idle = _idle_clients.get(_client_key(key))
+        if idle:
+            return idle.pop()
+    return initialize_client(key)
+
+
+def release_client(key, client, model):
+    """Give back a client after a successful call, keeping at most PROVIDER_IDLE_CLIENTS per key"""
+    with _idle_lock:
+        idle = _idle_clients.setdefault(_client_key(key), [])
+        if len(idle) < settings.PROVIDER_IDLE_CLIENTS:
+            idle.append((client, model))
+            return
+    close_client(client)
+
+
+def close_client(client):
+    close = getattr(client, 'close', None)
+    if close:
+        close()
+
+
+def warm_active_key():
+    """
+    Load the active key and open a connection to its provider, from a
+    worker thread at startup.
+    """
+    version = cache.get(KEY_VERSION_CACHE_KEY, 0)
+    key = select_key()
+    _active_key['key'] = key
+    _active_key['version'] = version
+    if key is None:
+        return None
+
+    client, model = initialize_client(key)
+    models = getattr(client, 'models', None)
+    if models is not None:
+        # Listing models opens the provider's HTTP connection without using tokens
+        try:
+            with_options = getattr(client, 'with_options', None)
+            (with_options(timeout=settings.WARMUP_PROVIDER_TIMEOUT).models if with_options else models).list()
+        except Exception as e:
+            logger.warning("Could not open a provider connection for key id %s: %s", key.pk, e)
+            close_client(client)
+            return key
+    release_client(key, client, model)
+    return key
@@ -1,112 +1,69 @@
 import asyncio
+import json
 import logging
 import time
-from huggingface_hub.utils import HfHubHTTPError
+from django.conf import settings
 from requests.exceptions import HTTPError, RequestException, ConnectionError, Timeout
-from .API_keys import get_correct_api, rigister_key_sotp_datetime, initialize_client
-from channels.db import database_sync_to_async
+from . import prompts
+from .API_keys import get_active_key, rotate_key, acquire_client, release_client, close_client
+from analyzer.utils.db_executor import database_read_to_async
+from analyzer.utils import metrics
+from analyzer.utils.deadline import within
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Active system messages by (name, profile), as (expires at, message or None)
+_prompts = {}
 
-async def analyze_company_name(company_name, language="English"):
-    alternativ_messsage= f"""
-        You are a company analysis AI. Your task is to analyze the provided company name and determine:
 
-        Whether the company supports Israel DIRECTLY or INDIRECTLY (True if it has any form of support, False if it does not). Include companies with:
-        - Direct support: donations, partnerships, investments in Israel
-        - Indirect support: subsidiaries operating in Israel, supply chains supporting Israeli economy, parent companies with Israeli ties
-        The brand/company name.
-        The parent company name.
-        The main product type/category the company is known for.
-        The cause of boycott, stated in a critical and direct manner, without any justification, apology, or positive framing for the company.
+def load_system_message(name, profile=prompts.VERBOSE):
+    """Text of the active SystemMessage called name for profile, cached for PROMPT_CACHE_SECONDS"""
+    from analyzer.models import SystemMessage
 
-        Respond only in this exact format:
-        [True/False, Brand Name, Parent Company Name, Product Type, Cause]
+    entry = _prompts.get((name, profile))
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    message = (SystemMessage.objects.filter(name=name, profile=profile, is_active=True)
+               .values_list('message', flat=True).first())
+    _prompts[(name, profile)] = (time.monotonic() + settings.PROMPT_CACHE_SECONDS, message)
+    return message
 
-        If no Parent Company, put: $
 
-        Examples:
-        [True, McDonald's, $, Fast Food, Provides free meals to Israeli military forces]
-        [True, Starbucks, $, Coffee, Supports Israeli military through corporate partnerships]
-        [False, Samsung, $, Electronics, No evidence of direct support for Israel]
-        [True, HP, $, Technology, Provides technology infrastructure for Israeli settlements]
-        [True, Coca-Cola, $, Soft Drinks, Sponsors Israeli military events and activities]
+async def get_system_message(name, profile=prompts.VERBOSE):
+    entry = _prompts.get((name, profile))
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    return await database_read_to_async(load_system_message)(name, profile)
 
-        CRITICAL: You MUST respond in {language} language only. All text in your response must be in {language}.
-        
-        Be accurate and consistent. Do not include any extra text, punctuation, or formatting other than the specified structure.
-    """
+
+def invalidate_system_messages():
+    _prompts.clear()
+
+
+async def system_prompt(name, language, profile, deadline=None):
+    """The SystemMessage of name and profile, or the built-in prompt"""
     try:
-        from analyzer.models import SystemMessage
-        system_msg = await database_sync_to_async(lambda: SystemMessage.objects.filter(name="company_analysis", is_active=True).first())()
-        system_content = (system_msg.message + f" CRITICAL: You MUST respond in {language} language only.") if system_msg else alternativ_messsage
+        with metrics.stage_seconds.time(stage='prompt_fetch'):
+            system_msg = await within(deadline, get_system_message(name, profile), "prompt lookup")
     except Exception as e:
-        logger.error(f"Error fetching analyze_company_name system message: {str(e)}")
-        system_content = alternativ_messsage
-    
+        logger.error("Error fetching %s system message: %s", name, e)
+        system_msg = None
+    if system_msg:
+        return prompts.with_language(name, system_msg, language)
+    return prompts.builtin_prompt(name, profile, language)
+
+
+async def analyze_company_name(company_name, language="English", deadline=None, **options):
     message = [
-        {
-            "role": "system",
-            "content": system_content
-        },
         {
             "role": "user",
             "content": f"Analyze this company: {company_name}. IMPORTANT: Respond in {language} language."
         }
     ]
-    return await analyze(message)
-
-async def analyze_img(image_url, language="English"):
-    alternativ_messsage= f"""
-        You are a product identification AI. Your task is to analyze the provided image and determine:
-
-        Whether the identified company/brand supports Israel DIRECTLY or INDIRECTLY (True if it has any form of support, False if it does not). Include companies with:
-        - Direct support: donations, partnerships, investments in Israel
-        - Indirect support: subsidiaries operating in Israel, supply chains supporting Israeli economy, parent companies with Israeli ties
-
-        The brand/company name.
-
-        The parent company name.
-
-        The product type/category (not the specific product name or flavor).
-
-        The cause of boycott, stated in a critical and direct manner, without any justification, apology, or positive framing for the company.
-
-        Respond only in this exact format:
-        [True/False, Brand Name, Parent Company Name, Product Type, Cause]
-
-        If no Parent Company, put: $
-
-        Correct Examples:
-        [True, 7 Up, PepsiCo, Soft Drink, Funds Israeli military through partnerships and donations]
-        [True, Miranda, PepsiCo, Soft Drink, Profits used to support Israeli settlement expansion]
-        [False, Apple, $, Smartphone, No evidence of direct support for Israel]
-        [True, Cadbury, Mondelez, Dairy Milk Chocolate, Parent company invests in Israeli companies aiding occupation]
-
-        Do NOT return specific product names or flavors:
-        [False, Apple, $, iPhone 14 Pro, No evidence of direct support for Israel] (Incorrect – too specific)
+    return await analyze(message, deadline, system=("company_analysis", language), **options)
 
-        If no product is clearly visible in the image, respond exactly with: #
-
-        CRITICAL: You MUST respond in {language} language only. All text in your response must be in {language}.
-        
-        Be concise and consistent. Do not include any extra text, punctuation, or formatting other than the specified structure. 
-        """
-    try:
-        from analyzer.models import SystemMessage
-        system_msg = await database_sync_to_async(lambda: SystemMessage.objects.filter(name="image_analysis", is_active=True).first())() 
-        system_content = (system_msg.message + f" CRITICAL: You MUST respond in {language} language only.") if system_msg else alternativ_messsage
-    except Exception as e:
-        logger.error(f"Error fetching image analysis system message: {str(e)}")
-        system_content = alternativ_messsage
-    
+async def analyze_img(image_url, language="English", deadline=None, **options):
     message = [
-        {
-            "role": "system",
-            "content": system_content
-        },
         {
             "role": "user",
             "content": [
@@ -119,64 +76,119 @@ async def analyze_img(image_url, language="English"):
             ]
         }
     ]
-    return await analyze(message)
+    return await analyze(message, deadline, system=("image_analysis", language), **options)
+
+async def translate_texts(texts, language, deadline=None, **options):
+    """Ask for texts translated into language, as a JSON array in the same order"""
+    message = [
+        {
+            "role": "user",
+            "content": f"Translate into {language}: {json.dumps(texts, ensure_ascii=False)}"
+        }
+    ]
+    return await analyze(message, deadline, system=("translation", language), **options)
+
+async def analyze(message: list, deadline=None, system=None, profile=None, key=None, usage=None) -> str:
+    """
+    Send a chat completion, rotating keys on auth, quota and connection errors.
 
-async def analyze(message: list) -> str:
-    global key
-    if 'key' not in globals() or key is None:
-        key = await get_correct_api()
-        if key is None:
-            logger.error("No available API keys. Service stopped for maintenance.")
-            return "SERVICE_STOPPED"
+    With a deadline, every attempt (key rotations included) only gets the time
+    left, and DeadlineExceeded is raised once it runs out.
+
+    system is the (prompt name, language) of the system message put before
+    message, in the prompt profile of the key's provider unless profile is
+    given. A given key is used without rotating to others. usage, if given,
+    is updated with the profile, model and token counts of the call.
+    """
+    pinned = key is not None
+    if not pinned:
+        with metrics.stage_seconds.time(stage='key_selection'):
+            key = await within(deadline, get_active_key(), "key lookup")
+    if key is None:
+        logger.error("No available API keys. Service stopped for maintenance.")
+        return "SERVICE_STOPPED"
 
     while True:
-        logger.info(f"Using API key: {key.api_key}")
-        client, model = initialize_client(key)
+        if deadline is not None:
+            deadline.check("provider call")
+        logger.info("Using API key id %s (%s)", key.pk, key.provider_company.company_name)
+        call_profile = profile or prompts.profile_for(key)
+        messages = message
+        if system is not None:
+            messages = [{"role": "system", "content": await system_prompt(*system, call_profile, deadline)}] + message
+        client, model = acquire_client(key)
+        reusable = False
 
         try:
-            completion = await asyncio.to_thread(
-                client.chat.completions.create,
-                model=model,
-                messages=message,
-                temperature=0,
-            )
-            return completion.choices[0].message.content
-
-        except (HfHubHTTPError, HTTPError) as e:
+            provider = key.provider_company.company_name.lower()
+            timer = metrics.provider_call_seconds.time(provider=provider, model=model, key_id=key.pk)
+            with timer:
+                completion = await within(deadline, asyncio.to_thread(
+                    client.chat.completions.create,
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                ), "provider call")
+            reusable = True
+            content = completion.choices[0].message.content
+
+            prompt_tokens, completion_tokens = prompts.token_usage(completion, messages, content)
+            metrics.provider_tokens_total.inc(prompt_tokens, provider=provider, model=model,
+                                              profile=call_profile, kind='prompt')
+            metrics.provider_tokens_total.inc(completion_tokens, provider=provider, model=model,
+                                              profile=call_profile, kind='completion')
+            if usage is not None:
+                usage.update(profile=call_profile, model=model,
+                             prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            return content
+
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # The caller is gone or out of time: closing the client below aborts
+            # the worker thread's HTTP request instead of letting it run to completion
+            raise
+
+        except HTTPError as e:
             status = getattr(e.response, "status_code", None)
 
             if status in [401, 403]:
                 logger.warning("Token expired or invalid. Fetching new API key...")
-                await rigister_key_sotp_datetime(key)
-                key = await get_correct_api()
+                metrics.key_rotations_total.inc(reason='auth')
+                key = await rotate_key(key) if not pinned else None
                 if key is None:
                     raise Exception("All keys exhausted or invalid. Please try again later.")
                 continue
 
             elif status == 429:
                 logger.warning("Quota exceeded. Fetching new API key...")
-                await rigister_key_sotp_datetime(key)
-                key = await get_correct_api()
+                metrics.key_rotations_total.inc(reason='quota')
+                key = await rotate_key(key) if not pinned else None
                 if key is None:
                     raise Exception("All keys exhausted or invalid. Please try again later.")
                 continue
 
             else:
-                logger.error(f"HTTP error: {str(e)}")
+                logger.error("HTTP error: %s", e)
                 raise
 
         except (ConnectionError, Timeout) as e:
             logger.warning("Connection/timeout error. Fetching new API key...")
-            await rigister_key_sotp_datetime(key)
-            key = await get_correct_api()
+            metrics.key_rotations_total.inc(reason='connection')
+            key = await rotate_key(key) if not pinned else None
             if key is None:
                 raise Exception("All keys exhausted or invalid. Please try again later.")
             continue
 
         except RequestException as e:
-            logger.error(f"Request error: {str(e)}")
+            logger.error("Request error: %s", e)
             raise Exception("A network or connection error occurred.")
 
         except Exception as e:
-            logger.error(f"API call failed: {str(e)}")
+            logger.error("API call failed: %s", e)
             raise Exception("API call failed. Please check your input or try again later.")
+
+        finally:
+            # Clients are only reused after a successful call
+            if reusable:
+                release_client(key, client, model)
+            else:
+                close_client(client)
@@ -0,0 +1,161 @@
+"""
+Built-in prompts and prompt profiles.
+
+A profile is a variant of every prompt: `verbose` has the full
+instructions and examples, `compact` the same format in a fraction of the
+tokens. The profile of a call is the prompt_profile of the key's provider,
+or PROMPT_PROFILE. An active SystemMessage with the prompt's name and the
+profile replaces the built-in prompt. `manage.py evaluate_prompts` compares
+the accuracy and token cost of profiles.
+"""
+import math
+
+from django.conf import settings
+
+VERBOSE = 'verbose'
+COMPACT = 'compact'
+
+PROMPTS = {
+    'company_analysis': {
+        VERBOSE: """
+        You are a company analysis AI. Your task is to analyze the provided company name and determine:
+
+        Whether the company supports Israel DIRECTLY or INDIRECTLY (True if it has any form of support, False if it does not). Include companies with:
+        - Direct support: donations, partnerships, investments in Israel
+        - Indirect support: subsidiaries operating in Israel, supply chains supporting Israeli economy, parent companies with Israeli ties
+        The brand/company name.
+        The parent company name.
+        The main product type/category the company is known for.
+        The cause of boycott, stated in a critical and direct manner, without any justification, apology, or positive framing for the company.
+
+        Respond only in this exact format:
+        [True/False, Brand Name, Parent Company Name, Product Type, Cause]
+
+        If no Parent Company, put: $
+
+        Examples:
+        [True, McDonald's, $, Fast Food, Provides free meals to Israeli military forces]
+        [True, Starbucks, $, Coffee, Supports Israeli military through corporate partnerships]
+        [False, Samsung, $, Electronics, No evidence of direct support for Israel]
+        [True, HP, $, Technology, Provides technology infrastructure for Israeli settlements]
+        [True, Coca-Cola, $, Soft Drinks, Sponsors Israeli military events and activities]
+
+        CRITICAL: You MUST respond in {language} language only. All text in your response must be in {language}.
+        
+        Be accurate and consistent. Do not include any extra text, punctuation, or formatting other than the specified structure.
+    """,
+        COMPACT: """
+        Decide whether the company supports Israel directly (donations, partnerships, investments) or indirectly (subsidiaries in Israel, supply chains, parent company ties).
+        Reply only with: [True/False, Brand Name, Parent Company Name or $, Product Type, Cause]
+        State the cause critically and directly, without justification.
+        Example: [True, Starbucks, $, Coffee, Supports Israeli military through corporate partnerships]
+        Respond in {language}.
+    """,
+    },
+    'image_analysis': {
+        VERBOSE: """
+        You are a product identification AI. Your task is to analyze the provided image and determine:
+
+        Whether the identified company/brand supports Israel DIRECTLY or INDIRECTLY (True if it has any form of support, False if it does not). Include companies with:
+        - Direct support: donations, partnerships, investments in Israel
+        - Indirect support: subsidiaries operating in Israel, supply chains supporting Israeli economy, parent companies with Israeli ties
+
+        The brand/company name.
+
+        The parent company name.
+
+        The product type/category (not the specific product name or flavor).
+
+        The cause of boycott, stated in a critical and direct manner, without any justification, apology, or positive framing for the company.
+
+        Respond only in this exact format:
+        [True/False, Brand Name, Parent Company Name, Product Type, Cause]
+
+        If no Parent Company, put: $
+
+        Correct Examples:
+        [True, 7 Up, PepsiCo, Soft Drink, Funds Israeli military through partnerships and donations]
+        [True, Miranda, PepsiCo, Soft Drink, Profits used to support Israeli settlement expansion]
+        [False, Apple, $, Smartphone, No evidence of direct support for Israel]
+        [True, Cadbury, Mondelez, Dairy Milk Chocolate, Parent company invests in Israeli companies aiding occupation]
+
+        Do NOT return specific product names or flavors:
+        [False, Apple, $, iPhone 14 Pro, No evidence of direct support for Israel] (Incorrect – too specific)
+
+        If no product is clearly visible in the image, respond exactly with: #
+
+        CRITICAL: You MUST respond in {language} language only. All text in your response must be in {language}.
+        
+        Be concise and consistent. Do not include any extra text, punctuation, or formatting other than the specified structure. 
+        """,
+        COMPACT: """
+        Identify the brand of the product in the image and decide whether it supports Israel directly or indirectly (subsidiaries in Israel, supply chains, parent company ties).
+        Reply only with: [True/False, Brand Name, Parent Company Name or $, Product Type, Cause]
+        Product Type is a category, not a product name or flavor. State the cause critically and directly.
+        Example: [True, 7 Up, PepsiCo, Soft Drink, Funds Israeli military through partnerships and donations]
+        If no product is visible, reply: #
+        Respond in {language}.
+    """,
+    },
+    'translation': {
+        VERBOSE: """
+        You are a translation AI. Translate each string of the JSON array you are given into the requested language.
+        Keep brand and company names unchanged. Keep the meaning and tone of every string.
+
+        Respond only with a JSON array of the translated strings, in the same order and with the same number of strings.
+        Do not include any extra text or formatting.
+    """,
+        COMPACT: """
+        Translate each string of the JSON array into the requested language, keeping brand names.
+        Reply only with a JSON array of the same length.
+    """,
+    },
+}
+
+# Appended to SystemMessage prompts of these names, which do not name the language
+LANGUAGE_SUFFIX = {
+    'company_analysis': " CRITICAL: You MUST respond in {language} language only.",
+    'image_analysis': " CRITICAL: You MUST respond in {language} language only.",
+}
+
+
+def profile_for(key):
+    """Prompt profile for calls with key"""
+    return key.provider_company.prompt_profile or settings.PROMPT_PROFILE
+
+
+def builtin_prompt(name, profile, language):
+    """Built-in prompt of the profile, or its verbose prompt for profiles without one"""
+    variants = PROMPTS[name]
+    return variants.get(profile, variants[VERBOSE]).format(language=language)
+
+
+def with_language(name, message, language):
+    return message + LANGUAGE_SUFFIX.get(name, '').format(language=language)
+
+
+def estimate_tokens(messages):
+    """
+    Rough token count of chat messages, about four characters per token,
+    for providers that do not report usage. Images are not counted.
+    """
+    chars = 0
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get('text', '')) for part in content if part.get('type') == 'text')
+    return math.ceil(chars / 4)
+
+
+def token_usage(completion, messages, content):
+    """(prompt tokens, completion tokens) as reported by the provider, else estimated"""
+    usage = getattr(completion, 'usage', None)
+    prompt_tokens = getattr(usage, 'prompt_tokens', None)
+    completion_tokens = getattr(usage, 'completion_tokens', None)
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(messages)
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens([{'content': content or ''}])
+    return prompt_tokens, completion_tokens
@@ -0,0 +1,144 @@
+"""
+Simulated LLM provider for load tests.
+
+Selected like a real provider: a ProviderCompany named "stub" whose
+model_name holds the configuration as a query string, e.g.
+
+    stub?latency_ms=1500&jitter_ms=500&dist=lognormal&p429=0.02&p401=0.005&ptimeout=0.01&boycott=0.5
+
+latency_ms   median latency of a call (default 1000)
+jitter_ms    spread: +/- for uniform, the standard deviation for normal,
+             and for lognormal sigma = jitter_ms / latency_ms (default 0)
+dist         fixed, uniform, normal or lognormal (default fixed)
+p429, p401   probability of a call failing with that HTTP status
+ptimeout     probability of a call hanging for timeout_ms, then raising
+             requests' Timeout (timeout_ms defaults to 30000)
+boycott      share of company names answered as boycotted (default 0.5);
+             the answer for a name is always the same
+ms_per_1k_tokens  latency added per 1000 prompt tokens (default 0)
+
+Text queries echo the company name in the verdict; image queries get one
+of the canned verdicts; translations prefix each text with the language.
+Token usage is reported like real providers do, estimated from the text.
+Calls run in a worker thread like the real clients, and close()
+interrupts a call that is still sleeping.
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+import requests
+
+from analyzer.API.prompts import estimate_tokens
+
+CANNED_VERDICTS = [
+    "[True, Starbucks, $, Coffee, Supports occupation through corporate partnerships]",
+    "[True, 7 Up, PepsiCo, Soft Drink, Funds occupation through partnerships]",
+    "[False, Samsung, $, Electronics, No evidence of direct support]",
+    "[True, Nescafe, Nestle, Coffee, Parent company invests in occupation]",
+    "[False, Matrix, $, Soft Drink, No evidence of direct support]",
+    "#",
+]
+
+COMPANY_RE = re.compile(r'Analyze this company: (.+?)\. IMPORTANT')
+TRANSLATE_RE = re.compile(r'^Translate into (.+?): (\[.*\])$', re.S)
+
+
+def parse_spec(model_name):
+    """Settings of a stub ProviderCompany from its model_name"""
+    _, _, query = model_name.partition('?')
+    spec = dict(parse_qsl(query))
+    return {
+        'latency': float(spec.get('latency_ms', 1000)) / 1000,
+        'jitter': float(spec.get('jitter_ms', 0)) / 1000,
+        'dist': spec.get('dist', 'fixed'),
+        'p429': float(spec.get('p429', 0)),
+        'p401': float(spec.get('p401', 0)),
+        'ptimeout': float(spec.get('ptimeout', 0)),
+        'timeout': float(spec.get('timeout_ms', 30000)) / 1000,
+        'boycott': float(spec.get('boycott', 0.5)),
+        'per_token': float(spec.get('ms_per_1k_tokens', 0)) / 1000 / 1000,
+    }
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} from stub provider", response=response)
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, messages, temperature=0, **kwargs):
+        return self._client._complete(messages)
+
+
+class StubClient:
+    """Implements the part of the chat completions client used by analyze()"""
+
+    def __init__(self, api_key, model_name, rng=None):
+        self.api_key = api_key
+        self.spec = parse_spec(model_name)
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self._rng = rng or random.Random()
+        self._closed = threading.Event()
+
+    def close(self):
+        self._closed.set()
+
+    def _latency(self):
+        spec = self.spec
+        latency, jitter = spec['latency'], spec['jitter']
+        if spec['dist'] == 'uniform':
+            latency = self._rng.uniform(latency - jitter, latency + jitter)
+        elif spec['dist'] == 'normal':
+            latency = self._rng.gauss(latency, jitter)
+        elif spec['dist'] == 'lognormal' and latency > 0:
+            latency = self._rng.lognormvariate(math.log(latency), jitter / latency)
+        return max(0.0, latency)
+
+    def _sleep(self, seconds):
+        if self._closed.wait(seconds):
+            raise requests.exceptions.ConnectionError("Stub client closed")
+
+    def _complete(self, messages):
+        spec = self.spec
+        roll = self._rng.random()
+        if roll < spec['ptimeout']:
+            self._sleep(spec['timeout'])
+            raise requests.exceptions.Timeout("Stub provider timed out")
+        roll -= spec['ptimeout']
+
+        prompt_tokens = estimate_tokens(messages)
+        self._sleep(self._latency() + prompt_tokens * spec['per_token'])
+        if roll < spec['p429']:
+            raise _http_error(429)
+        if roll < spec['p429'] + spec['p401']:
+            raise _http_error(401)
+
+        content = self._verdict(messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=estimate_tokens([{'content': content}]))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    def _verdict(self, messages):
+        user = messages[-1]['content']
+        if isinstance(user, str):
+            match = TRANSLATE_RE.match(user)
+            if match:
+                language, texts = match.group(1), json.loads(match.group(2))
+                return json.dumps([f"[{language}] {text}" for text in texts], ensure_ascii=False)
+            match = COMPANY_RE.search(user)
+            name = match.group(1) if match else user
+            # Same answer for the same name, like a real model at temperature 0
+            share = int(hashlib.sha256(name.lower().encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+            if share < self.spec['boycott']:
+                return f"[True, {name}, $, Coffee, Stub cause for {name}]"
+            return f"[False, {name}, $, Coffee, No evidence of direct support]"
+        return self._rng.choice(CANNED_VERDICTS)
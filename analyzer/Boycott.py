@@ -1,16 +1,23 @@
 import logging
 from channels.db import database_sync_to_async
+from analyzer.utils.db_executor import database_read_to_async
+from analyzer.utils.metrics import timed
+from analyzer.utils.image_store import mirror_image_to_imgur
+from analyzer.utils.logs import SAMPLED
+from analyzer.utils.write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 
-@database_sync_to_async
+@database_read_to_async
+@timed('boycott_lookup')
 def check_company_and_get_cause(company: str, company_parent_name=None):
     from analyzer.models import BoycottCompanies
+    from analyzer.utils.company_search import candidates
     from analyzer.utils.fuzzy_match import find_best_company_match
     from django.db.models import Q
 
     try:
-        logger.info(f"Checking company: {company} and parent company: {company_parent_name}")
+        logger.info("Checking company: %s and parent company: %s", company, company_parent_name)
 
         # Validate and clean input
         names_to_check = []
@@ -42,65 +49,72 @@ def check_company_and_get_cause(company: str, company_parent_name=None):
 
         partial_match = BoycottCompanies.objects.filter(partial_query).first()
         if partial_match:
-            logger.info(f"Partial match found: {partial_match.company_name}")
+            logger.info("Partial match found: %s", partial_match.company_name)
             return partial_match.cause
 
-        # 3. Fuzzy match with both names
-        all_companies = BoycottCompanies.objects.all()
+        # 3. Fuzzy match with both names, over the candidates the search index proposes
+        companies = candidates(names_to_check)
         best_match = None
         best_score = 0
 
         for name in names_to_check:
-            match, score = find_best_company_match(name, all_companies, threshold=0.75)
+            match, score = find_best_company_match(name, companies, threshold=0.75)
             if match and score > best_score:
                 best_match = match
                 best_score = score
 
         if best_match:
-            logger.info(f"Fuzzy match found: {best_match.company_name} (similarity: {best_score:.2f})")
+            logger.info("Fuzzy match found: %s (similarity: %.2f)", best_match.company_name, best_score)
             return best_match.cause
 
-        logger.info(f"No match found for: {company} or {company_parent_name}")
+        logger.info("No match found for: %s or %s", company, company_parent_name)
         return None
 
     except Exception as e:
-        logger.error(f"Error checking company: {str(e)}")
+        logger.error("Error checking company: %s", e)
         raise ValueError(f"Unsupported company: {company}, error: {str(e)}")
 
 
     except Exception as e:
-        logger.error(f"Error checking company: {str(e)}")
+        logger.error("Error checking company: %s", e)
         raise ValueError(f"Unsupported company: {company}, error: {str(e)}")
 
-@database_sync_to_async
-def save_product_as_alternative(company_name: str, product_type: str, image=None, country=None):
-    """Save a product as an alternative when it's not found in boycott list"""
+def store_alternative_image(image):
+    """
+    Store a base64 JPEG in the local image store and return its URL.
+    New images are mirrored to Imgur in the background when enabled.
+    """
+    from django.conf import settings
+    from analyzer.utils.image_store import store_image
+
+    digest, image_url, created = store_image(image)
+    if created and settings.IMGUR_MIRROR_ENABLED:
+        write_behind.submit_threadsafe('mirror_image', digest)
+    return image_url
+
+def save_product_as_alternative_sync(company_name: str, product_type: str, image=None, country=None):
+    """
+    Save a product as an alternative when it's not found in boycott list.
+
+    Database errors are raised so the write-behind queue can retry them.
+    """
     from analyzer.models import AlternativeCompanies, AlternativeProducts, ProductType, Country
-    from analyzer.utils.imgur_upload import upload_image_to_imgur
+    from analyzer.utils.bulk_writer import alternative_description
     
     try:
         if not company_name or not product_type:
             raise ValueError("Company name and product type are required")
             
-        logger.info(f"Saving alternative product: {company_name} - {product_type} from {country or 'unknown location'}")
+        logger.info("Saving alternative product: %s - %s from %s",
+                    company_name, product_type, country or 'unknown location')
         
-        # Upload image to Imgur if image provided
-        imgur_url = None
-        if image:
-            try:
-                imgur_url = upload_image_to_imgur(image)
-                if imgur_url:
-                    logger.info(f"Image uploaded to Imgur: {imgur_url}")
-                else:
-                    logger.warning("Failed to upload image to Imgur")
-            except Exception as imgur_error:
-                logger.error(f"Error uploading to Imgur: {str(imgur_error)}")
+        image_url = store_alternative_image(image) if image else None
         
         try:
             # Get or create the alternative company
             alt_company, created = AlternativeCompanies.objects.get_or_create(
                 company_name=company_name,
-                defaults={'description': f'Alternative company identified from image analysis{f" in {country}" if country else ""}'}
+                defaults={'description': alternative_description(country)}
             )
             
             # Get or create the product type
@@ -118,7 +132,7 @@ def save_product_as_alternative(company_name: str, product_type: str, image=None
                 product_name=company_name,
                 company_name=alt_company,
                 product_type=prod_type,
-                defaults={'image_url': imgur_url}
+                defaults={'image_url': image_url}
             )
             
             # Add country to the product if provided
@@ -126,63 +140,85 @@ def save_product_as_alternative(company_name: str, product_type: str, image=None
                 alt_product.countries.add(country_obj)
             
             # Update image_url if product already exists but doesn't have an image
-            if not created and imgur_url and not alt_product.image_url:
-                alt_product.image_url = imgur_url
+            if not created and image_url and not alt_product.image_url:
+                alt_product.image_url = image_url
                 alt_product.save()
             
-            logger.info(f"Successfully saved alternative product: {company_name} - {product_type}")
+            logger.info("Successfully saved alternative product: %s - %s", company_name, product_type)
             return alt_product
             
         except Exception as db_error:
-            logger.error(f"Database error saving alternative product: {str(db_error)}")
+            logger.error("Database error saving alternative product: %s", db_error)
             raise
             
-    except Exception as e:
-        logger.error(f"Error in save_product_as_alternative: {str(e)}")
+    except ValueError as e:
+        logger.error("Error in save_product_as_alternative: %s", e)
         return None
 
 @database_sync_to_async
-def get_alternatives_for_boycott_product(product_type=None, country=None):
+def save_product_as_alternative(company_name: str, product_type: str, image=None, country=None):
+    """Async wrapper for save_product_as_alternative_sync"""
+    try:
+        return save_product_as_alternative_sync(company_name, product_type, image, country)
+    except Exception as e:
+        logger.error("Error in save_product_as_alternative: %s", e)
+        return None
+
+@timed('learn_alternative')
+def learn_alternative_sync(company_name: str, product_type: str, image=None, country=None):
     """
-    Get alternative products for a specific boycott product.
-    
+    Write-behind job for a non-boycott scan: link or save the product as an
+    alternative. Only image scans are saved as new alternatives.
+    """
+    from analyzer.utils.bulk_writer import alternative_writer
+
+    if not company_name or not product_type:
+        return
+    if is_alternative_product_sync(company_name, product_type, country):
+        return
+    if not image:
+        return
+
+    # Written in the next coalesced batch
+    alternative_writer.add(company_name, product_type, country, store_alternative_image(image))
+    logger.info("New company queued as alternative: %s", company_name)
+
+def queue_learn_alternative(company_name: str, product_type: str, image=None, country=None):
+    """Queue learn_alternative_sync on the write-behind queue without waiting for it"""
+    return write_behind.submit('learn_alternative', company_name, product_type, image, country)
+
+@database_read_to_async
+def get_alternatives_for_boycott_product(product_type=None, country=None, deadline=None):
+    """
+    Get alternative products for a boycotted product type in a country.
+
+    Served from the per-country snapshot in alternatives_cache: exact product
+    type matches come first, then similar types, at most 6 entries.
+
     Args:
-        boycott_product_id: ID of the boycott product to find alternatives for
-        product_type: Optional product type to filter alternatives by
-        use_fuzzy_matching: If True, uses fuzzy matching for product types
-        
+        product_type: Product type of the boycotted product
+        country: Country name of the user
+        deadline: Request deadline; if it passed while the lookup waited for
+            a database thread, the lookup is skipped
+
     Returns:
-        List of alternative products with their details
+        Tuple of read-only dicts with the alternative products details,
+        or None when skipped
     """
-    from analyzer.models import AlternativeProducts
-    from analyzer.utils.fuzzy_match import is_similar_product_type
-    
+    from analyzer.utils.alternatives_cache import alternatives_cache
+
+    if deadline is not None and deadline.expired():
+        logger.warning("Skipping alternatives lookup, request deadline passed")
+        return None
+
     try:
-        # Get all alternatives for this boycott product
-        alternatives = AlternativeProducts.objects.filter(countries__name=country)    
-        # Filter by product type with optional fuzzy matching
-        result = []
-        for alt in alternatives:
-            alt_product_type = alt.product_type.product_type
-            
-            if is_similar_product_type(product_type, alt_product_type):
-                result.append({
-                    'product_name': alt.product_name,
-                    'company_name': alt.company_name.company_name,
-                    'product_type': alt_product_type,
-                    'company_website': alt.company_name.website,
-                    'image_url': alt.image_url,
-                    'countries': [country.name for country in alt.countries.all()],
-                    'is_exact_match': (alt_product_type.lower() == product_type.lower())
-                })
-                if len(result) ==6 : break
-        
-        return result
-        
+        return alternatives_cache.get(country, product_type)
+
     except Exception as e:
-        logger.error(f"Error getting alternatives: {str(e)}", exc_info=True)
+        logger.error("Error getting alternatives: %s", e, exc_info=True)
         return []
 
+@timed('alternative_check')
 def is_alternative_product_sync(company_name: str, product_type: str, country=None):
     """Synchronous version - Check if a product from a company is in the alternative products list"""
     from analyzer.models import AlternativeProducts, Country
@@ -192,11 +228,12 @@ def is_alternative_product_sync(company_name: str, product_type: str, country=No
         company_name = company_name.strip()
         product_type = product_type.strip()
         
-        logger.info(f"[SYNC] Checking alternative product for: '{company_name}' - '{product_type}' in '{country}'")
+        logger.info("[SYNC] Checking alternative product for: '%s' - '%s' in '%s'",
+                    company_name, product_type, country)
         
         # Get count of alternative products in database
         alt_count = AlternativeProducts.objects.count()
-        logger.info(f"[SYNC] Total alternative products in database: {alt_count}")
+        logger.info("[SYNC] Total alternative products in database: %s", alt_count)
         
         # If no alternative products exist, return False immediately
         if alt_count == 0:
@@ -214,7 +251,8 @@ def is_alternative_product_sync(company_name: str, product_type: str, country=No
         exact_match = AlternativeProducts.objects.filter(**query_filter).first()
         
         if exact_match:
-            logger.info(f"[SYNC] Found exact alternative match: {exact_match.company_name.company_name} - {exact_match.product_type.product_type}")
+            logger.info("[SYNC] Found exact alternative match: %s - %s",
+                        exact_match.company_name.company_name, exact_match.product_type.product_type)
             return True
             
         # Try case-insensitive match for company with fuzzy product type match
@@ -228,13 +266,13 @@ def is_alternative_product_sync(company_name: str, product_type: str, country=No
         
         for product in similar_products:
             if is_similar_product_type(product_type, product.product_type.product_type):
-                logger.info(f"[SYNC] Found alternative with similar product type: "
-                          f"{product.company_name.company_name} - {product.product_type.product_type} "
-                          f"(input type: {product_type})")
+                logger.info("[SYNC] Found alternative with similar product type: %s - %s (input type: %s)",
+                            product.company_name.company_name, product.product_type.product_type, product_type)
                 return True
         
         # If no exact match, try fuzzy matching
-        logger.info(f"[SYNC] No exact alternative match, trying fuzzy matching for: {company_name} - {product_type}")
+        logger.info("[SYNC] No exact alternative match, trying fuzzy matching for: %s - %s",
+                    company_name, product_type)
         
         # Get all alternative products and check similarity
         all_alt_products = AlternativeProducts.objects.select_related('company_name', 'product_type').all()
@@ -244,33 +282,42 @@ def is_alternative_product_sync(company_name: str, product_type: str, country=No
             company_similarity = calculate_similarity(company_name, alt_product.company_name.company_name)
             product_similarity = calculate_similarity(product_type, alt_product.product_type.product_type)
             
-            logger.info(f"[SYNC] Comparing with DB entry: '{alt_product.company_name.company_name}' - '{alt_product.product_type.product_type}' (scores: {company_similarity:.2f}, {product_similarity:.2f})")
+            # One line per row, so only a sample is kept
+            logger.info("[SYNC] Comparing with DB entry: '%s' - '%s' (scores: %.2f, %.2f)",
+                        alt_product.company_name.company_name, alt_product.product_type.product_type,
+                        company_similarity, product_similarity, extra=SAMPLED)
             
             # Check if company is similar and product types match (either exactly or through fuzzy matching)
             if company_similarity >= 0.75:
                 # Use the new fuzzy product type matching
                 if is_similar_product_type(product_type, alt_product.product_type.product_type):
-                    logger.info(f"[SYNC] Found fuzzy alternative match: {alt_product.company_name.company_name} - {alt_product.product_type.product_type} "
-                              f"(company score: {company_similarity:.2f}, product types: '{product_type}' ~ '{alt_product.product_type.product_type}')")
+                    logger.info("[SYNC] Found fuzzy alternative match: %s - %s "
+                                "(company score: %.2f, product types: '%s' ~ '%s')",
+                                alt_product.company_name.company_name, alt_product.product_type.product_type,
+                                company_similarity, product_type, alt_product.product_type.product_type)
                     country_obj, created = Country.objects.get_or_create(name=country)
                     alt_product.countries.add(country_obj)
                     found_match = True
                     break
         
         if not found_match:
-            logger.info(f"[SYNC] No fuzzy alternative match found for: {company_name} - {product_type}")
+            logger.info("[SYNC] No fuzzy alternative match found for: %s - %s", company_name, product_type)
         
-        logger.info(f"[SYNC] Final result: {found_match}")
+        logger.info("[SYNC] Final result: %s", found_match)
         return found_match
         
     except Exception as e:
-        logger.error(f"[SYNC] Error checking alternative product: {str(e)}")
+        logger.error("[SYNC] Error checking alternative product: %s", e)
         return False
 
 @database_sync_to_async
 def is_alternative_product(company_name: str, product_type: str, country=None):
     """Async wrapper for is_alternative_product_sync"""
-    logger.info(f"[ASYNC] is_alternative_product called with: '{company_name}' - '{product_type}' in '{country}'")
+    logger.info("[ASYNC] is_alternative_product called with: '%s' - '%s' in '%s'",
+                company_name, product_type, country)
     result = is_alternative_product_sync(company_name, product_type, country)
-    logger.info(f"[ASYNC] is_alternative_product returning: {result}")
-    return result
\ No newline at end of file
+    logger.info("[ASYNC] is_alternative_product returning: %s", result)
+    return result
+
+write_behind.register('learn_alternative', learn_alternative_sync)
+write_behind.register('mirror_image', mirror_image_to_imgur)
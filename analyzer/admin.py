@@ -1,12 +1,24 @@
 from django.contrib import admin
 from .models import *
+
+
+class CompanyCauseTranslationInline(admin.TabularInline):
+    model = CompanyCauseTranslation
+    extra = 0
+
+
+class BoycottCompaniesAdmin(admin.ModelAdmin):
+    inlines = [CompanyCauseTranslationInline]
+
+
 # Register your models here.
 admin.site.register(ProviderCompany)
 admin.site.register(ApiKeys)
-admin.site.register(BoycottCompanies)
+admin.site.register(BoycottCompanies, BoycottCompaniesAdmin)
 admin.site.register(BoycottProducts)
 admin.site.register(AlternativeCompanies)
 admin.site.register(AlternativeProducts)
 admin.site.register(ProductType)
 admin.site.register(SystemMessage)
 admin.site.register(Country)
+admin.site.register(PartnerKey)
@@ -0,0 +1,27 @@
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import authentication, exceptions, permissions
+
+
+class PartnerKeyAuthentication(authentication.BaseAuthentication):
+    """Authenticates partners by the X-API-Key header; request.auth is their PartnerKey"""
+
+    header = 'X-API-Key'
+
+    def authenticate(self, request):
+        from analyzer.models import PartnerKey
+
+        key = request.headers.get(self.header)
+        if not key:
+            return None
+        partner = PartnerKey.objects.filter(key=key, is_active=True).first()
+        if partner is None:
+            raise exceptions.AuthenticationFailed("Invalid API key")
+        return AnonymousUser(), partner
+
+    def authenticate_header(self, request):
+        return self.header
+
+
+class IsPartner(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.auth is not None
@@ -1,65 +1,56 @@
-import base64
-import json
 import asyncio
 import logging
 import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
-from .imgProcessor import convert_and_resize_image
-from analyzer.API.message import analyze_img, analyze_company_name
-from analyzer.Boycott import check_company_and_get_cause, get_alternatives_for_boycott_product
+from analyzer import protocol
+from analyzer.pipeline import ANALYSIS_TIMEOUT, run_analysis
+from analyzer.utils.deadline import Deadline
+from analyzer.utils.logs import bind_request_id
+from analyzer.utils.rate_limit import connection_limiter, message_limiter
 
 logger = logging.getLogger(__name__)
 
-# Rate limiting storage (in production, use Redis)
-connection_attempts = {}
-MAX_REQUESTS_PER_MINUTE = 10
-
-
-def parse_response(response: str):
-    """
-    response will be as follow: [Company Name, Product Type]
-                        change  [Boycott Status, Company Name, head company name, Product Type] responss head (-) or none  
-    """
-    response = response.strip() 
-    if response.startswith('['):
-        response = response[1:]
-    if response.endswith(']'):
-        response = response[:-1]
-    if response.endswith('].'):
-        response = response[:-2]
-    try:
-        parts = [part.strip() for part in response.split(',')]
-        return parts[0].lower()== 'true', parts[1], parts[2] if "$" not in parts[2] else None, parts[3], parts[4]
-    except:
-        return False, False, None, None, None
-
-
 
 class AnalyzeConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Get client IP for rate limiting
-        client_ip = self.get_client_ip()
+        client_ip = self.client_ip = self.get_client_ip()
         
         # Rate limiting check
-        if not self.check_rate_limit(client_ip):
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+        if not await connection_limiter.aallow(client_ip):
+            logger.warning("Rate limit exceeded for IP: %s", client_ip)
             await self.close(code=4429)  # Too Many Requests
             return
             
         # API Key validation
-        query_string = self.scope.get('query_string', b'').decode('utf-8')
-        api_key = None
-        if 'api_key=' in query_string:
-            api_key = query_string.split('api_key=')[1].split('&')[0]
+        query = self.get_query_params()
+        api_key = query.get('api_key')
             
         if not api_key or api_key != settings.WEBSOCKET_API_KEY:
-            logger.warning(f"Invalid API key from IP: {client_ip}, {api_key}")
+            logger.warning("Invalid API key from IP: %s", client_ip)
             await self.close(code=4401)  # Unauthorized
             return
+
+        # Session mode keeps the socket open for many requests, old clients get one request per socket
+        self.session = query.get('session', '0').lower() in ('1', 'true')
+        self.in_flight = {}
+        self.last_activity = time.monotonic()
+        self.heartbeat_task = None
+
+        # Result protocol: legacy frames for old clients, one envelope per result for v2
+        self.protocol, self.format, subprotocol = protocol.negotiate(self.scope.get('subprotocols'), query)
+        self.stream = self.protocol == protocol.V2 and query.get('stream', '0').lower() in ('1', 'true')
         
-        await self.accept()
+        await self.accept(subprotocol=subprotocol)
+        if self.session:
+            self.heartbeat_task = asyncio.create_task(self.heartbeat())
         
+    def get_query_params(self):
+        """Raw (not URL decoded) query string parameters"""
+        query_string = self.scope.get('query_string', b'').decode('utf-8')
+        return dict(part.split('=', 1) for part in query_string.split('&') if '=' in part)
+
     def get_client_ip(self):
         """Extract client IP from WebSocket scope"""
         headers = dict(self.scope.get('headers', []))
@@ -78,144 +69,156 @@ class AnalyzeConsumer(AsyncWebsocketConsumer):
         client = self.scope.get('client')
         return client[0] if client else 'unknown'
         
-    def check_rate_limit(self, client_ip):
-        """Simple rate limiting - 5 requests per minute per IP"""
-        current_time = time.time()
-        
-        if client_ip not in connection_attempts:
-            connection_attempts[client_ip] = []
-            
-        # Remove attempts older than 1 minute
-        connection_attempts[client_ip] = [
-            attempt_time for attempt_time in connection_attempts[client_ip]
-            if current_time - attempt_time < 60
-        ]
-        
-        # Check if under limit
-        if len(connection_attempts[client_ip]) >= MAX_REQUESTS_PER_MINUTE:
-            return False
-            
-        # Add current attempt
-        connection_attempts[client_ip].append(current_time)
-        return True
-
     async def disconnect(self, close_code):
-        pass
+        heartbeat_task = getattr(self, 'heartbeat_task', None)
+        if heartbeat_task:
+            heartbeat_task.cancel()
+        # The client is gone, stop working on its requests
+        for task in list(getattr(self, 'in_flight', {}).values()):
+            task.cancel()
+
+    async def heartbeat(self):
+        """Ping session clients and close sessions idle for longer than the idle timeout"""
+        while True:
+            await asyncio.sleep(settings.WEBSOCKET_HEARTBEAT_INTERVAL)
+            idle = time.monotonic() - self.last_activity
+            if not self.in_flight and idle > settings.WEBSOCKET_IDLE_TIMEOUT:
+                logger.info("Closing idle WebSocket session after %.0fs", idle)
+                await self.close(code=4408)
+                return
+            await self.send_frame("ping")
 
-    async def receive(self, text_data):
+    async def send_frame(self, frame_type, value=None, request_id=None, **extra):
+        frame = {"type": frame_type}
+        if value is not None or frame_type not in ("done", "ping", "pong"):
+            frame["value"] = value
+        if request_id is not None:
+            frame["request_id"] = request_id
+        frame.update(extra)
+        await self.send_encoded(frame)
+
+    async def send_encoded(self, frame):
+        if self.protocol == protocol.LEGACY:
+            text_data, bytes_data = protocol.encode_legacy(frame)
+        else:
+            text_data, bytes_data = protocol.encode(frame, self.format)
+        protocol.wire_stats[f"{self.protocol}_frames"] += 1
+        protocol.wire_stats[f"{self.protocol}_bytes"] += len(text_data.encode('utf-8')) if text_data is not None else len(bytes_data)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def send_error(self, message, request_id=None):
+        await self.send_frame("error", message, request_id)
+        if not self.session:
+            await self.close()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        self.last_activity = time.monotonic()
+        # The time budget of a request starts when it arrives
+        deadline = Deadline(ANALYSIS_TIMEOUT)
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
+            data = protocol.decode(text_data, bytes_data, self.format)
+        except (ValueError, UnicodeDecodeError):
             logger.error("Invalid JSON received")
-            await self.send(text_data=json.dumps({"type": "error", "value": "Invalid JSON format"}))
-            await self.close()
+            await self.send_error("Invalid JSON format")
             return
-            
+
+        if self.session and isinstance(data, dict) and data.get('type') in ('ping', 'pong'):
+            if data['type'] == 'ping':
+                await self.send_frame("pong")
+            return
+
+        request_id = data.get('request_id') if isinstance(data, dict) else None
+        if self.session and not self.validate_request_id(request_id):
+            logger.error("Missing or invalid request_id in session mode")
+            await self.send_error("Invalid or missing request_id")
+            return
+
         # Input validation
         if not self.validate_input(data):
             logger.error("Invalid input data")
-            await self.send(text_data=json.dumps({"type": "error", "value": "Invalid input data"}))
-            await self.close()
+            await self.send_error("Invalid input data", request_id)
             return
         image_data = data.get('image_data', None)
         company_name_input = data.get('company_name', None)
         
         if not image_data and not company_name_input:
             logger.error("No IMAGE data or company name provided")
-            return     
-           
-        country = data.get('country', None)
-        if not country:
-            logger.info(f"User country: NO COUNTRY..!")
+            return
 
-        language = data.get('language', 'English')
+        if not await message_limiter.aallow(self.client_ip):
+            logger.warning("Message rate limit exceeded for IP: %s", self.client_ip)
+            await self.send_frame("error", "Rate limit exceeded", request_id)
+            if not self.session:
+                await self.close(code=4429)
+            return
 
-        try:
-            if company_name_input:
-                # Handle text-based company name analysis
-                response_text = await asyncio.wait_for(analyze_company_name(company_name_input, language), timeout=25.0)
-                logger.info(f"Company name analysis response: {response_text}")
-                boycott_status, company_name, company_parent_name, product_type, cause = parse_response(response_text)
-                logger.info(f"Parsed response: {company_name}, {company_parent_name}, {product_type}")
-            else:
-                # Handle image-based analysis
-                # Extract base64 data from data URL
-                if image_data.startswith('data:image/'):
-                    base64_data = image_data.split(',')[1]
-                else:
-                    base64_data = image_data
+        if not self.session:
+            if self.in_flight:
+                await self.send_error("Request already in progress")
+                return
+        elif request_id in self.in_flight:
+            await self.send_error("Duplicate request_id", request_id)
+            return
+        elif len(self.in_flight) >= settings.WEBSOCKET_MAX_IN_FLIGHT:
+            await self.send_error("Too many requests in flight", request_id)
+            return
 
-                file_bytes = base64.b64decode(base64_data)
-                resized_base64, ext, saved_filename = await asyncio.to_thread(
-                    convert_and_resize_image, file_bytes, max_size=(800, 800), quality=70
-                )
+        # Requests run as tasks so disconnect can cancel them, even in one-shot mode
+        task = asyncio.create_task(self.handle_request(data, request_id, deadline))
+        self.in_flight[request_id] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(request_id, None))
 
-                image_url = f"data:image/{ext};base64,{resized_base64}"
-                response_text = await asyncio.wait_for(analyze_img(image_url, language), timeout=25.0)
-                logger.info(f"Image analysis response: {response_text}")
-                boycott_status, company_name, company_parent_name, product_type, cause = parse_response(response_text)
-                logger.info(f"Parsed response: {company_name}, {company_parent_name}, {product_type}")
-            
-            if not company_name:
-                error_msg = "Invalid response format" if company_name_input else "Invalid image or response format"
-                not_recognized_msg = "Company NOT recognized" if company_name_input else "Image NOT recognized"
-                await self.send(text_data=json.dumps({"type": "error", "value": error_msg}))
-                await self.send(text_data=json.dumps({"type": "company", "value": not_recognized_msg}))
-                await self.send(text_data=json.dumps({"type": "boycott", "value": False}))
-                await self.send(text_data=json.dumps({"type": "product_type", "value":""}))
-                await self.send(text_data=json.dumps({"type": "cause", "value": ""}))
-                await self.send(text_data=json.dumps({"type": "alternative", "value": ""}))
-                await self.send(text_data=json.dumps({"type": "done"}))
-                await self.close()
-                return
-            
-            else:
-                await self.send(text_data=json.dumps({"type": "company", "value": company_name}))
-                await self.send(text_data=json.dumps({"type": "product_type", "value": product_type}))
-                await self.send(text_data=json.dumps({"type": "boycott", "value": boycott_status}))
-                await self.send(text_data=json.dumps({"type": "cause", "value": cause}))
-                if boycott_status:
-                    # Get and send alternatives
-                    alternatives = await get_alternatives_for_boycott_product(product_type, country=country)
-                    await self.send(text_data=json.dumps({
-                        "type": "alternative", 
-                        "value": alternatives
-                    }))
-                    await self.send(text_data=json.dumps({"type": "done"}))
-                    await self.close()
-                else:
-                    await self.send(text_data=json.dumps({"type": "alternative", "value": ""}))
-                    # Check if it's an alternative company
-                    from analyzer.Boycott import is_alternative_product, save_product_as_alternative
+    async def handle_request(self, data, request_id=None, deadline=None):
+        # Runs as its own task, so the id only tags the logs of this request
+        bind_request_id(request_id)
+        on_verdict = None
+        if self.stream:
+            sent = {}
 
-                    # Await the async function call
-                    is_alternative = await is_alternative_product(company_name, product_type, country)
-                    logger.info(f"is_alternative_product returned: {is_alternative} for {company_name} - {product_type} in {country}")
-                    
-                    if not is_alternative and image_data:
-                        await save_product_as_alternative(company_name, product_type, resized_base64, country)
-                        logger.info(f"New company saved as alternative: {company_name}")
+            async def on_verdict(partial):
+                await self.send_encoded(protocol.result_delta(protocol.result_fields(partial), sent, request_id))
 
-                    await self.send(text_data=json.dumps({"type": "done"}))
-                    await self.close()
+        async def on_queue(position, expected_wait):
+            await self.send_frame("queue", position, request_id, eta=round(expected_wait, 1))
 
-        except asyncio.TimeoutError:
-            await self.send(text_data=json.dumps({"type": "error", "value": "Request timed out after 25 seconds"}))
-            await self.send(text_data=json.dumps({"type": "company", "value": "Timed out after 25 seconds"}))
-            await self.send(text_data=json.dumps({"type": "boycott", "value": False}))
-            await self.send(text_data=json.dumps({"type": "product_type", "value":""}))
-            await self.send(text_data=json.dumps({"type": "cause", "value": ""}))
-            await self.send(text_data=json.dumps({"type": "done"}))
-            await self.close()
-        except Exception as e:
-            logger.error(f"Error processing request: {str(e)}")
-            await self.send(text_data=json.dumps({"type": "error", "value": "Processing error"}))
-            await self.send(text_data=json.dumps({"type": "company", "value": "Error: Try again"}))
-            await self.send(text_data=json.dumps({"type": "boycott", "value": False}))
-            await self.send(text_data=json.dumps({"type": "product_type", "value":""}))
-            await self.send(text_data=json.dumps({"type": "cause", "value": ""}))
-            await self.send(text_data=json.dumps({"type": "done"}))
+        result = await run_analysis(
+            data, on_verdict=on_verdict, client_key=self.client_ip, on_queue=on_queue, deadline=deadline,
+        )
+        self.last_activity = time.monotonic()
+
+        if self.protocol == protocol.LEGACY:
+            await self.send_result(result, request_id)
+        elif self.stream:
+            await self.send_encoded(protocol.result_delta(protocol.result_fields(result), sent, request_id, done=True))
+        else:
+            await self.send_encoded(protocol.result_envelope(result, request_id))
+
+        if not self.session:
             await self.close()
+
+    async def send_result(self, result, request_id=None):
+        """Send a result as the legacy sequence of frames, ending with done"""
+        if result['error']:
+            await self.send_frame("error", result['error'], request_id)
+            await self.send_frame("company", result['company'], request_id)
+            await self.send_frame("boycott", result['boycott'], request_id)
+            await self.send_frame("product_type", result['product_type'], request_id)
+            await self.send_frame("cause", result['cause'], request_id)
+        else:
+            await self.send_frame("company", result['company'], request_id)
+            await self.send_frame("product_type", result['product_type'], request_id)
+            await self.send_frame("boycott", result['boycott'], request_id)
+            await self.send_frame("cause", result['cause'], request_id)
+        if result['alternative'] is not None:
+            await self.send_frame("alternative", result['alternative'], request_id)
+        await self.send_frame("done", request_id=request_id)
+
+    def validate_request_id(self, request_id):
+        if isinstance(request_id, bool):
+            return False
+        if isinstance(request_id, int):
+            return True
+        return isinstance(request_id, str) and 0 < len(request_id) <= 64
             
     def validate_input(self, data):
         """Validate input data structure and content"""
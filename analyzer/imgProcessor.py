@@ -1,32 +1,57 @@
 import io
 import base64
 from PIL import Image
-from cairosvg import svg2png
-import os
-from django.conf import settings
-from datetime import datetime
+from analyzer.utils.image_store import image_digest
 
-def convert_and_resize_image(file_bytes, max_size=(800, 800), quality=70):
-    
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    file_name = f"converted_{timestamp}.jpeg"
-    file_path = os.path.join(settings.MEDIA_ROOT, file_name)
+def perceptual_hash(image):
+    """
+    64-bit difference hash as 16 hex digits: whether each pixel of a 9x8
+    grayscale thumbnail is brighter than its right neighbour. The same
+    picture re-encoded or resized almost always gets the same hash.
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def convert_and_resize_image(file_bytes, max_size=(800, 800), quality=70, cancel_event=None, deadline=None):
+    """
+    Convert an image (SVG or any format Pillow reads) to a resized JPEG.
+
+    Returns the JPEG as base64, its extension, its content addressed file
+    name, which is the name it gets in the image store, and its perceptual
+    hash.
+    If cancel_event is set between steps, InterruptedError is raised; if
+    the request deadline passes, DeadlineExceeded is raised.
+    """
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise InterruptedError("Image conversion cancelled")
+        if deadline is not None:
+            deadline.check("image conversion")
 
     try:
         if file_bytes.strip().startswith(b"<?xml") or b"<svg" in file_bytes[:500].lower():
-            # SVG → PNG → PIL Image
+            # SVG → PNG → PIL Image; cairosvg loads the cairo library, so only when needed
+            from cairosvg import svg2png
             png_bytes = svg2png(bytestring=file_bytes)
             image = Image.open(io.BytesIO(png_bytes))
         else:
             image = Image.open(io.BytesIO(file_bytes))
 
+        check_cancelled()
         image = image.convert("RGB")
+        check_cancelled()
         image.thumbnail(max_size)
 
+        check_cancelled()
         buffer = io.BytesIO()
         image.save(buffer, format="JPEG", quality=quality)
-        resized_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        return resized_base64, "jpeg", file_name
+        jpeg_bytes = buffer.getvalue()
+        resized_base64 = base64.b64encode(jpeg_bytes).decode('utf-8')
+        return resized_base64, "jpeg", f"{image_digest(jpeg_bytes)}.jpeg", perceptual_hash(image)
 
     except Exception as e:
         print(f"خطأ أثناء التحويل والحفظ: {e}")
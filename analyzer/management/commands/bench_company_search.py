@@ -0,0 +1,85 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from analyzer.utils.company_search import PythonSearch, get_backend
+
+SYLLABLES = ['al', 'ba', 'co', 'da', 'el', 'fa', 'ga', 'ha', 'in', 'jo', 'ka', 'lu', 'ma', 'no', 'or',
+             'pe', 'qu', 'ra', 'sa', 'ta', 'ur', 'vi', 'wa', 'xo', 'ya', 'ze']
+SUFFIXES = ['', '', '', ' Inc', ' Ltd', ' Group', ' Corporation', ' GmbH', ' International']
+
+
+def make_name(rng):
+    words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+             for _ in range(rng.randint(1, 3))]
+    return ' '.join(words) + rng.choice(SUFFIXES)
+
+
+def misspell(name, rng):
+    """The name with one character dropped, doubled or swapped, like a misread label"""
+    i = rng.randrange(1, len(name) - 1)
+    edit = rng.choice(('drop', 'double', 'swap'))
+    if edit == 'drop':
+        return name[:i] + name[i + 1:]
+    if edit == 'double':
+        return name[:i] + name[i] + name[i:]
+    return name[:i - 1] + name[i] + name[i - 1] + name[i + 1:]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare fuzzy company lookups scanning every row with the database search backend "
+        "on generated companies. Runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--queries', type=int, default=50, help='Lookups per corpus size')
+        parser.add_argument('--backend', default=None, help='sqlite or postgres (default: COMPANY_SEARCH_BACKEND)')
+        parser.add_argument('--seed', type=int, default=1948)
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['backend'])
+        self.stdout.write(f"Database: {connection.vendor}, search backend: {backend.name}")
+        for size in options['companies']:
+            with transaction.atomic():
+                self.run_size(backend, size, options['queries'], random.Random(options['seed'] + size))
+                transaction.set_rollback(True)
+
+    def run_size(self, backend, size, query_count, rng):
+        from analyzer.models import BoycottCompanies
+        from analyzer.utils.fuzzy_match import find_best_company_match
+
+        backend.install()
+        BoycottCompanies.objects.bulk_create(
+            [BoycottCompanies(company_name=make_name(rng)) for _ in range(size)], batch_size=5000,
+        )
+        names = list(BoycottCompanies.objects.values_list('company_name', flat=True))
+        # Two thirds misspelled known names, one third unknown names
+        queries = [misspell(rng.choice(names), rng) if i % 3 else make_name(rng) for i in range(query_count)]
+
+        results = {}
+        for label, search in (('scan', PythonSearch()), ('index', backend)):
+            durations, matches = [], []
+            for query in queries:
+                start = time.perf_counter()
+                ids = search.candidate_ids([query], 50)
+                companies = (list(BoycottCompanies.objects.all()) if ids is None
+                             else list(BoycottCompanies.objects.filter(id__in=ids)))
+                match, score = find_best_company_match(query, companies, threshold=0.75)
+                durations.append(time.perf_counter() - start)
+                matches.append((match.id if match else None, round(score, 6)))
+            results[label] = matches
+            durations.sort()
+            self.stdout.write(
+                f"{size:7d} companies  {label:5s}  mean {statistics.fmean(durations) * 1000:8.2f} ms  "
+                f"p95 {durations[int(len(durations) * 0.95)] * 1000:8.2f} ms"
+            )
+        same_match = sum(a == b for a, b in zip(results['scan'], results['index']))
+        # Different companies with the same score are ties the scan breaks by table order
+        same_score = sum(a[1] == b[1] for a, b in zip(results['scan'], results['index']))
+        self.stdout.write(f"{size:7d} companies  same best match for {same_match}/{len(queries)} queries, "
+                          f"same best score for {same_score}/{len(queries)}")
@@ -0,0 +1,65 @@
+import asyncio
+import statistics
+import time
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+
+from analyzer.utils.db_executor import database_read_to_async
+
+
+def lookup_company(company_name, latency):
+    from analyzer.models import BoycottCompanies
+
+    match = BoycottCompanies.objects.filter(company_name__icontains=company_name).first()
+    if latency:
+        # Stands in for the network round trip of a remote database
+        time.sleep(latency)
+    return match
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent company lookups through database_sync_to_async and "
+        "through the read executor, and compare how long they queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent lookups per round')
+        parser.add_argument('--rounds', type=int, default=3, help='Rounds per wrapper')
+        parser.add_argument('--latency-ms', type=float, default=10.0,
+                            help='Simulated database round trip added to every lookup')
+        parser.add_argument('--company', default='Starbucks', help='Company name to look up')
+
+    def handle(self, *args, **options):
+        latency = options['latency_ms'] / 1000
+        wrappers = [
+            ('database_sync_to_async', database_sync_to_async(lookup_company)),
+            ('database_read_to_async', database_read_to_async(lookup_company)),
+        ]
+        self.stdout.write(
+            f"{options['concurrency']} concurrent lookups x {options['rounds']} rounds, "
+            f"{options['latency_ms']:.1f} ms simulated latency"
+        )
+        self.stdout.write(f"{'wrapper':<24}{'wall ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, wrapper in wrappers:
+            wall, latencies = asyncio.run(self._run(wrapper, options, latency))
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            self.stdout.write(
+                f"{name:<24}{wall * 1000:>10.1f}{statistics.median(latencies) * 1000:>10.1f}"
+                f"{p95 * 1000:>10.1f}{latencies[-1] * 1000:>10.1f}"
+            )
+
+    async def _run(self, wrapper, options, latency):
+        latencies = []
+
+        async def timed_lookup():
+            start = time.perf_counter()
+            await wrapper(options['company'], latency)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(options['rounds']):
+            await asyncio.gather(*(timed_lookup() for _ in range(options['concurrency'])))
+        return (time.perf_counter() - start) / options['rounds'], latencies
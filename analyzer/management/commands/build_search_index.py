@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from analyzer.utils.company_search import get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the database structures of the company search backend (SQLite FTS5 table "
+        "and triggers, or the pg_trgm extension and GIN index) and fill them from the companies table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default=None,
+                            help='sqlite or postgres (default: COMPANY_SEARCH_BACKEND)')
+
+    def handle(self, *args, **options):
+        try:
+            backend = get_backend(options['backend'])
+            with transaction.atomic():
+                backend.install()
+        except Exception as e:
+            raise CommandError(f"Could not build the company search index: {e}")
+        if backend.name == 'python':
+            self.stdout.write("The python backend has no index to build")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Company search index ready ({backend.name})"))
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.API.prompts import COMPACT, VERBOSE
+from analyzer.utils.fuzzy_match import normalize_company_name
+
+DEFAULT_FIXTURES = os.path.join(settings.BASE_DIR, 'benchmarks', 'prompt_eval.jsonl')
+CHECKS = ('format', 'boycott', 'brand', 'parent', 'product_type')
+
+
+def same_name(a, b):
+    return (normalize_company_name(a or '') or (a or '').lower()) == (normalize_company_name(b or '') or (b or '').lower())
+
+
+def score(fixture, verdict):
+    """Which checks the verdict passes, None for checks the fixture has no answer for"""
+    boycott, brand, parent, product_type, _ = verdict
+    if not brand:
+        return dict.fromkeys(CHECKS, False)
+    return {
+        'format': True,
+        'boycott': boycott == fixture['boycott'] if 'boycott' in fixture else None,
+        'brand': same_name(brand, fixture['brand']) if 'brand' in fixture else None,
+        'parent': same_name(parent, fixture.get('parent')) if 'brand' in fixture else None,
+        'product_type': (product_type.strip().lower() == fixture['product_type'].strip().lower()
+                         if 'product_type' in fixture else None),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the accuracy and token cost of prompt profiles on a fixture set of company "
+        "names, with the stub provider unless --live is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', default=DEFAULT_FIXTURES,
+                            help='JSON Lines of {"company", "boycott", "brand", "parent", "product_type"}')
+        parser.add_argument('--profiles', nargs='+', default=[COMPACT, VERBOSE])
+        parser.add_argument('--stub', default='stub?latency_ms=0', help='Stub provider spec')
+        parser.add_argument('--live', action='store_true', help='Use the active API key instead of the stub')
+        parser.add_argument('--language', default=None, help='Default: VERDICT_LANGUAGE')
+        parser.add_argument('--tolerance', type=float, default=0.02,
+                            help='Accuracy a cheaper profile may lose and still be recommended')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['fixtures'], encoding='utf-8') as f:
+                fixtures = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read fixtures: {e}")
+        key = self.get_key(options)
+        language = options['language'] or settings.VERDICT_LANGUAGE
+
+        results = {}
+        for profile in options['profiles']:
+            results[profile] = asyncio.run(self.evaluate(profile, fixtures, key, language))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{len(fixtures)} fixtures, provider {key.provider_company.company_name} "
+                          f"({key.provider_company.model_name})")
+        self.stdout.write(f"{'profile':10s} {'format':>7s} {'boycott':>8s} {'brand':>6s} {'parent':>7s} "
+                          f"{'type':>6s} {'prompt tok':>11s} {'output tok':>11s} {'p50 ms':>8s}")
+        for profile, result in results.items():
+            accuracy = result['accuracy']
+            self.stdout.write(
+                f"{profile:10s} " + ' '.join(f"{accuracy[check]:>{width}.0%}" for check, width in
+                                            zip(CHECKS, (7, 8, 6, 7, 6)))
+                + f" {result['prompt_tokens']:11.0f} {result['completion_tokens']:11.0f} {result['p50_ms']:8.0f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Cheapest profile within tolerance: {self.pick(results, options['tolerance'])}"))
+
+    def get_key(self, options):
+        from analyzer.API.API_keys import select_key
+        from analyzer.models import ApiKeys, ProviderCompany
+
+        if options['live']:
+            key = select_key()
+            if key is None:
+                raise CommandError("No active API key")
+            return key
+        # Never saved: the evaluation does not touch the keys used by the service
+        return ApiKeys(api_key='stub-evaluation',
+                       provider_company=ProviderCompany(company_name='stub', model_name=options['stub']))
+
+    async def evaluate(self, profile, fixtures, key, language):
+        from analyzer.API.message import analyze_company_name
+        from analyzer.pipeline import parse_response
+
+        scores, prompt_tokens, completion_tokens, durations = [], [], [], []
+        for fixture in fixtures:
+            usage = {}
+            start = time.perf_counter()
+            response = await analyze_company_name(fixture['company'], language, profile=profile, key=key, usage=usage)
+            durations.append((time.perf_counter() - start) * 1000)
+            scores.append(score(fixture, parse_response(response)))
+            prompt_tokens.append(usage.get('prompt_tokens', 0))
+            completion_tokens.append(usage.get('completion_tokens', 0))
+
+        accuracy = {}
+        for check in CHECKS:
+            passed = [result[check] for result in scores if result[check] is not None]
+            accuracy[check] = sum(passed) / len(passed) if passed else 0.0
+        return {
+            'accuracy': accuracy,
+            'prompt_tokens': statistics.fmean(prompt_tokens),
+            'completion_tokens': statistics.fmean(completion_tokens),
+            'p50_ms': statistics.median(durations),
+        }
+
+    def pick(self, results, tolerance):
+        """Profile with the fewest tokens whose verdict accuracy is within tolerance of the best"""
+        def quality(result):
+            return min(result['accuracy']['format'], result['accuracy']['boycott'])
+
+        best = max(quality(result) for result in results.values())
+        eligible = [profile for profile, result in results.items() if quality(result) >= best - tolerance]
+        return min(eligible, key=lambda profile: results[profile]['prompt_tokens'] + results[profile]['completion_tokens'])
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from analyzer.utils.catalog import export_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the offline catalog (boycotted companies and alternatives per "
+        "country) as a new version with deltas from the kept versions, if the data changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=None,
+                            help='Previous versions to keep deltas from (default: CATALOG_KEEP_VERSIONS)')
+
+    def handle(self, *args, **options):
+        manifest, created = export_catalog(keep=options['keep'])
+        if created:
+            self.stdout.write(self.style.SUCCESS(
+                f"Exported catalog version {manifest['version']} ({manifest['digest']}), "
+                f"deltas from {manifest['versions'][:-1] or 'none'}"
+            ))
+        else:
+            self.stdout.write(f"Catalog version {manifest['version']} is up to date")
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.utils.dataset_import import KINDS, DatasetImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a boycott or alternatives dataset (.csv or .jsonl, optionally .gz) into the "
+        "database in batched transactions, matching names like the analysis does."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Roll back every batch')
+        parser.add_argument('--export-catalog', action='store_true',
+                            help='Export a new offline catalog version after the import')
+
+    def handle(self, *args, **options):
+        importer = DatasetImporter(options['kind'], batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        def progress(stats, rate):
+            self.stdout.write(f"{stats['rows']} rows ({stats['skipped']} skipped), {rate:.0f} rows/s")
+
+        try:
+            stats = importer.run(read_rows(options['path']), progress=progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        except Exception as e:
+            # Earlier batches are committed and the import is idempotent, so it can be re-run
+            raise CommandError(
+                f"Import failed after line {importer.stats['last_line'] or 'none'}: {e}. "
+                "Batches up to that line are committed; re-running the import is safe."
+            )
+
+        for line_number, error in importer.errors:
+            self.stderr.write(f"Line {line_number}: {error}")
+        counts = ', '.join(
+            f"{name} {stats[name]}" for name in sorted(stats) if name.endswith(('_created', '_updated'))
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Checked' if options['dry_run'] else 'Imported'} {stats['imported']} of {stats['rows']} rows"
+            f"{': ' + counts if counts else ''}"
+        ))
+        if options['dry_run']:
+            return
+
+        if importer.kind == 'alternatives':
+            from analyzer.utils.cache_sync import invalidate_alternatives
+
+            # bulk_create sends no model signals. Running servers see this through the Redis
+            # broadcast, or without Redis through the version stamp in the database
+            invalidate_alternatives(importer.touched_countries, country_names=True)
+        if options['export_catalog']:
+            from analyzer.utils.catalog import export_catalog
+
+            manifest, created = export_catalog()
+            self.stdout.write(
+                f"Catalog version {manifest['version']}" + (" exported" if created else " is up to date")
+            )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from analyzer.utils.image_store import prune_images
+
+
+class Command(BaseCommand):
+    help = "Delete the stored images that no alternative product links to any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Seconds an unused image is kept (default: IMAGE_UNUSED_MAX_AGE)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        deleted, freed = prune_images(max_age=options['max_age'], dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} unused images ({freed / 1024:.0f} KiB)"))
@@ -0,0 +1,53 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.utils.translations import is_canonical, language_key, translate
+
+
+class Command(BaseCommand):
+    help = (
+        "Translate the causes of boycotted companies into the given languages and store them "
+        "with the companies. Only causes without a current translation are sent to the provider."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('languages', nargs='+', help='Languages, e.g. Arabic French')
+        parser.add_argument('--batch-size', type=int, default=20, help='Causes per provider call')
+
+    def handle(self, *args, **options):
+        from analyzer.models import BoycottCompanies, CompanyCauseTranslation
+
+        for language in options['languages']:
+            if is_canonical(language):
+                raise CommandError(f"Causes are already stored in {language}")
+            current = {
+                company_id for company_id, cause, source in CompanyCauseTranslation.objects
+                .filter(language=language_key(language))
+                .values_list('company_id', 'company__cause', 'source_cause')
+                if cause == source
+            }
+            pending = {}
+            for company_id, cause in BoycottCompanies.objects.exclude(cause__isnull=True).exclude(cause='') \
+                    .values_list('id', 'cause'):
+                if company_id not in current:
+                    pending.setdefault(cause, []).append(company_id)
+
+            causes = list(pending)
+            stored = 0
+            for start in range(0, len(causes), options['batch_size']):
+                batch = causes[start:start + options['batch_size']]
+                translated = asyncio.run(translate(batch, language))
+                for cause, text in zip(batch, translated):
+                    if text == cause:
+                        # Left untranslated; retried on the next run
+                        continue
+                    for company_id in pending[cause]:
+                        CompanyCauseTranslation.objects.update_or_create(
+                            company_id=company_id, language=language_key(language),
+                            defaults={'cause': text, 'source_cause': cause},
+                        )
+                        stored += 1
+            self.stdout.write(self.style.SUCCESS(
+                f"{language}: {stored} causes translated, {len(current)} already up to date"
+            ))
@@ -1,9 +1,12 @@
 from django.db import models
 
+from analyzer.utils.fuzzy_match import normalize_company_name
+
 
 class ProviderCompany(models.Model):
     company_name = models.CharField(max_length=255)
     model_name = models.CharField(max_length=255)
+    prompt_profile = models.CharField(max_length=20, blank=True, help_text="Prompt profile for this model, e.g. compact or verbose; empty for PROMPT_PROFILE")
 
     class Meta:
         verbose_name = 'provider company'
@@ -22,9 +25,47 @@ class ApiKeys(models.Model):
     def __str__(self):
         return self.api_key
 
+class PartnerKey(models.Model):
+    """API key of a partner using the bulk check endpoint, with its quota of names"""
+    name = models.CharField(max_length=255)
+    key = models.CharField(max_length=255, unique=True)
+    names_per_minute = models.PositiveIntegerField(default=60)
+    burst = models.PositiveIntegerField(default=100, help_text="Most names a single request can use, keep it at least BULK_CHECK_MAX_NAMES")
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name = 'Partner Key'
+        verbose_name_plural = 'Partner Keys'
+
+    def __str__(self):
+        return self.name
+
+class BoycottCompaniesQuerySet(models.QuerySet):
+    """Fills normalized_name on bulk writes, which skip save()"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.normalized_name = normalize_company_name(obj.company_name)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'company_name' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.normalized_name = normalize_company_name(obj.company_name)
+            fields = [*fields, 'normalized_name']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 class BoycottCompanies(models.Model):
     company_name = models.CharField(max_length=255)
+    # normalize_company_name(company_name), indexed by the company search backends
+    normalized_name = models.CharField(max_length=255, null=True, blank=True, editable=False)
     cause= models.TextField(null=True, blank=True)
+    parent_company = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='subsidiaries')
+
+    objects = BoycottCompaniesQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Boycott companies'
@@ -33,8 +74,41 @@ class BoycottCompanies(models.Model):
     def __str__(self):
         return self.company_name
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_company_name(self.company_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'company_name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
+
+class CompanyCauseTranslation(models.Model):
+    """Cause of a boycotted company in another language, for the version of the cause it was made from"""
+    company = models.ForeignKey(BoycottCompanies, on_delete=models.CASCADE, related_name='cause_translations')
+    language = models.CharField(max_length=20)
+    cause = models.TextField()
+    source_cause = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        verbose_name = 'Cause translation'
+        verbose_name_plural = 'Cause translations'
+        unique_together = ('company', 'language')
+
+    def save(self, *args, **kwargs):
+        self.language = self.language.strip().lower()
+        if not self.source_cause:
+            self.source_cause = self.company.cause or ''
+        super().save(*args, **kwargs)
+
+    @property
+    def is_current(self):
+        """False once the company cause changed since this translation was made"""
+        return self.source_cause == (self.company.cause or '')
+
+    def __str__(self):
+        return f"{self.company} ({self.language})"
+
 class ProductType(models.Model):
-    product_type = models.CharField(max_length=255)
+    product_type = models.CharField(max_length=255, unique=True)
 
     class Meta:
         verbose_name = 'type'
@@ -58,6 +132,7 @@ class BoycottProducts(models.Model):
 
 class SystemMessage(models.Model):
     name = models.CharField(max_length=100)
+    profile = models.CharField(max_length=20, default='verbose', help_text="Prompt profile this message is used for, e.g. compact or verbose")
     message = models.TextField()
     is_active = models.BooleanField(default=True)
     
@@ -66,12 +141,12 @@ class SystemMessage(models.Model):
         verbose_name_plural = 'System Messages'
     
     def __str__(self):
-        return self.name
+        return f"{self.name} ({self.profile})"
 
 
 
 class AlternativeCompanies(models.Model):
-    company_name = models.CharField(max_length=255)
+    company_name = models.CharField(max_length=255, unique=True)
     description = models.TextField(null=True, blank=True)
     website = models.URLField(null=True, blank=True)
 
@@ -109,3 +184,16 @@ class AlternativeProducts(models.Model):
 
     def __str__(self):
         return self.product_name
+
+
+class CacheVersion(models.Model):
+    """Version of the data behind a worker-local cache, bumped by any process that changes it"""
+    name = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Cache version'
+        verbose_name_plural = 'Cache versions'
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
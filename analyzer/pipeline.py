@@ -0,0 +1,297 @@
+import asyncio
+import base64
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from analyzer.API.message import analyze_img, analyze_company_name
+from analyzer.Boycott import get_alternatives_for_boycott_product, queue_learn_alternative
+from analyzer.utils.admission import AdmissionRejected, admission
+from analyzer.utils import metrics, refresh, translations, verdict_cache
+from analyzer.utils.deadline import Deadline, DeadlineExceeded
+from analyzer.utils.logs import bind_request_id
+from analyzer.utils.popularity import scan_key
+from .imgProcessor import convert_and_resize_image
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_TIMEOUT = 25.0
+# Seconds of the budget kept back from the provider call for the alternatives lookup
+ALTERNATIVES_RESERVE = 1.0
+
+# Requests abandoned because the client disconnected, by pipeline stage
+cancelled_work = Counter()
+metrics.register_collector(metrics.counter_collector(
+    'gaza_cancelled_total', 'Requests abandoned by disconnected clients, by stage', cancelled_work, 'stage',
+))
+
+
+def parse_response(response: str):
+    """
+    response will be as follow: [Company Name, Product Type]
+                        change  [Boycott Status, Company Name, head company name, Product Type] responss head (-) or none
+    """
+    response = response.strip()
+    if response.startswith('['):
+        response = response[1:]
+    if response.endswith(']'):
+        response = response[:-1]
+    if response.endswith('].'):
+        response = response[:-2]
+    try:
+        parts = [part.strip() for part in response.split(',')]
+        return parts[0].lower()== 'true', parts[1], parts[2] if "$" not in parts[2] else None, parts[3], parts[4]
+    except:
+        return False, False, None, None, None
+
+
+def parse_verdict(response_text):
+    with metrics.stage_seconds.time(stage='parse'):
+        return parse_response(response_text)
+
+
+async def localize(texts, language, deadline, admitted):
+    """texts translated into language, or unchanged when translation fails or runs out of time"""
+    if translations.is_canonical(language):
+        return texts
+    try:
+        with metrics.stage_seconds.time(stage='translation'):
+            return await deadline.run(
+                translations.translate(texts, language, deadline, run=lambda call: admitted('text', call)),
+                "translation",
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning("Translation into %s failed, answering in %s: %s", language, settings.VERDICT_LANGUAGE, e)
+        return texts
+
+
+def make_result(status, company="", product_type="", boycott=False, cause="", alternative=None, error=None):
+    """
+    Result of one analysis, independent of how it is sent to the client.
+
+    status is one of: ok, partial, not_recognized, busy, timeout, error.
+    partial is a verdict whose alternatives could not be looked up in time.
+    alternative is None when no alternative frame should be sent.
+    """
+    return {
+        'status': status,
+        'company': company,
+        'product_type': product_type,
+        'boycott': boycott,
+        'cause': cause,
+        'alternative': alternative,
+        'error': error,
+    }
+
+
+async def run_analysis(data, on_verdict=None, client_key=None, on_queue=None, deadline=None):
+    """
+    Run the analysis pipeline for one validated request and return its result dict,
+    recording its total time and result status. See _analyze for the arguments.
+    """
+    with metrics.stage_seconds.time(stage='total'):
+        result = await _analyze(data, on_verdict, client_key, on_queue, deadline)
+    metrics.requests_total.inc(status=result['status'])
+    return result
+
+
+async def _analyze(data, on_verdict, client_key, on_queue, deadline):
+    """
+    The analysis pipeline for one validated request.
+
+    on_verdict, if given, is awaited with the partial result as soon as the
+    verdict is known, before alternatives are looked up.
+    client_key is the fairness key for admission control (e.g. client IP) and
+    on_queue is awaited with (position, expected wait) while the LLM call is queued.
+    deadline bounds the whole request, by default ANALYSIS_TIMEOUT from now. Every
+    stage gets what is left of it; when it runs out after the verdict is known,
+    the verdict is returned without alternatives.
+    """
+    image_data = data.get('image_data', None)
+    company_name_input = data.get('company_name', None)
+
+    country = data.get('country', None)
+    if not country:
+        logger.info("User country: NO COUNTRY..!")
+
+    language = data.get('language', 'English')
+
+    # Stage the request is in, to count cancelled work by stage
+    stage = 'admission'
+    cancel_event = threading.Event()
+
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_TIMEOUT)
+    # Stages up to the verdict leave time for the lookups after it
+    verdict_deadline = deadline.reserving(ALTERNATIVES_RESERVE)
+
+    async def admitted(cost_class, call, on_position=on_queue):
+        nonlocal stage
+        queued = time.perf_counter()
+        async with admission.admit(client_key or 'anonymous', cost_class, verdict_deadline.expires_at, on_position):
+            metrics.stage_seconds.observe(time.perf_counter() - queued, stage='admission_wait')
+            stage = 'provider_call'
+            return await call()
+
+    async def analyze_verdict(cost_class, call, stage_name, on_position):
+        # The provider call of this request, which concurrent requests for the
+        # same verdict wait for too (see verdict_cache.get_or_analyze)
+        response_text = await verdict_deadline.run(admitted(cost_class, call, on_position), stage_name)
+        logger.info("Response of the %s: %s", stage_name, response_text)
+        return parse_verdict(response_text)
+
+    def get_verdict(key, analyze, on_stale):
+        return verdict_cache.get_or_analyze(key, analyze, on_stale, deadline=verdict_deadline, on_queue=on_queue)
+
+    try:
+        resized_base64 = None
+        if company_name_input:
+            # Handle text-based company name analysis
+            analyze_name = functools.partial(
+                analyze_verdict, 'text',
+                lambda: analyze_company_name(company_name_input, settings.VERDICT_LANGUAGE, verdict_deadline),
+                "company analysis",
+            )
+            key = verdict_cache.text_key(company_name_input)
+            on_stale = refresh.track(key, ('text', company_name_input))
+            stage = 'verdict'
+            verdict = await get_verdict(key, analyze_name, on_stale)
+        else:
+            # Handle image-based analysis
+            # Extract base64 data from data URL
+            if image_data.startswith('data:image/'):
+                base64_data = image_data.split(',')[1]
+            else:
+                base64_data = image_data
+
+            with metrics.stage_seconds.time(stage='decode'):
+                file_bytes = base64.b64decode(base64_data)
+            stage = 'resize'
+            with metrics.stage_seconds.time(stage='resize'):
+                resized_base64, ext, saved_filename, image_hash = await asyncio.to_thread(
+                    convert_and_resize_image, file_bytes, max_size=(800, 800), quality=70,
+                    cancel_event=cancel_event, deadline=verdict_deadline,
+                )
+
+            image_url = f"data:image/{ext};base64,{resized_base64}"
+            analyze_image = functools.partial(
+                analyze_verdict, 'image',
+                lambda: analyze_img(image_url, settings.VERDICT_LANGUAGE, verdict_deadline),
+                "image analysis",
+            )
+            digest = saved_filename.rsplit('.', 1)[0]
+            # Verdicts are cached by the exact image, popularity by what the image looks like
+            on_stale = refresh.track(scan_key(digest, image_hash), ('image', digest), resized_base64)
+            stage = 'verdict'
+            verdict = await get_verdict(verdict_cache.image_key(digest), analyze_image, on_stale)
+
+        boycott_status, company_name, company_parent_name, product_type, cause = verdict
+        logger.info("Verdict: %s, %s, %s", company_name, company_parent_name, product_type)
+
+        if not company_name:
+            return make_result(
+                'not_recognized',
+                company="Company NOT recognized" if company_name_input else "Image NOT recognized",
+                alternative="",
+                error="Invalid response format" if company_name_input else "Invalid image or response format",
+            )
+
+        # Lookups use the canonical product type, the client reads the translated label
+        stage = 'translation'
+        cause_label, product_type_label = await localize([cause, product_type], language, verdict_deadline, admitted)
+
+        if on_verdict:
+            await on_verdict(make_result(
+                'ok', company=company_name, product_type=product_type_label,
+                boycott=boycott_status, cause=cause_label,
+            ))
+
+        if boycott_status:
+            stage = 'db_lookup'
+            try:
+                with metrics.stage_seconds.time(stage='alternatives_lookup'):
+                    alternatives = await deadline.run(
+                        get_alternatives_for_boycott_product(product_type, country=country, deadline=deadline),
+                        "alternatives lookup",
+                    )
+            except DeadlineExceeded:
+                metrics.timeouts_total.inc(stage=stage)
+                alternatives = None
+            if alternatives is None:
+                logger.warning("Out of time for alternatives, returning the verdict alone")
+                return make_result(
+                    'partial', company=company_name, product_type=product_type_label,
+                    boycott=boycott_status, cause=cause_label,
+                )
+        else:
+            alternatives = ""
+            # Learning the product as an alternative happens in the background
+            queue_learn_alternative(company_name, product_type, resized_base64, country)
+
+        return make_result(
+            'ok', company=company_name, product_type=product_type_label,
+            boycott=boycott_status, cause=cause_label, alternative=alternatives,
+        )
+
+    except asyncio.CancelledError:
+        # Client disconnected: stop thread work that checks cancel_event and
+        # skip the remaining stages, including learning the alternative
+        cancel_event.set()
+        cancelled_work[stage] += 1
+        logger.info("Analysis cancelled during %s", stage)
+        raise
+    except AdmissionRejected as e:
+        return make_result('busy', company="Server busy", error=str(e))
+    except asyncio.TimeoutError as e:
+        # Includes DeadlineExceeded from any stage before the verdict
+        logger.warning("Analysis timed out during %s: %s", stage, e)
+        metrics.timeouts_total.inc(stage=stage)
+        return make_result('timeout', company="Timed out: Try again", error="Request timed out")
+    except Exception as e:
+        logger.error("Error processing request: %s", e)
+        metrics.errors_total.inc(stage=stage)
+        return make_result('error', company="Error: Try again", error="Processing error")
+
+
+async def check_names(names, country=None, language='English', client_key=None, concurrency=4):
+    """
+    Analyze company names concurrently, yielding (index, name, result) as each completes.
+
+    Repeated names (ignoring case and surrounding spaces) are analyzed once and
+    yielded for every index they appear at. At most `concurrency` analyses run
+    at once; each gets its own ANALYSIS_TIMEOUT deadline when it starts.
+    Closing the generator cancels the analyses still running.
+    """
+    indices = {}
+    for index, name in enumerate(names):
+        indices.setdefault(name.strip().lower(), []).append(index)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    batch_id = bind_request_id()
+
+    async def check(key):
+        name = names[indices[key][0]]
+        # Logs of each name carry "<batch id>.<index of its first occurrence>"
+        bind_request_id(f"{batch_id}.{indices[key][0]}")
+        async with semaphore:
+            result = await run_analysis(
+                {'company_name': name, 'country': country, 'language': language},
+                client_key=client_key, deadline=Deadline(ANALYSIS_TIMEOUT),
+            )
+        return key, result
+
+    tasks = [asyncio.ensure_future(check(key)) for key in indices]
+    try:
+        for future in asyncio.as_completed(tasks):
+            key, result = await future
+            for index in indices[key]:
+                yield index, names[index], result
+    finally:
+        for task in tasks:
+            task.cancel()
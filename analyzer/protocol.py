@@ -0,0 +1,113 @@
+"""
+Wire formats for AnalyzeConsumer results.
+
+legacy: one JSON text frame per field (company, product_type, boycott,
+        cause, alternative) followed by done. Used by old app versions.
+v2:     one result envelope per analysis, as compact JSON text frames or
+        MessagePack binary frames. In streaming mode the verdict is sent as
+        soon as it is known and the rest follows as a field level delta.
+
+v2 is negotiated with the WebSocket subprotocols gaza.v2+json and
+gaza.v2+msgpack, or with ?protocol=v2&format=json|msgpack for clients
+that cannot set subprotocols. ?stream=1 enables streaming deltas.
+MessagePack needs the optional msgpack package; without it v2 uses JSON.
+"""
+import json
+from collections import Counter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LEGACY = 'legacy'
+V2 = 'v2'
+
+SUBPROTOCOLS = {
+    'gaza.v2+msgpack': (V2, 'msgpack'),
+    'gaza.v2+json': (V2, 'json'),
+}
+
+# Fields of a result envelope, in the order they are streamed
+VERDICT_FIELDS = ('status', 'company', 'product_type', 'boycott', 'cause', 'error')
+RESULT_FIELDS = VERDICT_FIELDS + ('alternatives',)
+
+# Frames and bytes sent per protocol, for comparing legacy and v2 traffic
+wire_stats = Counter()
+
+
+def negotiate(subprotocols, query):
+    """
+    Pick the protocol for a connection.
+
+    Returns:
+        tuple: (protocol, format, subprotocol to accept or None)
+    """
+    for subprotocol in subprotocols or ():
+        if subprotocol in SUBPROTOCOLS:
+            protocol, fmt = SUBPROTOCOLS[subprotocol]
+            if fmt == 'msgpack' and msgpack is None:
+                continue
+            return protocol, fmt, subprotocol
+
+    if query.get('protocol') == V2:
+        fmt = 'msgpack' if query.get('format') == 'msgpack' and msgpack is not None else 'json'
+        return V2, fmt, None
+    return LEGACY, 'json', None
+
+
+def encode(frame, fmt):
+    """Serialize a frame; returns (text_data, bytes_data) with one of them None"""
+    if fmt == 'msgpack':
+        return None, msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame, separators=(',', ':')), None
+
+
+def encode_legacy(frame):
+    return json.dumps(frame), None
+
+
+def decode(text_data, bytes_data, fmt):
+    if text_data is not None:
+        return json.loads(text_data)
+    if fmt == 'msgpack':
+        return msgpack.unpackb(bytes_data, raw=False)
+    return json.loads(bytes_data.decode('utf-8'))
+
+
+def result_fields(result):
+    """Envelope fields of a pipeline result, leaving out empty values"""
+    fields = {
+        'status': result['status'],
+        'company': result['company'],
+        'product_type': result['product_type'],
+        'boycott': result['boycott'],
+        'cause': result['cause'],
+        'error': result['error'],
+        'alternatives': result['alternative'],
+    }
+    return {key: value for key, value in fields.items() if value not in (None, '', (), [])}
+
+
+def result_envelope(result, request_id=None):
+    envelope = {'type': 'result'}
+    if request_id is not None:
+        envelope['request_id'] = request_id
+    envelope.update(result_fields(result))
+    return envelope
+
+
+def result_delta(fields, sent, request_id=None, done=False):
+    """
+    Delta frame with the fields that differ from what was already sent.
+
+    `sent` holds the fields sent so far for the request and is updated.
+    """
+    changed = {key: value for key, value in fields.items() if sent.get(key, None) != value}
+    sent.update(changed)
+    delta = {'type': 'delta', 'fields': changed}
+    if request_id is not None:
+        delta['request_id'] = request_id
+    if done:
+        delta['done'] = True
+    return delta
@@ -0,0 +1,12 @@
+from django.conf import settings
+from rest_framework import serializers
+
+
+class BulkCheckSerializer(serializers.Serializer):
+    names = serializers.ListField(
+        child=serializers.CharField(min_length=2, max_length=100),
+        allow_empty=False,
+        max_length=settings.BULK_CHECK_MAX_NAMES,
+    )
+    country = serializers.CharField(max_length=50, required=False, allow_blank=True)
+    language = serializers.CharField(max_length=20, required=False, default='English')
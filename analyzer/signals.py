@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, Country, ProductType, SystemMessage
+from analyzer.utils.cache_sync import invalidate_alternatives
+
+CountryLinks = AlternativeProducts.countries.through
+
+
+def _countries_of_products(product_ids):
+    return set(
+        CountryLinks.objects.filter(alternativeproducts_id__in=list(product_ids))
+        .values_list('country_id', flat=True)
+    )
+
+
+def _invalidate_on_commit(country_ids):
+    country_ids = set(country_ids)
+    if country_ids:
+        transaction.on_commit(lambda: invalidate_alternatives(country_ids))
+
+
+@receiver(post_save, sender=AlternativeProducts)
+def alternative_product_saved(sender, instance, **kwargs):
+    _invalidate_on_commit(_countries_of_products([instance.pk]))
+
+
+@receiver(pre_delete, sender=AlternativeProducts)
+def alternative_product_deleting(sender, instance, **kwargs):
+    instance._cached_country_ids = _countries_of_products([instance.pk])
+
+
+@receiver(post_delete, sender=AlternativeProducts)
+def alternative_product_deleted(sender, instance, **kwargs):
+    _invalidate_on_commit(getattr(instance, '_cached_country_ids', ()))
+
+
+@receiver(post_save, sender=AlternativeCompanies)
+def alternative_company_saved(sender, instance, **kwargs):
+    product_ids = instance.products.values_list('id', flat=True)
+    _invalidate_on_commit(_countries_of_products(product_ids))
+
+
+@receiver(post_save, sender=ProductType)
+def product_type_saved(sender, instance, **kwargs):
+    product_ids = instance.alternatives.values_list('id', flat=True)
+    _invalidate_on_commit(_countries_of_products(product_ids))
+
+
+@receiver(m2m_changed, sender=CountryLinks)
+def alternative_countries_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Every entry lists all countries of its product, so a change to the
+    link table affects every country the touched products are sold in.
+    """
+    if action not in ('pre_clear', 'post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # instance is a Country, pk_set holds product ids
+        product_ids = set(pk_set or ()) if action != 'pre_clear' else set(
+            instance.alternative_products.values_list('id', flat=True)
+        )
+        country_ids = {instance.pk}
+    else:
+        product_ids = {instance.pk}
+        country_ids = set(pk_set or ())
+
+    if action == 'pre_clear':
+        instance._cached_country_ids = country_ids | _countries_of_products(product_ids)
+        return
+    if action == 'post_clear':
+        _invalidate_on_commit(getattr(instance, '_cached_country_ids', country_ids))
+        return
+    _invalidate_on_commit(country_ids | _countries_of_products(product_ids))
+
+
+@receiver(post_save, sender=Country)
+def country_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_alternatives(country_names=True))
+
+
+@receiver(post_delete, sender=Country)
+def country_deleted(sender, instance, **kwargs):
+    country_id = instance.pk
+    transaction.on_commit(lambda: invalidate_alternatives(dropped=[country_id]))
+
+
+@receiver(post_save, sender=SystemMessage)
+@receiver(post_delete, sender=SystemMessage)
+def system_message_changed(sender, instance, **kwargs):
+    # Other workers pick the change up when their PROMPT_CACHE_SECONDS run out
+    from analyzer.API.message import invalidate_system_messages
+    transaction.on_commit(invalidate_system_messages)
@@ -0,0 +1,139 @@
+"""
+Startup warm-up, run before a worker accepts traffic.
+
+Under Uvicorn (`--lifespan on`) it runs in the ASGI lifespan startup, and
+the worker only starts accepting connections when it is done. Under Daphne,
+which has no lifespan support, image_analyzer.asgi runs it while the
+application is imported, before the server listens. Every step is
+best-effort: a failing step is logged and the worker starts anyway.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+_warmed = threading.Event()
+_lock = threading.Lock()
+
+
+def _warm_alternatives():
+    from analyzer.utils.alternatives_cache import alternatives_cache
+    alternatives_cache.prewarm()
+
+
+def _warm_prompts():
+    from analyzer.API.message import load_system_message
+    from analyzer.API.prompts import PROMPTS
+    from analyzer.models import ProviderCompany
+
+    profiles = {settings.PROMPT_PROFILE}
+    profiles.update(ProviderCompany.objects.exclude(prompt_profile='').values_list('prompt_profile', flat=True))
+    for name in PROMPTS:
+        for profile in profiles:
+            load_system_message(name, profile)
+
+
+def _warm_company_index():
+    from analyzer.utils.company_search import candidates
+    candidates(['warm up'])
+
+
+def _warm_key():
+    from analyzer.API.API_keys import warm_active_key
+    warm_active_key()
+
+
+def _warm_read_connections():
+    """Open the database connection of every read executor thread"""
+    from analyzer.utils.db_executor import read_executor
+
+    workers = settings.DB_READ_WORKERS
+    # The barrier keeps each task on its own thread until all have connected
+    barrier = threading.Barrier(workers)
+
+    def connect():
+        connection.ensure_connection()
+        barrier.wait(timeout=10)
+
+    for future in [read_executor.submit(connect) for _ in range(workers)]:
+        future.result()
+
+
+STEPS = (
+    ('read_connections', _warm_read_connections),
+    ('alternatives', _warm_alternatives),
+    ('prompts', _warm_prompts),
+    ('company_index', _warm_company_index),
+    ('api_key', _warm_key),
+)
+
+
+def check_configuration():
+    """Raise ImproperlyConfigured for settings the server cannot run without"""
+    from analyzer.utils.image_store import check_public_base_url
+    check_public_base_url()
+
+
+def warm_up():
+    """Run the warm-up steps once per process; blocking, call it from a thread inside an event loop"""
+    if not settings.WARMUP_ENABLED:
+        return
+    with _lock:
+        if _warmed.is_set():
+            return
+        start = time.perf_counter()
+        timings = []
+        for name, step in STEPS:
+            step_start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning("Warm-up step %s failed: %s", name, e)
+            timings.append(f"{name} {(time.perf_counter() - step_start) * 1000:.0f} ms")
+        close_old_connections()
+        _warmed.set()
+        logger.info("Warm-up done in %.0f ms (%s)", (time.perf_counter() - start) * 1000, ', '.join(timings))
+
+
+def start_background_tasks():
+    """Start the background tasks of this worker on the running loop; cheap to call again"""
+    from analyzer.utils.cache_sync import ensure_listener
+    ensure_listener()
+
+
+def with_background_tasks(app):
+    """
+    ASGI middleware starting the background tasks on the first connection
+    of any protocol, for servers without lifespan support (Daphne).
+    """
+    async def middleware(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            start_background_tasks()
+        return await app(scope, receive, send)
+    return middleware
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan app: warm up and start the background tasks before the server accepts connections"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.to_thread(warm_up)
+            start_background_tasks()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from django.core.cache import cache
+
+from analyzer import pipeline
+from analyzer.utils import company_search
+from analyzer.utils.alternatives_cache import alternatives_cache
+
+PROVIDER_RESPONSE = "[True, Acme, $, Coffee, Occupation profits]"
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    """Every test writes images and catalogs to its own MEDIA_ROOT"""
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    return tmp_path / 'media'
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    """Module level caches must not carry state from one test to the next"""
+    cache.clear()
+    alternatives_cache.clear()
+    alternatives_cache._version = None
+    alternatives_cache._version_checked_at = None
+    company_search._state.update(backend=None, checked_at=None, available=False)
+    yield
+    cache.clear()
+    alternatives_cache.clear()
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Replaces the LLM call; records the deadline each call was given"""
+    calls = []
+
+    class Provider:
+        latency = 0.0
+        response = PROVIDER_RESPONSE
+
+        async def analyze(self, company_name, language, deadline):
+            calls.append(deadline)
+            await asyncio.sleep(self.latency)
+            return self.response
+
+    fake = Provider()
+    fake.calls = calls
+    monkeypatch.setattr(pipeline, 'analyze_company_name', fake.analyze)
+    return fake
+
+
+@pytest.fixture
+def alternatives(monkeypatch):
+    """Replaces the alternatives lookup; records the deadline each lookup was given"""
+
+    class Lookup:
+        latency = 0.0
+
+        def __init__(self):
+            self.deadlines = []
+
+        async def get(self, product_type, country=None, deadline=None):
+            self.deadlines.append(deadline)
+            await asyncio.sleep(self.latency)
+            return [{'product_name': 'Local Coffee'}]
+
+    lookup = Lookup()
+    monkeypatch.setattr(pipeline, 'get_alternatives_for_boycott_product', lookup.get)
+    return lookup
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+
+from analyzer.utils.admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(capacity=1, max_queue=10):
+    return AdmissionController(capacity=capacity, max_queue=max_queue, costs={'text': 1, 'image': 2})
+
+
+async def hold(controller, client_key, order, release, cost_class='text', **options):
+    async with controller.admit(client_key, cost_class, **options):
+        order.append(client_key)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_admits_while_capacity_is_free():
+    controller = make_controller(capacity=2)
+    async with controller.admit('a', 'text'):
+        async with controller.admit('b', 'text'):
+            assert controller._in_use == 2
+    assert controller._in_use == 0
+    assert controller.stats['admitted'] == 2
+
+
+async def test_clients_are_served_round_robin():
+    controller = make_controller()
+    order = []
+    release = asyncio.Event()
+    release.set()
+    blocker = asyncio.Event()
+
+    running = asyncio.ensure_future(hold(controller, 'first', order, blocker))
+    await settle()
+    # 'busy' queues three requests before 'quiet' sends its one
+    tasks = [asyncio.ensure_future(hold(controller, 'busy', order, release)) for _ in range(3)]
+    await settle()
+    tasks.append(asyncio.ensure_future(hold(controller, 'quiet', order, release)))
+    await settle()
+
+    blocker.set()
+    await asyncio.gather(running, *tasks)
+    assert order == ['first', 'busy', 'quiet', 'busy', 'busy']
+
+
+async def test_full_queue_rejects_at_once():
+    controller = make_controller(max_queue=1)
+    blocker = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, 'a', [], blocker))
+    queued = asyncio.ensure_future(hold(controller, 'b', [], blocker))
+    await settle()
+
+    with pytest.raises(AdmissionRejected):
+        async with controller.admit('c', 'text'):
+            pass
+    assert controller.stats['rejected_queue_full'] == 1
+
+    blocker.set()
+    await asyncio.gather(running, queued)
+
+
+async def test_request_that_cannot_start_before_its_deadline_is_shed():
+    controller = make_controller()
+    blocker = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, 'a', [], blocker))
+    await settle()
+
+    # The default service time is 5 seconds, far beyond this deadline
+    with pytest.raises(AdmissionRejected):
+        async with controller.admit('b', 'text', deadline=time.monotonic() + 1):
+            pass
+    assert controller.stats['rejected_deadline'] == 1
+
+    blocker.set()
+    await running
+
+
+async def test_cancelled_request_leaves_the_queue():
+    controller = make_controller()
+    order = []
+    blocker = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, 'a', order, blocker))
+    cancelled = asyncio.ensure_future(hold(controller, 'b', order, blocker))
+    await settle()
+    assert controller._queued == 1
+
+    cancelled.cancel()
+    await settle()
+    assert controller._queued == 0
+
+    blocker.set()
+    await running
+    assert order == ['a']
+    assert controller._in_use == 0
+
+
+async def test_queued_requests_hear_their_position():
+    controller = make_controller()
+    blocker = asyncio.Event()
+    positions = []
+
+    async def on_position(position, wait):
+        positions.append(position)
+
+    running = asyncio.ensure_future(hold(controller, 'a', [], blocker))
+    await settle()
+    queued = asyncio.ensure_future(hold(controller, 'b', [], blocker, on_position=on_position))
+    await settle()
+
+    assert positions == [1]
+    blocker.set()
+    await asyncio.gather(running, queued)
+
+
+async def test_image_requests_cost_more():
+    controller = make_controller(capacity=2)
+    order = []
+    blocker = asyncio.Event()
+    text = asyncio.ensure_future(hold(controller, 'a', order, blocker))
+    await settle()
+    image = asyncio.ensure_future(hold(controller, 'b', order, blocker, cost_class='image'))
+    await settle()
+
+    # One unit is free, the image needs two
+    assert order == ['a']
+    blocker.set()
+    await asyncio.gather(text, image)
+    assert order == ['a', 'b']
@@ -0,0 +1,137 @@
+import time
+
+import pytest
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, CacheVersion, Country, ProductType
+from analyzer.utils import cache_sync
+from analyzer.utils.alternatives_cache import AlternativesSnapshotCache
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def jordan():
+    country = Country.objects.create(name='Jordan')
+    add_product(country, 'Local Coffee')
+    return country
+
+
+def add_product(country, name, product_type='Coffee'):
+    """Writes the way another process would: no signals, no invalidation here"""
+    company, _ = AlternativeCompanies.objects.get_or_create(company_name='Local Roasters')
+    type_, _ = ProductType.objects.get_or_create(product_type=product_type)
+    (product,) = AlternativeProducts.objects.bulk_create([
+        AlternativeProducts(product_name=name, company_name=company, product_type=type_),
+    ])
+    AlternativeProducts.countries.through.objects.create(alternativeproducts_id=product.id, country_id=country.id)
+
+
+def bump_from_another_process():
+    CacheVersion.objects.get_or_create(name=cache_sync.VERSION_NAME)
+    CacheVersion.objects.filter(name=cache_sync.VERSION_NAME).update(version=cache_sync.current_version() + 1)
+
+
+def names(entries):
+    return sorted(entry['product_name'] for entry in entries)
+
+
+def test_lookup_by_country_and_similar_type(jordan):
+    cache = AlternativesSnapshotCache()
+    assert names(cache.get('Jordan', 'coffee')) == ['Local Coffee']
+    assert cache.get('Jordan', 'coffee')[0]['is_exact_match']
+    assert cache.get('Atlantis', 'coffee') == ()
+
+
+def test_entries_are_read_only(jordan):
+    (entry,) = AlternativesSnapshotCache().get('Jordan', 'Coffee')
+    with pytest.raises(TypeError):
+        entry['product_name'] = 'Changed'
+
+
+def test_spellings_of_a_type_share_one_match(jordan, monkeypatch):
+    from analyzer.utils import fuzzy_match
+
+    add_product(jordan, 'Local Soda', product_type='Soft Drinks')
+    compared = []
+    similar = fuzzy_match.is_similar_product_type
+
+    def recording(requested, bucket_type):
+        compared.append(requested)
+        return similar(requested, bucket_type)
+
+    monkeypatch.setattr(fuzzy_match, 'is_similar_product_type', recording)
+    snapshot = AlternativesSnapshotCache().snapshot('Jordan')
+    first = snapshot.lookup('  Soft   DRINK ')
+
+    # Matched with the canonical type it is memoized under, not the spelling asked first
+    assert set(compared) == {'soft drink'}
+    assert snapshot.lookup('soft drink') is first
+    assert names(first) == ['Local Soda']
+
+
+def test_invalidated_country_is_rebuilt(jordan):
+    cache = AlternativesSnapshotCache()
+    cache.prewarm()
+    add_product(jordan, 'Fresh Coffee')
+    assert names(cache.get('Jordan', 'Coffee')) == ['Local Coffee']
+
+    cache.invalidate_countries([jordan.id])
+    assert names(cache.get('Jordan', 'Coffee')) == ['Fresh Coffee', 'Local Coffee']
+
+
+def test_snapshot_older_than_max_age_is_rebuilt(jordan):
+    cache = AlternativesSnapshotCache(max_age=0.05)
+    cache.prewarm()
+    add_product(jordan, 'Fresh Coffee')
+    assert names(cache.get('Jordan', 'Coffee')) == ['Local Coffee']
+
+    time.sleep(0.1)
+    assert names(cache.get('Jordan', 'Coffee')) == ['Fresh Coffee', 'Local Coffee']
+
+
+def test_version_bump_from_another_process_rebuilds_snapshots(jordan):
+    cache = AlternativesSnapshotCache(version_check_interval=0)
+    cache.prewarm()
+    add_product(jordan, 'Fresh Coffee')
+    assert names(cache.get('Jordan', 'Coffee')) == ['Local Coffee']
+
+    bump_from_another_process()
+    assert names(cache.get('Jordan', 'Coffee')) == ['Fresh Coffee', 'Local Coffee']
+
+
+def test_version_is_read_at_most_every_interval(jordan):
+    cache = AlternativesSnapshotCache(version_check_interval=60)
+    cache.prewarm()
+    add_product(jordan, 'Fresh Coffee')
+    bump_from_another_process()
+    assert names(cache.get('Jordan', 'Coffee')) == ['Local Coffee']
+
+
+def test_new_country_from_another_process_is_found(jordan):
+    cache = AlternativesSnapshotCache(version_check_interval=0)
+    cache.prewarm()
+    egypt = Country.objects.create(name='Egypt')
+    add_product(egypt, 'Cairo Coffee')
+    bump_from_another_process()
+    assert names(cache.get('Egypt', 'Coffee')) == ['Cairo Coffee']
+
+
+def test_own_bump_keeps_the_snapshots(jordan):
+    cache = AlternativesSnapshotCache(version_check_interval=0)
+    cache.prewarm()
+    snapshot = cache.snapshot('Jordan')
+
+    bump_from_another_process()
+    cache.saw_version(cache_sync.current_version())
+    assert cache.snapshot('Jordan') is snapshot
+
+
+def test_own_bump_after_a_missed_one_still_rebuilds(jordan):
+    cache = AlternativesSnapshotCache(version_check_interval=0)
+    cache.prewarm()
+    snapshot = cache.snapshot('Jordan')
+
+    bump_from_another_process()
+    bump_from_another_process()
+    cache.saw_version(cache_sync.current_version())
+    assert cache.snapshot('Jordan') is not snapshot
@@ -0,0 +1,81 @@
+import pytest
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, Country, ProductType
+from analyzer.utils.alternatives_cache import alternatives_cache
+
+pytestmark = pytest.mark.django_db
+
+URL = '/api/alternatives/'
+
+
+@pytest.fixture
+def jordan():
+    country = Country.objects.create(name='Jordan')
+    company = AlternativeCompanies.objects.create(company_name='Local Roasters')
+    coffee = ProductType.objects.create(product_type='Coffee')
+    for index in range(3):
+        product = AlternativeProducts.objects.create(
+            product_name=f'Local Coffee {index}', company_name=company, product_type=coffee,
+        )
+        product.countries.add(country)
+    return country
+
+
+def get(client, etag=None, **params):
+    params = {'country': 'Jordan', 'product_type': 'Coffee', **params}
+    headers = {'HTTP_IF_NONE_MATCH': etag} if etag is not None else {}
+    return client.get(URL, params, **headers)
+
+
+def test_alternatives_are_paginated_and_cacheable(client, jordan, settings):
+    response = get(client, page_size=2)
+
+    assert response.status_code == 200
+    assert response.json()['count'] == 3
+    assert len(response.json()['results']) == 2
+    assert response['Cache-Control'] == f"public, max-age={settings.ALTERNATIVES_CACHE_MAX_AGE}"
+    assert response['ETag'].startswith('"') and response['ETag'].endswith('"')
+
+
+def test_missing_parameters_are_refused(client):
+    assert client.get(URL, {'country': 'Jordan'}).status_code == 400
+
+
+def test_matching_tag_is_not_modified(client, jordan):
+    etag = get(client)['ETag']
+
+    response = get(client, etag=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+    assert get(client, etag=f'"other", {etag}').status_code == 304
+
+
+@pytest.mark.parametrize('header', [
+    lambda etag: f'W/{etag}',
+    lambda etag: etag[:-1] + 'x"',
+    lambda etag: f'"prefix-{etag[1:]}',
+    lambda etag: etag.strip('"'),
+])
+def test_weak_or_partial_tags_do_not_match(client, jordan, header):
+    etag = get(client)['ETag']
+    assert get(client, etag=header(etag)).status_code == 200
+
+
+def test_pages_and_product_types_have_their_own_tags(client, jordan):
+    first = get(client, page_size=2)['ETag']
+    second = get(client, page_size=2, page=2)['ETag']
+    milk = get(client, product_type='Milk')['ETag']
+
+    assert len({first, second, milk}) == 3
+    # The tag of one page does not revalidate another
+    assert get(client, etag=first, page_size=2, page=2).status_code == 200
+
+
+def test_tag_changes_with_the_data(client, jordan):
+    before = get(client)['ETag']
+    AlternativeProducts.objects.first().delete()
+    alternatives_cache.invalidate_countries([jordan.id])
+
+    response = get(client, etag=before)
+    assert response.status_code == 200
+    assert response['ETag'] != before
@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from analyzer import pipeline
+from analyzer.models import PartnerKey
+from analyzer.pipeline import make_result
+
+URL = '/api/check/'
+
+
+@pytest.fixture
+def analyses(monkeypatch):
+    """Replaces run_analysis; records the names analyzed"""
+    names = []
+
+    async def run_analysis(data, on_verdict=None, client_key=None, on_queue=None, deadline=None):
+        names.append((data['company_name'], client_key))
+        await asyncio.sleep(0)
+        return make_result('ok', company=data['company_name'], product_type='Coffee', boycott=True,
+                           cause='cause', alternative=[])
+
+    monkeypatch.setattr(pipeline, 'run_analysis', run_analysis)
+    return names
+
+
+@pytest.fixture
+def partner(db):
+    return PartnerKey.objects.create(name='Grocer', key='partner-key', names_per_minute=60, burst=10)
+
+
+def post(client, body, key='partner-key'):
+    headers = {'HTTP_X_API_KEY': key} if key else {}
+    return client.post(URL, json.dumps(body), content_type='application/json', **headers)
+
+
+async def read(streaming_content):
+    return b''.join([chunk async for chunk in streaming_content])
+
+
+def lines(response):
+    # The response streams from an async generator, as under ASGI
+    return [json.loads(line) for line in async_to_sync(read)(response.streaming_content).decode('utf-8').splitlines()]
+
+
+def test_results_stream_as_ndjson_one_line_per_name(client, partner, analyses):
+    response = post(client, {'names': ['Acme', 'Other Brand', ' ACME '], 'country': 'Jordan'})
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/x-ndjson'
+    results = sorted(lines(response), key=lambda line: line['index'])
+    assert [(line['index'], line['name']) for line in results] == [(0, 'Acme'), (1, 'Other Brand'), (2, 'ACME')]
+    assert results[0] == {
+        'index': 0, 'name': 'Acme', 'status': 'ok', 'company': 'Acme', 'product_type': 'Coffee',
+        'boycott': True, 'cause': 'cause',
+    }
+    # Repeated names are analyzed once, under the partner's admission key
+    assert sorted(analyses) == [('Acme', f'partner:{partner.pk}'), ('Other Brand', f'partner:{partner.pk}')]
+
+
+@pytest.mark.parametrize('key', [None, 'wrong-key'])
+def test_requests_need_an_active_partner_key(client, partner, analyses, key):
+    assert post(client, {'names': ['Acme']}, key=key).status_code in (401, 403)
+    assert analyses == []
+
+
+def test_inactive_partner_is_refused(client, partner, analyses):
+    partner.is_active = False
+    partner.save()
+    assert post(client, {'names': ['Acme']}).status_code in (401, 403)
+
+
+@pytest.mark.parametrize('body', [{'names': []}, {'names': ['A']}, {'country': 'Jordan'}])
+def test_invalid_bodies_are_refused(client, partner, analyses, body):
+    assert post(client, body).status_code == 400
+
+
+def test_every_name_counts_against_the_quota(client, partner, analyses):
+    partner.burst = 3
+    partner.save()
+
+    assert post(client, {'names': ['Acme', 'Other Brand']}).status_code == 200
+    assert post(client, {'names': ['Third Brand', 'Fourth Brand']}).status_code == 429
+
+
+async def test_check_names_limits_concurrency_and_cancels_on_close(monkeypatch):
+    running = []
+    most = []
+    cancelled = []
+    release = asyncio.Event()
+
+    async def run_analysis(data, **kwargs):
+        running.append(data['company_name'])
+        most.append(len(running))
+        try:
+            if data['company_name'] != 'Quick':
+                await release.wait()
+        except asyncio.CancelledError:
+            cancelled.append(data['company_name'])
+            raise
+        finally:
+            running.remove(data['company_name'])
+        return make_result('ok', company=data['company_name'])
+
+    monkeypatch.setattr(pipeline, 'run_analysis', run_analysis)
+    results = pipeline.check_names(['Quick', 'Slow One', 'Slow Two', 'Slow Three'], concurrency=2)
+
+    index, name, result = await results.__anext__()
+    assert (index, name, result['company']) == (0, 'Quick', 'Quick')
+    await results.aclose()
+    while running:
+        await asyncio.sleep(0.01)
+
+    assert max(most) <= 2
+    assert cancelled
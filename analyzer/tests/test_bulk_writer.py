@@ -0,0 +1,150 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import pytest
+from django.conf import settings
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, Country
+from analyzer.utils import cache_sync
+from analyzer.utils.alternatives_cache import alternatives_cache
+from analyzer.utils.bulk_writer import AlternativeBulkWriter, alternative_description
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Replaces the database write and the invalidation; records the items of each flush"""
+    flushed = []
+    monkeypatch.setattr(cache_sync, 'invalidate_alternatives', lambda *args, **kwargs: None)
+
+    def write(items):
+        flushed.append(dict(items))
+        return set()
+
+    return flushed, write
+
+
+def make_writer(writes, **options):
+    writer = AlternativeBulkWriter(**{'flush_size': 10, 'flush_interval': 60, **options})
+    writer._write = writes[1]
+    return writer
+
+
+def test_duplicates_are_buffered_once(writes):
+    writer = make_writer(writes)
+    writer.add('Local Roasters', 'Coffee', 'Jordan', 'https://img.example/a.jpeg')
+    writer.add('Local Roasters', 'Coffee', 'Jordan')
+    writer.add('Local Roasters', 'Coffee', 'Egypt')
+
+    assert writer.flush() == 2
+    assert writes[0] == [{
+        ('Local Roasters', 'Coffee', 'Jordan'): 'https://img.example/a.jpeg',
+        ('Local Roasters', 'Coffee', 'Egypt'): None,
+    }]
+    assert writer.stats['added'] == 3
+
+
+def test_full_buffer_flushes_at_once(writes):
+    writer = make_writer(writes, flush_size=2)
+    writer.add('Local Roasters', 'Coffee')
+    assert writes[0] == []
+    writer.add('Sunrise Dairy', 'Milk')
+
+    assert [len(items) for items in writes[0]] == [2]
+    assert writer._pending == {} and writer._timer is None
+
+
+def test_oldest_items_are_dropped_past_max_pending(writes):
+    writer = make_writer(writes, max_pending=2)
+    for company in ('First', 'Second', 'Third'):
+        writer.add(company, 'Coffee')
+
+    assert [company for company, _, _ in writer._pending] == ['Second', 'Third']
+    assert writer.stats['dropped'] == 1
+    writer.flush()
+
+
+def test_timer_flushes_from_its_own_thread(writes):
+    flushed_by = []
+    done = threading.Event()
+    writer = make_writer(writes, flush_interval=0.05)
+
+    def write(items):
+        flushed_by.append(threading.current_thread())
+        done.set()
+        return set()
+
+    writer._write = write
+    writer.add('Local Roasters', 'Coffee')
+
+    assert done.wait(2)
+    assert flushed_by[0] is not threading.main_thread()
+    assert writer._timer is None
+
+
+def test_failed_flush_keeps_items_for_the_next_one(writes):
+    flushed, write = writes
+    attempts = []
+
+    def flaky_write(items):
+        attempts.append(items)
+        if len(attempts) == 1:
+            raise RuntimeError("database is locked")
+        return write(items)
+
+    writer = make_writer(writes)
+    writer._write = flaky_write
+    writer.add('Local Roasters', 'Coffee', 'Jordan', 'https://img.example/old.jpeg')
+
+    assert writer.flush() == 0
+    assert writer.stats['failed_flushes'] == 1
+    # Items added after the failure win over the kept ones
+    writer.add('Local Roasters', 'Coffee', 'Jordan', 'https://img.example/new.jpeg')
+    writer.add('Sunrise Dairy', 'Milk')
+
+    assert writer.flush() == 2
+    assert flushed == [{
+        ('Local Roasters', 'Coffee', 'Jordan'): 'https://img.example/new.jpeg',
+        ('Sunrise Dairy', 'Milk', None): None,
+    }]
+
+
+def test_pending_items_are_flushed_at_exit():
+    script = textwrap.dedent("""
+        import django
+        django.setup()
+
+        from analyzer.utils import cache_sync
+        from analyzer.utils.bulk_writer import alternative_writer
+
+        cache_sync.invalidate_alternatives = lambda *args, **kwargs: None
+        alternative_writer._write = lambda items: print(sorted(items)) or set()
+        alternative_writer.add('Local Roasters', 'Coffee', 'Jordan')
+    """)
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='image_analyzer.settings', ALTERNATIVE_FLUSH_INTERVAL='60')
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=60,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "[('Local Roasters', 'Coffee', 'Jordan')]" in result.stdout
+
+
+@pytest.mark.django_db
+def test_flush_writes_rows_and_invalidates_the_alternatives_cache():
+    Country.objects.create(name='Jordan')
+    assert not alternatives_cache.get('Jordan', 'Coffee')
+    writer = AlternativeBulkWriter(flush_size=10, flush_interval=60)
+    writer.add('Local Roasters', 'Coffee', 'Jordan', 'https://img.example/a.jpeg')
+    writer.add('Local Roasters', 'Coffee', 'Egypt')
+
+    assert writer.flush() == 2
+    company = AlternativeCompanies.objects.get()
+    assert company.description == alternative_description('Jordan')
+    product = AlternativeProducts.objects.get()
+    assert product.image_url == 'https://img.example/a.jpeg'
+    assert sorted(product.countries.values_list('name', flat=True)) == ['Egypt', 'Jordan']
+    # bulk_create sends no signals, the flush drops the stale snapshot itself
+    assert [entry['product_name'] for entry in alternatives_cache.get('Jordan', 'coffee')] == ['Local Roasters']
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import pytest
+
+from analyzer import pipeline
+from analyzer.utils import verdict_cache
+from analyzer.utils.deadline import Deadline
+
+
+async def test_cancelled_request_stops_the_provider_call(provider, alternatives):
+    provider.latency = 5
+    before = pipeline.cancelled_work['provider_call']
+    task = asyncio.ensure_future(pipeline.run_analysis({'company_name': 'Acme Seven'}, deadline=Deadline(10)))
+    while not provider.calls:
+        await asyncio.sleep(0.01)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert pipeline.cancelled_work['provider_call'] == before + 1
+    # The shared call had no other waiter and is cancelled too
+    await asyncio.sleep(0.01)
+    assert not verdict_cache._inflight
+
+
+async def test_cancelled_request_stops_resizing(monkeypatch, alternatives):
+    started = threading.Event()
+    stopped = threading.Event()
+
+    def resize(file_bytes, max_size, quality, cancel_event, deadline):
+        started.set()
+        if cancel_event.wait(5):
+            stopped.set()
+        raise RuntimeError("resize abandoned")
+
+    monkeypatch.setattr(pipeline, 'convert_and_resize_image', resize)
+    task = asyncio.ensure_future(pipeline.run_analysis({'image_data': 'data:image/jpeg;base64,AAAA'}))
+    await asyncio.to_thread(started.wait, 5)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # The worker thread sees the cancel event instead of resizing to the end
+    assert await asyncio.to_thread(stopped.wait, 5)
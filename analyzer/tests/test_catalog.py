@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, BoycottCompanies, BoycottProducts, Country, ProductType
+from analyzer.utils import catalog
+
+pytestmark = pytest.mark.django_db
+
+
+def apply_delta(bundle, delta):
+    """What the app does with a delta: upsert and delete per section"""
+    sections = {}
+    for section in catalog.SECTIONS:
+        records = dict(bundle[section])
+        records.update(delta[section]['upsert'])
+        for key in delta[section]['delete']:
+            records.pop(key, None)
+        sections[section] = records
+    return sections
+
+
+@pytest.fixture
+def data():
+    coffee = ProductType.objects.create(product_type='Coffee')
+    parent = BoycottCompanies.objects.create(company_name='Nestlé SA', cause='Parent cause')
+    child = BoycottCompanies.objects.create(company_name='Nespresso', cause='Child cause', parent_company=parent)
+    BoycottProducts.objects.create(product_name='Nescafé Gold', product_type=coffee, company_name=parent)
+    jordan = Country.objects.create(name='Jordan')
+    local = AlternativeCompanies.objects.create(company_name='Local Roasters', website='https://local.example')
+    product = AlternativeProducts.objects.create(product_name='Local Coffee', product_type=coffee, company_name=local)
+    product.countries.add(jordan)
+    return {'parent': parent, 'child': child, 'coffee': coffee, 'local': local, 'jordan': jordan}
+
+
+def test_build_catalog(data):
+    sections = catalog.build_catalog()
+
+    parent = sections['companies'][str(data['parent'].id)]
+    assert parent['normalized'] == 'nestle'
+    assert parent['aliases'] == ['nescafe gold']
+    assert parent['causes'] == {'default': 'Parent cause'}
+    assert sections['companies'][str(data['child'].id)]['parent'] == data['parent'].id
+    (alternative,) = sections['alternatives'].values()
+    assert alternative['product_name'] == 'Local Coffee'
+    assert sections['countries'] == {'Jordan': [int(key) for key in sections['alternatives']]}
+
+
+def test_unchanged_data_is_not_exported_again(data):
+    manifest, created = catalog.export_catalog()
+    assert created and manifest['version'] == 1
+
+    again, created = catalog.export_catalog()
+    assert not created
+    assert again['version'] == 1
+
+
+def test_delta_turns_the_previous_version_into_the_new_one(data):
+    catalog.export_catalog()
+    child_id = data['child'].id
+    data['child'].delete()
+    BoycottCompanies.objects.filter(pk=data['parent'].pk).update(cause='New cause')
+    BoycottCompanies.objects.create(company_name='Newco')
+
+    manifest, created = catalog.export_catalog()
+    assert created and manifest['version'] == 2
+    assert manifest['versions'] == [1, 2]
+
+    old = catalog.read_bundle(catalog.full_path(1))
+    new = catalog.read_bundle(catalog.full_path(2))
+    delta = catalog.read_bundle(catalog.delta_path(1, 2))
+    assert delta['base_version'] == 1
+    assert delta['companies']['delete'] == [str(child_id)]
+    assert set(delta['companies']['upsert']) == {str(data['parent'].id), str(BoycottCompanies.objects.get(company_name='Newco').id)}
+    assert delta['alternatives']['upsert'] == {}
+    assert apply_delta(old, delta) == {section: new[section] for section in catalog.SECTIONS}
+
+
+def test_old_versions_are_pruned(data):
+    for version in range(1, 5):
+        BoycottCompanies.objects.create(company_name=f'Company {version}')
+        catalog.export_catalog(keep=2)
+
+    manifest = catalog.read_manifest()
+    assert manifest['versions'] == [2, 3, 4]
+    assert sorted(os.listdir(catalog.catalog_dir())) == [
+        'delta-2-4.json.gz', 'delta-3-4.json.gz',
+        'full-2.json.gz', 'full-3.json.gz', 'full-4.json.gz', 'manifest.json',
+    ]
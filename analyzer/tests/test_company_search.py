@@ -0,0 +1,168 @@
+import sqlite3
+
+import pytest
+from django.db import connection
+
+from analyzer.models import BoycottCompanies
+from analyzer.utils import company_search
+
+pytestmark = pytest.mark.django_db
+
+on_sqlite = pytest.mark.skipif(connection.vendor != 'sqlite', reason="SQLite database only")
+# Run the suite with USE_POSTGRES_DB=True and DATABASE_URL to include these
+on_postgres = pytest.mark.skipif(connection.vendor != 'postgresql', reason="Postgres database only")
+
+
+@pytest.fixture
+def companies():
+    names = ['Coca-Cola Company', 'Nestlé SA', 'HP Inc', 'Puma SE', 'Carrefour Group']
+    return {name: BoycottCompanies.objects.create(company_name=name) for name in names}
+
+
+@pytest.fixture
+def sqlite_index(settings):
+    if connection.vendor != 'sqlite':
+        pytest.skip("SQLite database only")
+    settings.COMPANY_SEARCH_BACKEND = 'sqlite'
+    company_search.get_backend('sqlite').install()
+
+
+def names_of(found):
+    return [company.company_name for company in found]
+
+
+def test_trigrams_of_normalized_names():
+    assert company_search.trigrams('Nestlé SA') == ['nes', 'est', 'stl', 'tle']
+    assert company_search.trigrams('HP Inc') == []
+
+
+@on_sqlite
+def test_without_index_every_company_is_scanned(companies, settings):
+    settings.COMPANY_SEARCH_BACKEND = 'sqlite'
+    assert len(company_search.candidates(['coca cola'])) == len(companies)
+
+
+def test_index_returns_best_matches_first(companies, sqlite_index):
+    assert names_of(company_search.candidates(['coca cola'], limit=2))[0] == 'Coca-Cola Company'
+
+
+def test_index_holds_normalized_names(companies, sqlite_index):
+    # Accents and suffixes are gone, as in the names the rescoring compares
+    assert names_of(company_search.candidates(['nestle'], limit=1)) == ['Nestlé SA']
+
+
+def test_triggers_follow_writes(companies, sqlite_index):
+    added = BoycottCompanies.objects.create(company_name='Starbucks Corporation')
+    assert names_of(company_search.candidates(['starbucks'], limit=1)) == ['Starbucks Corporation']
+
+    added.company_name = 'Sodastream'
+    added.save()
+    assert 'Sodastream' in names_of(company_search.candidates(['sodastream'], limit=1))
+
+    added.delete()
+    assert 'Sodastream' not in names_of(company_search.candidates(['sodastream']))
+
+
+def test_names_without_trigrams_scan_every_company(companies, sqlite_index):
+    backend = company_search.get_backend('sqlite')
+    assert backend.candidate_ids(['HP'], 10) is None
+    assert backend.candidate_ids(['HP', 'coca cola'], 10) is None
+    assert 'HP Inc' in names_of(company_search.candidates(['HP']))
+
+
+def test_auto_picks_the_backend_of_the_database(settings):
+    settings.COMPANY_SEARCH_BACKEND = 'auto'
+    assert company_search.get_backend().name == company_search.VENDOR_BACKENDS[connection.vendor]
+    with pytest.raises(ValueError):
+        company_search.get_backend('elastic')
+
+
+def test_writes_keep_the_normalized_name():
+    company = BoycottCompanies.objects.create(company_name='Nestlé SA')
+    (bulk,) = BoycottCompanies.objects.bulk_create([BoycottCompanies(company_name='Puma SE')])
+    assert company.normalized_name == 'nestle'
+
+    company.company_name = 'Starbucks Corporation'
+    company.save(update_fields=['company_name'])
+    bulk.company_name = 'The Carrefour Group'
+    BoycottCompanies.objects.bulk_update([bulk], ['company_name'])
+
+    assert dict(BoycottCompanies.objects.values_list('company_name', 'normalized_name')) == {
+        'Starbucks Corporation': 'starbucks', 'The Carrefour Group': 'carrefour',
+    }
+
+
+def test_install_backfills_names_written_without_django(companies, settings):
+    BoycottCompanies.objects.filter(company_name='Puma SE').update(normalized_name=None)
+    settings.COMPANY_SEARCH_BACKEND = 'auto'
+    company_search.get_backend().install()
+
+    assert BoycottCompanies.objects.get(company_name='Puma SE').normalized_name == 'puma se'
+    assert names_of(company_search.candidates(['puma'], limit=1)) == ['Puma SE']
+
+
+def write_from_sqlite3(*statements):
+    """Run statements on a plain sqlite3 connection, which has none of the functions Django registers"""
+    other = sqlite3.connect(connection.settings_dict['NAME'], uri=True)
+    try:
+        with other:
+            for statement in statements:
+                other.execute(*statement)
+    finally:
+        other.close()
+
+
+@pytest.fixture
+def sqlite_index_committed(settings):
+    settings.COMPANY_SEARCH_BACKEND = 'sqlite'
+    company_search.get_backend('sqlite').install()
+    yield
+    with connection.cursor() as cursor:
+        for trigger in ('insert', 'delete', 'update'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {company_search.FTS_TABLE}_{trigger}")
+        cursor.execute(f"DROP TABLE IF EXISTS {company_search.FTS_TABLE}")
+
+
+@on_sqlite
+@pytest.mark.django_db(transaction=True)
+def test_triggers_work_from_other_sqlite_clients(sqlite_index_committed):
+    write_from_sqlite3((
+        "INSERT INTO analyzer_boycottcompanies (company_name, normalized_name) VALUES (?, ?)",
+        ['Sodastream Ltd', 'sodastream'],
+    ))
+    assert names_of(company_search.candidates(['sodastream'], limit=1)) == ['Sodastream Ltd']
+
+    write_from_sqlite3(
+        ("UPDATE analyzer_boycottcompanies SET company_name = 'Puma SE', normalized_name = 'puma se'",),
+        ("DELETE FROM analyzer_boycottcompanies WHERE company_name = 'Nobody'",),
+    )
+    assert names_of(company_search.candidates(['puma'], limit=1)) == ['Puma SE']
+
+    write_from_sqlite3(("DELETE FROM analyzer_boycottcompanies",))
+    assert company_search.candidates(['puma']) == []
+
+
+@on_postgres
+def test_postgres_index_holds_normalized_names(companies, settings):
+    settings.COMPANY_SEARCH_BACKEND = 'postgres'
+    backend = company_search.get_backend('postgres')
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # An index from before names were normalized, which install() replaces
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(
+            f"CREATE INDEX {company_search.LEGACY_TRGM_INDEX} ON {company_search.TABLE} "
+            f"USING gin (lower(company_name) gin_trgm_ops)"
+        )
+    backend.install()
+
+    assert backend.available()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname IN (%s, %s)",
+                       [company_search.TRGM_INDEX, company_search.LEGACY_TRGM_INDEX])
+        (definition,), = cursor.fetchall()
+    assert 'normalized_name' in definition
+    # Accents and suffixes are gone on both sides, as with SQLite
+    assert names_of(company_search.candidates(['Nestle'], limit=1)) == ['Nestlé SA']
+    assert names_of(company_search.candidates(['coca cola company'], limit=1)) == ['Coca-Cola Company']
+    assert backend.candidate_ids(['HP'], 10) is None
@@ -0,0 +1,191 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+from channels.testing import WebsocketCommunicator
+
+from analyzer import consumers
+from analyzer.pipeline import make_result
+
+# Channels closes old database connections when a socket connects and disconnects
+pytestmark = pytest.mark.django_db
+
+API_KEY = 'test-key'
+# Each test connects from its own address, so rate limits do not carry over
+addresses = (f'198.51.100.{n}' for n in itertools.count(1))
+
+
+@pytest.fixture(autouse=True)
+def api_key(settings):
+    settings.WEBSOCKET_API_KEY = API_KEY
+
+
+@pytest.fixture
+def analysis(monkeypatch):
+    """Replaces run_analysis; each request finishes when its company name is released"""
+
+    class Analysis:
+        def __init__(self):
+            self.requests = []
+            self.released = {}
+            self.cancelled = []
+
+        def release(self, company_name):
+            self.released.setdefault(company_name, asyncio.Event()).set()
+
+        async def run(self, data, on_verdict=None, client_key=None, on_queue=None, deadline=None):
+            name = data['company_name']
+            self.requests.append((name, client_key))
+            try:
+                await self.released.setdefault(name, asyncio.Event()).wait()
+            except asyncio.CancelledError:
+                self.cancelled.append(name)
+                raise
+            return make_result('ok', company=name, product_type='Coffee', boycott=True, cause='cause', alternative=[])
+
+    fake = Analysis()
+    monkeypatch.setattr(consumers, 'run_analysis', fake.run)
+    return fake
+
+
+async def connect(query='', api_key=API_KEY):
+    communicator = WebsocketCommunicator(
+        consumers.AnalyzeConsumer.as_asgi(), f'/ws/analyze/?api_key={api_key}&{query}',
+        headers=[(b'x-forwarded-for', next(addresses).encode('ascii'))],
+    )
+    connected, _ = await communicator.connect()
+    return communicator, connected
+
+
+async def test_wrong_api_key_is_refused():
+    communicator, connected = await connect(api_key='wrong')
+
+    assert not connected
+    await communicator.disconnect()
+
+
+async def test_one_shot_socket_answers_in_legacy_frames_and_closes(analysis):
+    communicator, connected = await connect()
+    assert connected
+    analysis.release('Acme')
+    await communicator.send_json_to({'company_name': 'Acme'})
+
+    frames = []
+    while not frames or frames[-1]['type'] != 'done':
+        frames.append(await communicator.receive_json_from())
+    assert [frame['type'] for frame in frames] == ['company', 'product_type', 'boycott', 'cause', 'alternative', 'done']
+    assert frames[0]['value'] == 'Acme'
+    assert (await communicator.receive_output())['type'] == 'websocket.close'
+
+
+async def test_session_multiplexes_requests_by_id(analysis):
+    communicator, connected = await connect('session=1&protocol=v2')
+    assert connected
+    await communicator.send_json_to({'request_id': 1, 'company_name': 'Slow Brand'})
+    await communicator.send_json_to({'request_id': 'b', 'company_name': 'Fast Brand'})
+
+    # The second request answers first; each result carries the id it was asked with
+    analysis.release('Fast Brand')
+    assert await communicator.receive_json_from() == {
+        'type': 'result', 'request_id': 'b', 'status': 'ok', 'company': 'Fast Brand',
+        'product_type': 'Coffee', 'boycott': True, 'cause': 'cause',
+    }
+    analysis.release('Slow Brand')
+    result = await communicator.receive_json_from()
+    assert (result['request_id'], result['company']) == (1, 'Slow Brand')
+
+    # The session stays open for more requests
+    await communicator.send_json_to({'type': 'ping'})
+    assert await communicator.receive_json_from() == {'type': 'pong'}
+    await communicator.disconnect()
+
+
+@pytest.mark.parametrize('request_id', [None, True, '', 'x' * 65])
+async def test_session_requests_need_a_valid_id(analysis, request_id):
+    communicator, _ = await connect('session=1&protocol=v2')
+    message = {'company_name': 'Acme'}
+    if request_id is not None:
+        message['request_id'] = request_id
+    await communicator.send_json_to(message)
+
+    frame = await communicator.receive_json_from()
+    assert (frame['type'], frame['value']) == ('error', "Invalid or missing request_id")
+    assert analysis.requests == []
+    await communicator.disconnect()
+
+
+async def test_session_refuses_a_duplicate_id_in_flight(analysis):
+    communicator, _ = await connect('session=1&protocol=v2')
+    await communicator.send_json_to({'request_id': 7, 'company_name': 'Acme'})
+    await communicator.send_json_to({'request_id': 7, 'company_name': 'Acme Two'})
+
+    frame = await communicator.receive_json_from()
+    assert frame == {'type': 'error', 'value': "Duplicate request_id", 'request_id': 7}
+    analysis.release('Acme')
+    assert (await communicator.receive_json_from())['request_id'] == 7
+    await communicator.disconnect()
+
+
+async def test_session_limits_requests_in_flight(analysis, settings):
+    settings.WEBSOCKET_MAX_IN_FLIGHT = 1
+    communicator, _ = await connect('session=1&protocol=v2')
+    await communicator.send_json_to({'request_id': 1, 'company_name': 'Acme'})
+    await communicator.send_json_to({'request_id': 2, 'company_name': 'Acme Two'})
+
+    frame = await communicator.receive_json_from()
+    assert (frame['value'], frame['request_id']) == ("Too many requests in flight", 2)
+    await communicator.disconnect()
+
+
+async def test_invalid_json_keeps_the_session_open(analysis):
+    communicator, _ = await connect('session=1&protocol=v2')
+    await communicator.send_to(text_data='{not json')
+
+    assert (await communicator.receive_json_from())['value'] == "Invalid JSON format"
+    await communicator.send_to(text_data=json.dumps({'type': 'ping'}))
+    assert await communicator.receive_json_from() == {'type': 'pong'}
+    await communicator.disconnect()
+
+
+async def test_idle_session_is_closed(analysis, settings):
+    settings.WEBSOCKET_HEARTBEAT_INTERVAL = 0.05
+    settings.WEBSOCKET_IDLE_TIMEOUT = 0.1
+    communicator, _ = await connect('session=1&protocol=v2')
+
+    frames = []
+    while True:
+        output = await communicator.receive_output(timeout=2)
+        if output['type'] == 'websocket.close':
+            break
+        frames.append(json.loads(output['text']))
+    assert {'type': 'ping'} in frames
+    assert output['code'] == 4408
+
+
+async def wait_until(condition, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+
+async def test_disconnect_cancels_every_request_in_flight(analysis):
+    communicator, _ = await connect('session=1&protocol=v2')
+    await communicator.send_json_to({'request_id': 1, 'company_name': 'Acme'})
+    await communicator.send_json_to({'request_id': 2, 'company_name': 'Acme Two'})
+    await wait_until(lambda: len(analysis.requests) == 2)
+
+    await communicator.disconnect()
+    await wait_until(lambda: len(analysis.cancelled) == 2)
+    assert sorted(analysis.cancelled) == ['Acme', 'Acme Two']
+
+
+async def test_disconnect_cancels_a_one_shot_request(analysis):
+    communicator, _ = await connect()
+    await communicator.send_json_to({'company_name': 'Acme'})
+    await wait_until(lambda: analysis.requests)
+
+    await communicator.disconnect()
+    await wait_until(lambda: analysis.cancelled == ['Acme'])
@@ -0,0 +1,117 @@
+import gzip
+import json
+
+import pytest
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, BoycottCompanies, BoycottProducts, Country, ProductType
+from analyzer.utils.dataset_import import DatasetImporter, ImportRowError, read_rows
+
+pytestmark = pytest.mark.django_db
+
+
+def rows(*dicts):
+    return list(enumerate(dicts, 1))
+
+
+def test_read_csv(tmp_path):
+    path = tmp_path / 'boycott.csv'
+    path.write_text('company,cause\nNestlé,Profits\n', encoding='utf-8')
+    assert list(read_rows(str(path))) == [(2, {'company': 'Nestlé', 'cause': 'Profits'})]
+
+
+def test_read_gzipped_jsonl_with_a_bad_line(tmp_path):
+    path = tmp_path / 'boycott.jsonl.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'company': 'Acme'}) + '\n\n{not json\n[1]\n')
+
+    (first, row), (second, error), (third, not_object) = read_rows(str(path))
+    assert (first, row) == (1, {'company': 'Acme'})
+    assert second == 3 and isinstance(error, ImportRowError)
+    assert third == 4 and isinstance(not_object, ImportRowError)
+
+
+def test_unsupported_file_type(tmp_path):
+    path = tmp_path / 'boycott.xlsx'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        list(read_rows(str(path)))
+
+
+def test_boycott_rows_create_companies_products_and_parents():
+    importer = DatasetImporter('boycott', batch_size=2)
+    importer.run(rows(
+        {'company': 'Nespresso', 'cause': 'Child cause', 'parent': 'Nestlé SA',
+         'product': 'Vertuo Pods', 'product_type': 'Coffee'},
+        {'company': 'Nestlé SA', 'cause': 'Parent cause'},
+        {'company': 'nespresso', 'product': 'Original Pods', 'product_type': 'coffee'},
+    ))
+
+    parent = BoycottCompanies.objects.get(company_name='Nestlé SA')
+    child = BoycottCompanies.objects.get(company_name='Nespresso')
+    assert child.parent_company == parent
+    assert (parent.cause, child.cause) == ('Parent cause', 'Child cause')
+    assert sorted(BoycottProducts.objects.values_list('product_name', flat=True)) == ['Original Pods', 'Vertuo Pods']
+    assert list(ProductType.objects.values_list('product_type', flat=True)) == ['Coffee']
+    assert importer.stats['companies_created'] == 2
+    assert importer.stats['imported'] == 3
+
+
+def test_rows_match_existing_companies_by_normalized_name():
+    BoycottCompanies.objects.create(company_name='Nestle', cause='Old cause')
+    importer = DatasetImporter('boycott')
+    importer.run(rows({'company': 'Nestlé SA', 'cause': 'New cause'}))
+
+    assert list(BoycottCompanies.objects.values_list('company_name', 'cause')) == [('Nestle', 'New cause')]
+    assert importer.stats['companies_updated'] == 1
+
+
+def test_invalid_rows_are_skipped_and_reported():
+    importer = DatasetImporter('boycott')
+    importer.run(rows(
+        {'cause': 'no company'},
+        {'company': 'Acme', 'product': 'Widget'},
+        ImportRowError("invalid JSON"),
+        {'company': 'Valid'},
+    ))
+
+    assert importer.stats['skipped'] == 3
+    assert [line for line, _ in importer.errors] == [1, 2, 3]
+    assert list(BoycottCompanies.objects.values_list('company_name', flat=True)) == ['Valid']
+
+
+def test_dry_run_keeps_nothing():
+    importer = DatasetImporter('boycott', batch_size=1, dry_run=True)
+    importer.run(rows({'company': 'Acme'}, {'company': 'Acme', 'cause': 'cause'}))
+
+    assert not BoycottCompanies.objects.exists()
+    assert importer.stats['imported'] == 2
+
+
+def test_alternatives_rows_link_countries_and_report_them():
+    jordan = Country.objects.create(name='Jordan')
+    importer = DatasetImporter('alternatives')
+    importer.run(rows(
+        {'company': 'Local Roasters', 'product': 'Local Coffee', 'product_type': 'Coffee',
+         'countries': 'jordan; Egypt', 'website': 'https://local.example'},
+        {'company': 'Local Roasters', 'product': 'Local Coffee', 'product_type': 'Coffee',
+         'countries': ['Turkey'], 'image_url': 'https://img.example/coffee.jpeg'},
+    ))
+
+    company = AlternativeCompanies.objects.get()
+    assert company.website == 'https://local.example'
+    product = AlternativeProducts.objects.get()
+    assert product.image_url == 'https://img.example/coffee.jpeg'
+    assert sorted(product.countries.values_list('name', flat=True)) == ['Egypt', 'Jordan', 'Turkey']
+    assert importer.touched_countries == set(Country.objects.values_list('id', flat=True))
+    assert jordan.id in importer.touched_countries
+
+
+def test_reimport_updates_instead_of_duplicating():
+    row = {'company': 'Local Roasters', 'product': 'Local Coffee', 'product_type': 'Coffee', 'countries': 'Jordan'}
+    DatasetImporter('alternatives').run(rows(row))
+    importer = DatasetImporter('alternatives')
+    importer.run(rows(dict(row, image_url='https://img.example/new.jpeg')))
+
+    assert AlternativeProducts.objects.count() == 1
+    assert importer.stats['products_updated'] == 1
+    assert importer.stats['products_created'] == 0
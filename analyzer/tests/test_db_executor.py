@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import pytest
+
+from analyzer.models import Country
+from analyzer.utils import db_executor
+from analyzer.utils.db_executor import database_read_to_async
+
+
+async def test_reads_run_concurrently_on_the_read_pool(monkeypatch):
+    monkeypatch.setattr(db_executor, 'close_old_connections', lambda: None)
+    # Both reads must be inside the barrier at once, which one shared thread could not do
+    barrier = threading.Barrier(2, timeout=5)
+
+    @database_read_to_async
+    def read():
+        barrier.wait()
+        return threading.current_thread().name
+
+    names = await asyncio.gather(read(), read())
+
+    assert all(name.startswith('db-read') for name in names)
+    assert names[0] != names[1]
+
+
+async def test_old_connections_are_closed_around_each_read(monkeypatch):
+    calls = []
+    monkeypatch.setattr(db_executor, 'close_old_connections', lambda: calls.append('close'))
+
+    @database_read_to_async
+    def read():
+        calls.append('read')
+        return 42
+
+    assert await read() == 42
+    assert calls == ['close', 'read', 'close']
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_orm_reads_see_committed_rows():
+    await Country.objects.acreate(name='Jordan')
+
+    names = await database_read_to_async(lambda: list(Country.objects.values_list('name', flat=True)))()
+    assert names == ['Jordan']
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from analyzer import pipeline
+from analyzer.utils.admission import AdmissionController
+from analyzer.utils.deadline import Deadline, DeadlineExceeded, within
+
+async def test_run_returns_within_budget():
+    assert await Deadline(1).run(asyncio.sleep(0, result='done')) == 'done'
+
+
+async def test_run_raises_when_the_budget_runs_out():
+    with pytest.raises(DeadlineExceeded, match="during lookup"):
+        await Deadline(0.05).run(asyncio.sleep(1), "lookup")
+
+
+async def test_expired_deadline_does_not_start_the_stage():
+    coro = asyncio.sleep(1)
+    with pytest.raises(DeadlineExceeded, match="No time left"):
+        await Deadline(0).run(coro)
+    # The coroutine was closed, not left unawaited
+    assert coro.cr_frame is None
+
+
+def test_reserving_leaves_time_for_later_stages():
+    deadline = Deadline(10)
+    reserved = deadline.reserving(4)
+    assert reserved.expires_at == deadline.expires_at - 4
+    assert 5.5 < reserved.remaining() <= 6
+
+
+def test_check_raises_after_expiry():
+    Deadline(1).check()
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).check("resize")
+
+
+async def test_within_without_deadline_just_awaits():
+    assert await within(None, asyncio.sleep(0, result=1)) == 1
+
+
+async def test_provider_call_gets_the_request_deadline(provider, alternatives):
+    deadline = Deadline(5)
+    result = await pipeline.run_analysis({'company_name': 'Acme One'}, deadline=deadline)
+
+    assert result['status'] == 'ok'
+    (given,) = provider.calls
+    # Less the time kept back for the alternatives lookup
+    assert given.expires_at == deadline.expires_at - pipeline.ALTERNATIVES_RESERVE
+
+
+async def test_alternatives_lookup_gets_the_request_deadline(provider, alternatives):
+    deadline = Deadline(5)
+    result = await pipeline.run_analysis({'company_name': 'Acme Two', 'country': 'Jordan'}, deadline=deadline)
+
+    assert result['alternative'] == [{'product_name': 'Local Coffee'}]
+    assert alternatives.deadlines == [deadline]
+
+
+async def test_slow_verdict_times_out_on_the_request_deadline(provider, alternatives):
+    provider.latency = 2
+    result = await pipeline.run_analysis({'company_name': 'Acme Three'}, deadline=Deadline(1.2))
+
+    assert result['status'] == 'timeout'
+    assert alternatives.deadlines == []
+
+
+async def test_slow_alternatives_return_the_verdict_alone(provider, alternatives):
+    alternatives.latency = 5
+    verdicts = []
+
+    async def on_verdict(result):
+        verdicts.append(result)
+
+    result = await pipeline.run_analysis(
+        {'company_name': 'Acme Four', 'country': 'Jordan'}, on_verdict=on_verdict, deadline=Deadline(1.5),
+    )
+
+    assert result['status'] == 'partial'
+    assert result['company'] == 'Acme'
+    assert result['boycott'] is True
+    assert [verdict['status'] for verdict in verdicts] == ['ok']
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    """A one-slot admission controller, held by another client until released"""
+    controller = AdmissionController(capacity=1, max_queue=10, costs={'text': 1, 'image': 2})
+    monkeypatch.setattr(pipeline, 'admission', controller)
+    return controller
+
+
+async def hold(controller, release):
+    async with controller.admit('198.51.100.1', 'text'):
+        await release.wait()
+
+
+async def test_request_that_cannot_start_in_time_is_shed_as_busy(provider, alternatives, controller):
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(hold(controller, release))
+    await asyncio.sleep(0)
+
+    # The expected wait of one service time is more than this request has left
+    result = await pipeline.run_analysis({'company_name': 'Acme Five'}, client_key='203.0.113.7', deadline=Deadline(3))
+
+    assert result['status'] == 'busy'
+    assert provider.calls == []
+    release.set()
+    await holder
+
+
+async def test_verdict_call_waits_in_the_client_queue(provider, alternatives, controller):
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(hold(controller, release))
+    await asyncio.sleep(0)
+
+    request = asyncio.ensure_future(pipeline.run_analysis(
+        {'company_name': 'Acme Six'}, client_key='203.0.113.7', deadline=Deadline(20),
+    ))
+    while '203.0.113.7' not in controller._clients:
+        await asyncio.sleep(0.01)
+    release.set()
+
+    assert (await request)['status'] == 'ok'
+    await holder
+
@@ -0,0 +1,78 @@
+import base64
+import os
+import time
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from analyzer.models import AlternativeCompanies, AlternativeProducts, ProductType
+from analyzer.utils import image_store
+
+JPEG = base64.b64encode(b'\xff\xd8\xff\xe0 not really a jpeg').decode('ascii')
+OTHER_JPEG = base64.b64encode(b'\xff\xd8\xff\xe0 another one').decode('ascii')
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_store_image_is_content_addressed(settings):
+    settings.PUBLIC_BASE_URL = 'https://example.org/'
+    digest, url, created = image_store.store_image(JPEG)
+
+    assert created
+    assert url == f"https://example.org/images/{digest}.jpeg"
+    assert image_store.store_image(JPEG) == (digest, url, False)
+
+
+@pytest.mark.parametrize('url', ['', '/media', 'example.org', 'ftp://example.org'])
+def test_relative_public_base_url_is_refused(settings, url):
+    settings.PUBLIC_BASE_URL = url
+    with pytest.raises(ImproperlyConfigured):
+        image_store.check_public_base_url()
+
+
+def test_absolute_public_base_url_is_accepted(settings):
+    settings.PUBLIC_BASE_URL = 'https://gaza.example'
+    image_store.check_public_base_url()
+
+
+@pytest.mark.django_db
+def test_prune_deletes_old_unused_images_only(settings):
+    used, used_url, _ = image_store.store_image(JPEG)
+    unused, _, _ = image_store.store_image(OTHER_JPEG)
+    unused_path = image_store.image_path(unused)
+    with open(f"{unused_path}.imgur", 'w', encoding='utf-8') as marker:
+        marker.write('https://i.imgur.com/x.jpeg')
+    for digest in (used, unused):
+        age(image_store.image_path(digest), 3600)
+
+    AlternativeProducts.objects.create(
+        product_name='Local Coffee', image_url=used_url,
+        company_name=AlternativeCompanies.objects.create(company_name='Local Roasters'),
+        product_type=ProductType.objects.create(product_type='Coffee'),
+    )
+
+    assert image_store.prune_images(max_age=60, dry_run=True)[0] == 1
+    assert os.path.exists(unused_path)
+
+    deleted, freed = image_store.prune_images(max_age=60)
+    assert (deleted, freed) == (1, len(base64.b64decode(OTHER_JPEG)))
+    assert not os.path.exists(unused_path)
+    assert not os.path.exists(f"{unused_path}.imgur")
+    assert os.path.exists(image_store.image_path(used))
+
+
+@pytest.mark.django_db
+def test_prune_keeps_recent_images():
+    digest, _, _ = image_store.store_image(JPEG)
+    assert image_store.prune_images(max_age=60) == (0, 0)
+    assert os.path.exists(image_store.image_path(digest))
+
+
+def test_reference_images_are_written_once():
+    image_store.store_reference_image('b6341c6c3938286c', JPEG)
+    image_store.store_reference_image('b6341c6c3938286c', OTHER_JPEG)
+    with open(image_store.reference_path('b6341c6c3938286c'), 'rb') as f:
+        assert f.read() == base64.b64decode(JPEG)
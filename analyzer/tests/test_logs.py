@@ -0,0 +1,102 @@
+import asyncio
+import atexit
+import contextvars
+import io
+import logging
+import threading
+import time
+
+import pytest
+
+from analyzer.utils.logs import (
+    SAMPLED, QueuedStreamHandler, RequestContextFilter, SampleFilter, bind_request_id, request_id_var,
+)
+
+
+def record(msg='Row %s', name='analyzer.Boycott', sampled=True, args=(1,)):
+    return logging.makeLogRecord({'name': name, 'msg': msg, 'args': args, **(SAMPLED if sampled else {})})
+
+
+def kept(sample, records):
+    return sum(sample.filter(r) for r in records)
+
+
+def test_sampled_records_are_kept_one_in_every():
+    sample = SampleFilter(every=100)
+
+    assert kept(sample, [record() for _ in range(250)]) == 3
+    assert kept(sample, [record(sampled=False) for _ in range(250)]) == 250
+
+
+def test_samples_are_counted_per_logger_and_message():
+    sample = SampleFilter(every=10)
+    records = [record(), record(msg='Other row %s'), record(name='analyzer.pipeline')] * 10
+
+    # Each of the three streams keeps its own first record
+    assert kept(sample, records) == 3
+
+
+def test_rates_override_the_rate_per_logger():
+    sample = SampleFilter(every=100, rates='analyzer.Boycott=1, analyzer.pipeline=5')
+
+    assert kept(sample, [record() for _ in range(10)]) == 10
+    assert kept(sample, [record(name='analyzer.pipeline') for _ in range(10)]) == 2
+    assert kept(sample, [record(name='analyzer.consumers') for _ in range(10)]) == 1
+
+
+async def test_records_carry_the_request_id_of_their_task():
+    context = RequestContextFilter()
+    outer = request_id_var.get()
+
+    def tagged():
+        logged = record()
+        context.filter(logged)
+        return logged.request_id
+
+    async def handle(request_id):
+        bind_request_id(request_id)
+        await asyncio.sleep(0)
+        # Threads started with to_thread copy the task's context
+        return tagged(), await asyncio.to_thread(tagged)
+
+    assert await asyncio.gather(handle('a'), handle('b')) == [('a', 'a'), ('b', 'b')]
+    # Binding in a task leaves the caller's id alone
+    assert request_id_var.get() == outer
+
+
+def test_bound_request_ids_are_generated_when_missing():
+    context = contextvars.copy_context()
+    assert context.run(bind_request_id, 7) == '7'
+    assert len(context.run(bind_request_id)) == 12
+
+
+@pytest.fixture
+def handler():
+    stream = io.StringIO()
+    handler = QueuedStreamHandler(stream)
+    yield handler, stream
+    handler.listener.stop()
+    atexit.unregister(handler.listener.stop)
+
+
+def test_records_are_formatted_and_written_by_the_listener(handler):
+    handler, stream = handler
+    threads = []
+
+    class Formatter(logging.Formatter):
+        def format(self, record):
+            threads.append(threading.current_thread())
+            return super().format(record)
+
+    handler.setFormatter(Formatter('%(name)s %(message)s'))
+    logged = record(msg='Fuzzy match found: %s (similarity: %.2f)', args=('Acme', 0.9), sampled=False)
+    handler.handle(logged)
+
+    for _ in range(200):
+        if stream.getvalue():
+            break
+        time.sleep(0.01)
+    assert stream.getvalue() == 'analyzer.Boycott Fuzzy match found: Acme (similarity: 0.90)\n'
+    assert threads and threading.current_thread() not in threads
+    # The record is queued as is, not pre-formatted in the caller's thread
+    assert logged.args == ('Acme', 0.9)
@@ -0,0 +1,99 @@
+import os
+from collections import Counter
+
+import pytest
+
+from analyzer.utils import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Metrics made by a test are rendered on their own and forgotten afterwards"""
+    monkeypatch.setattr(metrics, '_metrics', [])
+    monkeypatch.setattr(metrics, '_collectors', [])
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+
+
+def test_histogram_renders_cumulative_buckets(registry):
+    histogram = metrics.Histogram('test_seconds', 'Test latency', labels=('stage',), buckets=(0.01, 1.0))
+    for value in (0.003, 0.3, 30):
+        histogram.observe(value, stage='resize')
+
+    lines = metrics.render().splitlines()
+    assert lines[:7] == [
+        '# HELP test_seconds Test latency',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{stage="resize",le="0.01"} 1',
+        'test_seconds_bucket{stage="resize",le="1.0"} 2',
+        'test_seconds_bucket{stage="resize",le="+Inf"} 3',
+        'test_seconds_sum{stage="resize"} 30.303',
+        'test_seconds_count{stage="resize"} 3',
+    ]
+
+
+def test_timer_observes_its_block(registry):
+    histogram = metrics.Histogram('test_seconds', 'Test latency', labels=('stage',))
+    with histogram.time(stage='parse'):
+        pass
+
+    child = histogram.labels(stage='parse')
+    assert sum(child.counts) == 1
+    assert 0 <= child.sum < 1
+
+
+def test_counter_escapes_label_values(registry):
+    counter = metrics.Counter('test_total', 'Test events', labels=('reason',))
+    counter.inc(reason='quote " backslash \\ newline \n')
+    counter.inc(2, reason='plain')
+
+    lines = metrics.render().splitlines()
+    assert 'test_total{reason="plain"} 2.0' in lines
+    assert 'test_total{reason="quote \\" backslash \\\\ newline \\n"} 1.0' in lines
+
+
+def test_collectors_and_process_info_are_rendered(registry):
+    stats = Counter(admitted=3, rejected_queue_full=1)
+    metrics.register_collector(metrics.counter_collector('test_admission_total', 'Decisions', stats, 'outcome'))
+
+    text = metrics.render()
+    assert '# TYPE test_admission_total counter\n' in text
+    assert 'test_admission_total{outcome="admitted"} 3\n' in text
+    assert text.endswith(f'gaza_process_info{{pid="{os.getpid()}"}} 1\n')
+
+
+def test_disabled_metrics_are_no_ops(registry, monkeypatch):
+    histogram = metrics.Histogram('test_seconds', 'Test latency', labels=('stage',))
+    counter = metrics.Counter('test_total', 'Test events', labels=('reason',))
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+
+    assert histogram.time(stage='parse') is metrics._NOOP
+    with histogram.time(stage='parse'):
+        pass
+    histogram.observe(1.0, stage='parse')
+    counter.inc(reason='any')
+
+    # Nothing was recorded, not even a label set
+    assert histogram._children == {} and counter._children == {}
+
+
+def test_metrics_view(client, settings):
+    settings.METRICS_ENABLED = True
+    settings.METRICS_TOKEN = ''
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    assert b'# TYPE gaza_stage_seconds histogram' in response.content
+
+
+def test_metrics_view_needs_the_token(client, settings):
+    settings.METRICS_ENABLED = True
+    settings.METRICS_TOKEN = 'scrape-token'
+
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').status_code == 200
+
+
+def test_disabled_metrics_view_is_not_found(client, settings):
+    settings.METRICS_ENABLED = False
+    assert client.get('/metrics').status_code == 404
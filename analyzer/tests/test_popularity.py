@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from analyzer.utils.popularity import SpaceSaving, scan_key
+
+
+def test_counts_while_there_is_room():
+    sketch = SpaceSaving(capacity=3)
+    for key in ['a', 'b', 'a', 'c', 'a']:
+        sketch.add(key, payload=key.upper())
+
+    assert sketch.get('a') == (3, 0, 'A')
+    assert sketch.top(1) == [('a', 3, 'A')]
+    assert {key for key, _, _ in sketch.top(3)} == {'a', 'b', 'c'}
+
+
+def test_new_key_takes_over_the_lowest_counter():
+    sketch = SpaceSaving(capacity=2)
+    for key in ['a', 'a', 'a', 'b', 'c']:
+        sketch.add(key)
+
+    assert len(sketch) == 2
+    assert sketch.get('b') is None
+    # 'c' inherits the count of 'b' and remembers it as its error
+    assert sketch.get('c') == (2, 1, None)
+    assert sketch.get('a')[0] == 3
+
+
+def test_heavy_hitters_survive_many_rare_keys():
+    rng = random.Random(1948)
+    sketch = SpaceSaving(capacity=50)
+    for i in range(20000):
+        if i % 10 == 0:
+            sketch.add('popular')
+        elif i % 25 == 0:
+            sketch.add('steady')
+        else:
+            sketch.add(f'rare-{rng.randrange(100000)}')
+
+    top = [key for key, _, _ in sketch.top(2)]
+    assert top == ['popular', 'steady']
+    assert len(sketch) == 50
+    # The heap of lazily deleted entries stays bounded
+    assert len(sketch._heap) <= 4 * sketch.capacity
+
+
+def test_decay_halves_counts_and_drops_zeros():
+    sketch = SpaceSaving(capacity=3)
+    for key in ['a', 'a', 'a', 'a', 'b']:
+        sketch.add(key)
+    sketch.decay()
+
+    assert sketch.get('a') == (2, 0, None)
+    assert sketch.get('b') is None
+    # The rebuilt heap still finds the lowest counter
+    sketch.add('c')
+    sketch.add('d')
+    sketch.add('e')
+    assert sketch.get('a') is not None
+
+
+def test_scans_are_counted_by_perceptual_hash():
+    assert scan_key('d' * 64, 'b6341c6c3938286c') == 'image:b6341c6c3938286c'
+
+
+@pytest.mark.parametrize('perceptual_hash', ['0000000000000000', 'ffffffffffffffff', '0000000000000f00', None])
+def test_uniform_scans_are_counted_by_digest(perceptual_hash):
+    assert scan_key('d' * 64, perceptual_hash) == 'image:' + 'd' * 64
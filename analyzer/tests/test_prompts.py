@@ -0,0 +1,147 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from analyzer.API import message, prompts
+from analyzer.management.commands.evaluate_prompts import Command, score
+from analyzer.models import ApiKeys, ProviderCompany, SystemMessage
+from analyzer.utils import metrics
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def provider_client(monkeypatch):
+    """Replaces the provider client; records the messages of each call"""
+
+    class Client:
+        def __init__(self):
+            self.calls = []
+            self.usage = SimpleNamespace(prompt_tokens=120, completion_tokens=30)
+            self.chat = SimpleNamespace(completions=self)
+
+        def create(self, model, messages, temperature=0):
+            self.calls.append(messages)
+            content = "[True, Acme, $, Coffee, Occupation profits]"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=self.usage)
+
+    fake = Client()
+    monkeypatch.setattr(message, 'acquire_client', lambda key: (fake, key.provider_company.model_name))
+    monkeypatch.setattr(message, 'release_client', lambda key, client, model: None)
+    monkeypatch.setattr(message, 'close_client', lambda client: None)
+    message.invalidate_system_messages()
+    yield fake
+    message.invalidate_system_messages()
+
+
+def key_for(profile=''):
+    # Unsaved like the evaluation key; analyze() only reads its provider
+    return ApiKeys(pk=1, api_key='test-key', provider_company=ProviderCompany(
+        company_name='stub', model_name='stub-model', prompt_profile=profile,
+    ))
+
+
+@pytest.mark.parametrize('name', list(prompts.PROMPTS))
+def test_compact_prompts_cost_fewer_tokens(name):
+    verbose = prompts.builtin_prompt(name, prompts.VERBOSE, 'Arabic')
+    compact = prompts.builtin_prompt(name, prompts.COMPACT, 'Arabic')
+
+    assert prompts.estimate_tokens([{'content': compact}]) < prompts.estimate_tokens([{'content': verbose}])
+    assert '{language}' not in compact
+
+
+def test_unknown_profiles_use_the_verbose_prompt():
+    assert (prompts.builtin_prompt('company_analysis', 'tiny', 'English')
+            == prompts.builtin_prompt('company_analysis', prompts.VERBOSE, 'English'))
+
+
+def test_profile_comes_from_the_provider_or_the_setting(settings):
+    settings.PROMPT_PROFILE = prompts.VERBOSE
+    assert prompts.profile_for(key_for(prompts.COMPACT)) == prompts.COMPACT
+    assert prompts.profile_for(key_for()) == prompts.VERBOSE
+
+
+def test_usage_is_estimated_when_the_provider_reports_none():
+    messages = [
+        {'role': 'system', 'content': 'x' * 40},
+        {'role': 'user', 'content': [{'type': 'image_url', 'image_url': {'url': 'https://img.example/a.jpeg'}},
+                                     {'type': 'text', 'text': 'y' * 8}]},
+    ]
+    assert prompts.token_usage(SimpleNamespace(), messages, 'z' * 6) == (12, 2)
+    assert prompts.token_usage(SimpleNamespace(usage=SimpleNamespace(prompt_tokens=5, completion_tokens=1)),
+                               messages, 'z') == (5, 1)
+
+
+async def test_calls_use_the_profile_of_the_key(provider_client, monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    tokens = metrics.provider_tokens_total.labels(provider='stub', model='stub-model', profile='compact', kind='prompt')
+    before = tokens.value
+    usage = {}
+
+    await message.analyze_company_name('Acme', 'English', key=key_for(prompts.COMPACT), usage=usage)
+
+    system = provider_client.calls[0][0]
+    assert system == {'role': 'system', 'content': prompts.builtin_prompt('company_analysis', prompts.COMPACT, 'English')}
+    assert usage == {'profile': 'compact', 'model': 'stub-model', 'prompt_tokens': 120, 'completion_tokens': 30}
+    assert tokens.value == before + 120
+
+
+# The prompt is read on the database read pool, which only sees committed rows
+@pytest.mark.django_db(transaction=True)
+async def test_system_messages_override_the_profile_prompt(provider_client):
+    await SystemMessage.objects.acreate(name='company_analysis', profile='compact', message='Admin prompt.')
+    await SystemMessage.objects.acreate(name='company_analysis', profile='verbose', message='Other profile.')
+
+    await message.analyze_company_name('Acme', 'Arabic', key=key_for(), profile=prompts.COMPACT)
+
+    assert provider_client.calls[0][0]['content'] == 'Admin prompt.' + prompts.LANGUAGE_SUFFIX['company_analysis'].format(
+        language='Arabic')
+
+
+def test_score_checks_each_answered_field():
+    fixture = {'company': 'Acme', 'boycott': True, 'brand': 'Acme', 'product_type': 'Coffee'}
+
+    assert score(fixture, (True, 'ACME', None, ' coffee ', 'cause')) == {
+        'format': True, 'boycott': True, 'brand': True, 'parent': True, 'product_type': True,
+    }
+    assert score({'company': 'Acme'}, (False, 'Acme', None, 'Tea', ''))['boycott'] is None
+    assert not any(score(fixture, (None, None, None, None, None)).values())
+
+
+def test_pick_prefers_the_cheapest_profile_within_tolerance():
+    def result(accuracy, tokens):
+        return {'accuracy': {'format': 1.0, 'boycott': accuracy}, 'prompt_tokens': tokens, 'completion_tokens': 10}
+
+    results = {'verbose': result(1.0, 420), 'compact': result(0.99, 130)}
+    assert Command().pick(results, tolerance=0.02) == 'compact'
+    assert Command().pick(results, tolerance=0.0) == 'verbose'
+
+
+def write_fixtures(path, fixtures):
+    path.write_text(''.join(json.dumps(fixture) + '\n' for fixture in fixtures), encoding='utf-8')
+    return str(path)
+
+
+def test_evaluate_prompts_compares_the_profiles(tmp_path, capsys):
+    fixtures = write_fixtures(tmp_path / 'fixtures.jsonl', [
+        {'company': 'Acme', 'boycott': True, 'brand': 'Acme', 'product_type': 'Coffee'},
+        {'company': 'Other Brand', 'boycott': True, 'brand': 'Other Brand'},
+    ])
+
+    call_command('evaluate_prompts', fixtures=fixtures, stub='stub?latency_ms=0&boycott=1', json=True)
+    results = json.loads(capsys.readouterr().out)
+
+    assert set(results) == {'compact', 'verbose'}
+    for result in results.values():
+        assert result['accuracy'] == {'format': 1.0, 'boycott': 1.0, 'brand': 1.0, 'parent': 1.0, 'product_type': 1.0}
+    assert results['compact']['prompt_tokens'] < results['verbose']['prompt_tokens']
+
+    call_command('evaluate_prompts', fixtures=fixtures, stub='stub?latency_ms=0&boycott=1')
+    assert "Cheapest profile within tolerance: compact" in capsys.readouterr().out
+
+
+def test_evaluate_prompts_needs_readable_fixtures(tmp_path):
+    with pytest.raises(CommandError):
+        call_command('evaluate_prompts', fixtures=str(tmp_path / 'missing.jsonl'))
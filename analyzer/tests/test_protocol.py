@@ -0,0 +1,75 @@
+import pytest
+
+from analyzer import protocol
+
+
+def test_legacy_without_subprotocol_or_query():
+    assert protocol.negotiate([], {}) == (protocol.LEGACY, 'json', None)
+
+
+def test_json_subprotocol():
+    assert protocol.negotiate(['gaza.v2+json'], {}) == (protocol.V2, 'json', 'gaza.v2+json')
+
+
+def test_first_supported_subprotocol_wins():
+    assert protocol.negotiate(['chat', 'gaza.v2+json', 'gaza.v2+msgpack'], {})[2] == 'gaza.v2+json'
+
+
+def test_msgpack_subprotocol():
+    pytest.importorskip('msgpack')
+    assert protocol.negotiate(['gaza.v2+msgpack'], {}) == (protocol.V2, 'msgpack', 'gaza.v2+msgpack')
+
+
+def test_msgpack_falls_back_to_json_without_the_package(monkeypatch):
+    monkeypatch.setattr(protocol, 'msgpack', None)
+    assert protocol.negotiate(['gaza.v2+msgpack', 'gaza.v2+json'], {}) == (protocol.V2, 'json', 'gaza.v2+json')
+    assert protocol.negotiate([], {'protocol': 'v2', 'format': 'msgpack'}) == (protocol.V2, 'json', None)
+
+
+def test_query_parameters_for_clients_without_subprotocols():
+    assert protocol.negotiate([], {'protocol': 'v2'}) == (protocol.V2, 'json', None)
+    assert protocol.negotiate([], {'protocol': 'v1'}) == (protocol.LEGACY, 'json', None)
+
+
+@pytest.mark.parametrize('fmt', ['json', 'msgpack'])
+def test_frames_round_trip(fmt):
+    if fmt == 'msgpack':
+        pytest.importorskip('msgpack')
+    frame = {'type': 'result', 'company': 'Nestlé', 'boycott': True, 'alternatives': [{'product_name': 'x'}]}
+    text_data, bytes_data = protocol.encode(frame, fmt)
+    assert (text_data is None) == (fmt == 'msgpack')
+    assert protocol.decode(text_data, bytes_data, fmt) == frame
+
+
+def result(**fields):
+    values = {'status': 'ok', 'company': 'Acme', 'product_type': 'Coffee', 'boycott': True,
+              'cause': 'cause', 'error': None, 'alternative': None}
+    values.update(fields)
+    return values
+
+
+def test_envelope_leaves_out_empty_fields():
+    envelope = protocol.result_envelope(result(alternative=[]), request_id='r1')
+    assert envelope == {'type': 'result', 'request_id': 'r1', 'status': 'ok', 'company': 'Acme',
+                        'product_type': 'Coffee', 'boycott': True, 'cause': 'cause'}
+
+
+def test_delta_sends_only_what_changed():
+    sent = {}
+    verdict = protocol.result_fields(result())
+    first = protocol.result_delta(verdict, sent, request_id='r1')
+    assert first['fields'] == verdict
+    assert 'done' not in first
+
+    alternatives = [{'product_name': 'Local Coffee'}]
+    final = protocol.result_fields(result(alternative=alternatives))
+    second = protocol.result_delta(final, sent, request_id='r1', done=True)
+    assert second == {'type': 'delta', 'fields': {'alternatives': alternatives}, 'request_id': 'r1', 'done': True}
+    assert sent == final
+
+
+def test_delta_of_a_changed_status():
+    sent = {}
+    protocol.result_delta(protocol.result_fields(result()), sent)
+    delta = protocol.result_delta(protocol.result_fields(result(status='partial')), sent, done=True)
+    assert delta['fields'] == {'status': 'partial'}
@@ -0,0 +1,83 @@
+from analyzer.utils.rate_limit import InMemoryBackend, SQLiteBackend, TokenBucketLimiter
+
+
+def test_bucket_allows_burst_then_refills():
+    backend = InMemoryBackend()
+    # One token per second, bursts of 3
+    allowed = [backend.take('ip', 1.0, 3, 1, now=100.0) for _ in range(4)]
+    assert allowed == [True, True, True, False]
+
+    assert not backend.take('ip', 1.0, 3, 1, now=100.5)
+    assert backend.take('ip', 1.0, 3, 1, now=101.5)
+
+
+def test_bucket_never_holds_more_than_capacity():
+    backend = InMemoryBackend()
+    backend.take('ip', 1.0, 2, 2, now=0.0)
+    # An hour idle refills to the burst size, not to 3600 tokens
+    assert backend.take('ip', 1.0, 2, 2, now=3600.0)
+    assert not backend.take('ip', 1.0, 2, 1, now=3600.0)
+
+
+def test_costly_events_take_several_tokens():
+    backend = InMemoryBackend()
+    assert backend.take('ip', 1.0, 5, 4, now=0.0)
+    assert not backend.take('ip', 1.0, 5, 4, now=0.0)
+    assert backend.take('ip', 1.0, 5, 1, now=0.0)
+
+
+def test_keys_have_separate_buckets():
+    backend = InMemoryBackend()
+    assert backend.take('a', 1.0, 1, 1, now=0.0)
+    assert not backend.take('a', 1.0, 1, 1, now=0.0)
+    assert backend.take('b', 1.0, 1, 1, now=0.0)
+
+
+def test_least_recently_used_buckets_are_evicted():
+    backend = InMemoryBackend(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        backend.take(key, 1.0, 1, 1, now=0.0)
+    assert len(backend) == 2
+    # 'a' was evicted, so it starts again from a full bucket
+    assert backend.take('a', 1.0, 1, 1, now=0.0)
+
+
+def test_idle_buckets_expire():
+    backend = InMemoryBackend(ttl=10)
+    backend.take('a', 1.0, 1, 1, now=0.0)
+    backend.take('b', 1.0, 1, 1, now=20.0)
+    assert len(backend) == 1
+
+
+def test_sqlite_buckets_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'buckets.sqlite3')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    assert first.take('ip', 1.0, 2, 1, now=0.0)
+    assert second.take('ip', 1.0, 2, 1, now=0.0)
+    assert not first.take('ip', 1.0, 2, 1, now=0.0)
+    assert second.take('ip', 1.0, 2, 1, now=1.0)
+
+
+def test_limiter_uses_its_rate_per_minute():
+    limiter = TokenBucketLimiter('msg', per_minute=60, burst=2, backend=InMemoryBackend())
+    assert limiter.allow('ip')
+    assert limiter.allow('ip')
+    assert not limiter.allow('ip')
+
+
+def test_limiter_fails_open_when_the_backend_fails():
+    class BrokenBackend:
+        is_local = False
+
+        def take(self, *args):
+            raise ConnectionError("redis down")
+
+    limiter = TokenBucketLimiter('msg', per_minute=1, burst=1, backend=BrokenBackend())
+    assert limiter.allow('ip')
+    assert limiter.allow('ip')
+
+
+async def test_async_limiter():
+    limiter = TokenBucketLimiter('conn', per_minute=60, burst=1, backend=InMemoryBackend())
+    assert await limiter.aallow('ip')
+    assert not await limiter.aallow('ip')
@@ -0,0 +1,158 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import pytest
+from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+
+from analyzer import startup
+from analyzer.API import API_keys, message
+from analyzer.API.stub_provider import StubClient
+from analyzer.models import ApiKeys, ProviderCompany, SystemMessage
+
+
+@pytest.fixture
+def steps(monkeypatch, settings):
+    """Replaces the warm-up steps; records the steps run"""
+    settings.WARMUP_ENABLED = True
+    ran = []
+
+    def step(name, error=None):
+        def run():
+            ran.append(name)
+            if error:
+                raise error
+        return name, run
+
+    monkeypatch.setattr(startup, '_warmed', threading.Event())
+    monkeypatch.setattr(startup, 'close_old_connections', lambda: None)
+    monkeypatch.setattr(startup, 'STEPS', (step('first'), step('broken', RuntimeError("down")), step('last')))
+    return ran
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Every test starts without an active key or idle provider clients"""
+    monkeypatch.setattr(API_keys, '_idle_clients', {})
+    monkeypatch.setattr(API_keys, '_active_key', {'key': None, 'version': None})
+    message.invalidate_system_messages()
+    yield API_keys._idle_clients
+    message.invalidate_system_messages()
+
+
+@pytest.fixture
+def stub_key(db):
+    company = ProviderCompany.objects.create(company_name='stub', model_name='stub?latency_ms=0')
+    return ApiKeys.objects.create(api_key='stub-key', provider_company=company)
+
+
+def test_warm_up_runs_every_step_once(steps):
+    startup.warm_up()
+    startup.warm_up()
+
+    # A failing step is logged and the others still run
+    assert steps == ['first', 'broken', 'last']
+
+
+def test_warm_up_can_be_disabled(steps, settings):
+    settings.WARMUP_ENABLED = False
+    startup.warm_up()
+    assert steps == []
+
+
+async def test_lifespan_warms_up_before_startup_completes(monkeypatch):
+    events = []
+    monkeypatch.setattr(startup, 'warm_up', lambda: events.append('warm_up'))
+    monkeypatch.setattr(startup, 'start_background_tasks', lambda: events.append('background'))
+    messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        events.append(message['type'])
+
+    await startup.lifespan({'type': 'lifespan'}, receive, send)
+    assert events == ['warm_up', 'background', 'lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+
+@pytest.mark.parametrize('scope_type, started', [('http', True), ('websocket', True), ('lifespan', False)])
+async def test_background_tasks_start_on_the_first_connection(monkeypatch, scope_type, started):
+    calls = []
+    monkeypatch.setattr(startup, 'start_background_tasks', lambda: calls.append(scope_type))
+
+    async def app(scope, receive, send):
+        return scope['type']
+
+    assert await startup.with_background_tasks(app)({'type': scope_type}, None, None) == scope_type
+    assert bool(calls) == started
+
+
+@pytest.mark.parametrize('url', ['', '/media', 'example.com', 'ftp://example.com'])
+def test_configuration_needs_an_absolute_public_url(settings, url):
+    settings.PUBLIC_BASE_URL = url
+    with pytest.raises(ImproperlyConfigured):
+        startup.check_configuration()
+
+
+def test_system_messages_are_cached_until_one_is_saved(db, pool, django_capture_on_commit_callbacks):
+    prompt = SystemMessage.objects.create(name='company_analysis', profile='compact', message='Short prompt')
+    assert message.load_system_message('company_analysis', 'compact') == 'Short prompt'
+
+    SystemMessage.objects.filter(pk=prompt.pk).update(message='Changed behind the cache')
+    assert message.load_system_message('company_analysis', 'compact') == 'Short prompt'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        prompt.message = 'Saved prompt'
+        prompt.save()
+    assert message.load_system_message('company_analysis', 'compact') == 'Saved prompt'
+
+
+def test_prompts_are_warmed_for_every_profile(pool, stub_key, settings, django_assert_num_queries):
+    settings.PROMPT_PROFILE = 'verbose'
+    ProviderCompany.objects.create(company_name='groq', model_name='llama', prompt_profile='compact')
+
+    startup._warm_prompts()
+
+    assert {profile for _, profile in message._prompts} == {'verbose', 'compact'}
+    with django_assert_num_queries(0):
+        message.load_system_message('company_analysis', 'compact')
+
+
+def test_warm_key_leaves_an_idle_client(pool, stub_key):
+    assert API_keys.warm_active_key() == stub_key
+    assert API_keys._active_key['key'] == stub_key
+
+    client, model = API_keys.acquire_client(stub_key)
+    assert isinstance(client, StubClient)
+    assert model == 'stub?latency_ms=0'
+    assert pool[API_keys._client_key(stub_key)] == []
+
+
+def test_idle_clients_are_capped_per_key(pool, stub_key, settings):
+    settings.PROVIDER_IDLE_CLIENTS = 1
+    kept, extra = API_keys.initialize_client(stub_key), API_keys.initialize_client(stub_key)
+
+    API_keys.release_client(stub_key, *kept)
+    API_keys.release_client(stub_key, *extra)
+
+    assert API_keys.acquire_client(stub_key) == kept
+    assert extra[0]._closed.is_set()
+
+
+def test_provider_sdks_are_not_imported_with_the_application():
+    script = textwrap.dedent("""
+        import sys
+        import image_analyzer.asgi
+        print(sorted(name for name in ('groq', 'huggingface_hub', 'cairosvg') if name in sys.modules))
+    """)
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='image_analyzer.settings', WARMUP_ENABLED='False')
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=django_settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=60,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[]'
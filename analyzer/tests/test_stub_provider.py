@@ -0,0 +1,121 @@
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from analyzer.API.API_keys import initialize_client
+from analyzer.API.stub_provider import CANNED_VERDICTS, StubClient, parse_spec
+
+
+def company_message(name):
+    return [
+        {'role': 'system', 'content': 'You are a helpful assistant.'},
+        {'role': 'user', 'content': f"Analyze this company: {name}. IMPORTANT: Respond in English language."},
+    ]
+
+
+def complete(client, messages):
+    return client.chat.completions.create(model='stub', messages=messages)
+
+
+def stub(query='latency_ms=0', seed=1):
+    return StubClient('stub-key', f'stub?{query}', rng=random.Random(seed))
+
+
+def test_spec_is_read_from_the_model_name():
+    spec = parse_spec('stub?latency_ms=1500&jitter_ms=500&dist=lognormal&p429=0.02&boycott=1')
+
+    assert (spec['latency'], spec['jitter'], spec['dist']) == (1.5, 0.5, 'lognormal')
+    assert (spec['p429'], spec['p401'], spec['ptimeout'], spec['boycott']) == (0.02, 0, 0, 1.0)
+    assert parse_spec('stub')['latency'] == 1.0
+
+
+def test_company_verdicts_echo_the_name_and_are_stable():
+    client = stub('latency_ms=0&boycott=0.5')
+    answers = {name: complete(client, company_message(name)).choices[0].message.content
+               for name in ('Acme', 'Other Brand', 'Third Brand', 'Fourth Brand')}
+
+    for name, answer in answers.items():
+        assert f", {name}, $, Coffee, " in answer
+        assert complete(stub(seed=2, query='latency_ms=0&boycott=0.5'), company_message(name)).choices[0].message.content == answer
+
+
+@pytest.mark.parametrize('share, verdict', [(1, '[True'), (0, '[False')])
+def test_boycott_share_decides_the_verdict(share, verdict):
+    answer = complete(stub(f'latency_ms=0&boycott={share}'), company_message('Acme')).choices[0].message.content
+    assert answer.startswith(verdict)
+
+
+def test_translations_prefix_the_language():
+    messages = [{'role': 'user', 'content': f"Translate into Arabic: {json.dumps(['Coffee', 'Cause'])}"}]
+    answer = complete(stub(), messages).choices[0].message.content
+
+    assert json.loads(answer) == ['[Arabic] Coffee', '[Arabic] Cause']
+
+
+def test_images_get_a_canned_verdict():
+    messages = [{'role': 'user', 'content': [{'type': 'image_url', 'image_url': {'url': 'https://example.com/a.jpg'}}]}]
+    assert complete(stub(), messages).choices[0].message.content in CANNED_VERDICTS
+
+
+def test_usage_is_reported():
+    completion = complete(stub(), company_message('Acme'))
+    assert completion.usage.prompt_tokens > 0 and completion.usage.completion_tokens > 0
+
+
+@pytest.mark.parametrize('query, error, status', [
+    ('p429=1', requests.HTTPError, 429),
+    ('p401=1', requests.HTTPError, 401),
+    ('ptimeout=1&timeout_ms=0', requests.exceptions.Timeout, None),
+])
+def test_failures_are_raised_like_a_real_provider(query, error, status):
+    with pytest.raises(error) as raised:
+        complete(stub(f'latency_ms=0&{query}'), company_message('Acme'))
+    if status:
+        assert raised.value.response.status_code == status
+
+
+@pytest.mark.parametrize('dist', ['fixed', 'uniform', 'normal', 'lognormal'])
+def test_latency_follows_the_distribution(dist):
+    client = stub(f'latency_ms=100&jitter_ms=200&dist={dist}')
+    latencies = [client._latency() for _ in range(200)]
+
+    assert min(latencies) >= 0
+    if dist == 'fixed':
+        assert set(latencies) == {0.1}
+    else:
+        assert len(set(latencies)) > 1
+
+
+def test_close_interrupts_a_sleeping_call():
+    client = stub('latency_ms=10000')
+    errors = []
+
+    def call():
+        try:
+            complete(client, company_message('Acme'))
+        except requests.exceptions.ConnectionError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=call)
+    started = time.monotonic()
+    thread.start()
+    client.close()
+    thread.join(timeout=5)
+
+    assert errors and time.monotonic() - started < 5
+
+
+def test_stub_company_is_selected_like_a_provider():
+    key = SimpleNamespace(api_key='stub-key', provider_company=SimpleNamespace(
+        company_name='Stub', model_name='stub?latency_ms=0&boycott=1',
+    ))
+    client, model = initialize_client(key)
+
+    assert isinstance(client, StubClient)
+    assert model == 'stub?latency_ms=0&boycott=1'
+    assert client.spec['boycott'] == 1.0
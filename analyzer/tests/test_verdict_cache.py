@@ -0,0 +1,211 @@
+import asyncio
+import base64
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from analyzer.imgProcessor import convert_and_resize_image
+from analyzer.utils import verdict_cache
+from analyzer.utils.admission import AdmissionRejected
+from analyzer.utils.deadline import Deadline, DeadlineExceeded
+from analyzer.utils.popularity import popularity, scan_key
+
+VERDICT = (True, 'Acme', None, 'Coffee', 'cause')
+
+
+class Analysis:
+    """analyze callable for get_or_analyze, finishing when release is set"""
+
+    def __init__(self, verdict=VERDICT, error=None):
+        self.verdict = verdict
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self, on_position):
+        self.calls += 1
+        self.on_position = on_position
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.verdict
+
+
+async def joined(key, waiters):
+    """Wait until waiters requests wait for the call of key; each joins once its cache lookup on a thread returned"""
+    while key not in verdict_cache._inflight or verdict_cache._inflight[key].waiters < waiters:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0)
+
+
+async def test_cached_verdict_is_served_without_analysis():
+    key = verdict_cache.text_key('Acme')
+    verdict_cache.store(key, VERDICT)
+    analysis = Analysis()
+
+    assert await verdict_cache.get_or_analyze(key, analysis) == VERDICT
+    assert analysis.calls == 0
+
+
+async def test_text_keys_ignore_case_and_suffixes():
+    assert verdict_cache.text_key('Nestlé SA') == verdict_cache.text_key('nestle')
+
+
+async def test_concurrent_misses_share_one_call():
+    key = verdict_cache.text_key('Shared One')
+    analysis = Analysis()
+    waiters = [asyncio.ensure_future(verdict_cache.get_or_analyze(key, analysis)) for _ in range(3)]
+    await joined(key, 3)
+    analysis.release.set()
+
+    assert await asyncio.gather(*waiters) == [VERDICT] * 3
+    assert analysis.calls == 1
+    assert verdict_cache.lookup(key)[0] == VERDICT
+
+
+async def test_only_the_first_request_calls_the_provider():
+    key = verdict_cache.text_key('Shared Two')
+    first, second = Analysis(), Analysis()
+    waiters = [asyncio.ensure_future(verdict_cache.get_or_analyze(key, first))]
+    await joined(key, 1)
+    waiters.append(asyncio.ensure_future(verdict_cache.get_or_analyze(key, second)))
+    await joined(key, 2)
+    first.release.set()
+
+    assert await asyncio.gather(*waiters) == [VERDICT] * 2
+    assert (first.calls, second.calls) == (1, 0)
+
+
+@pytest.mark.parametrize('error', [AdmissionRejected("busy"), DeadlineExceeded("out of time")])
+async def test_starter_failure_is_its_own(error):
+    key = verdict_cache.text_key('Shared Six')
+    analysis = Analysis(error=error)
+    analysis.release.set()
+
+    with pytest.raises(type(error)):
+        await verdict_cache.get_or_analyze(key, analysis, deadline=Deadline(5))
+
+
+@pytest.mark.parametrize('error', [AdmissionRejected("busy"), DeadlineExceeded("out of time")])
+async def test_joined_request_with_time_left_starts_its_own_call(error):
+    key = verdict_cache.text_key('Shared Seven')
+    starter, joiner = Analysis(error=error), Analysis()
+    joiner.release.set()
+    first = asyncio.ensure_future(verdict_cache.get_or_analyze(key, starter, deadline=Deadline(5)))
+    await joined(key, 1)
+    second = asyncio.ensure_future(verdict_cache.get_or_analyze(key, joiner, deadline=Deadline(5)))
+    await joined(key, 2)
+    starter.release.set()
+
+    with pytest.raises(type(error)):
+        await first
+    assert await second == VERDICT
+    assert joiner.calls == 1
+
+
+async def test_waiter_that_runs_out_of_time_leaves_the_call_to_the_others():
+    key = verdict_cache.text_key('Shared Three')
+    analysis = Analysis()
+    patient = asyncio.ensure_future(verdict_cache.get_or_analyze(key, analysis, deadline=Deadline(5)))
+    hurried = asyncio.ensure_future(verdict_cache.get_or_analyze(key, analysis, deadline=Deadline(0.05)))
+
+    with pytest.raises(DeadlineExceeded):
+        await hurried
+    assert not analysis.cancelled
+
+    analysis.release.set()
+    assert await patient == VERDICT
+    assert analysis.calls == 1
+
+
+async def test_call_is_cancelled_when_every_waiter_is_gone():
+    key = verdict_cache.text_key('Shared Four')
+    first = Analysis()
+    waiter = asyncio.ensure_future(verdict_cache.get_or_analyze(key, first))
+    await joined(key, 1)
+    waiter.cancel()
+    await asyncio.sleep(0.01)
+
+    assert first.cancelled
+    # The next request starts a new call instead of joining the cancelled one
+    second = Analysis()
+    second.release.set()
+    assert await verdict_cache.get_or_analyze(key, second) == VERDICT
+    assert second.calls == 1
+
+
+async def test_unrecognized_verdicts_are_not_cached():
+    key = verdict_cache.text_key('Nobody Knows')
+    analysis = Analysis(verdict=(False, False, None, None, None))
+    analysis.release.set()
+
+    await verdict_cache.get_or_analyze(key, analysis)
+    assert verdict_cache.lookup(key) is None
+
+
+async def test_queue_positions_reach_every_waiter():
+    key = verdict_cache.text_key('Shared Five')
+    analysis = Analysis()
+    heard = {'a': [], 'b': []}
+
+    def listener(name):
+        async def on_queue(position, wait):
+            heard[name].append(position)
+        return on_queue
+
+    waiters = [
+        asyncio.ensure_future(verdict_cache.get_or_analyze(key, analysis, on_queue=listener(name)))
+        for name in heard
+    ]
+    await joined(key, 2)
+    await analysis.on_position(3, 2.0)
+    analysis.release.set()
+    await asyncio.gather(*waiters)
+
+    assert heard == {'a': [3], 'b': [3]}
+
+
+def jpeg(image, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', **options)
+    return buffer.getvalue()
+
+
+async def test_scans_alike_are_counted_together_but_cached_apart(monkeypatch):
+    from analyzer import pipeline
+
+    calls = []
+
+    async def analyze_img(image_url, language, deadline):
+        calls.append(image_url)
+        return "[True, Acme, $, Coffee, cause]"
+
+    async def alternatives(product_type, country=None, deadline=None):
+        return []
+
+    monkeypatch.setattr(pipeline, 'analyze_img', analyze_img)
+    monkeypatch.setattr(pipeline, 'get_alternatives_for_boycott_product', alternatives)
+
+    pattern = random.Random(1948).randbytes(16 * 12 * 3)
+    photo = Image.frombytes('RGB', (16, 12), pattern).resize((400, 300), Image.BICUBIC)
+    scans = [jpeg(photo, quality=95), jpeg(photo.resize((600, 450)), quality=60)]
+    converted = [convert_and_resize_image(scan) for scan in scans]
+    # Different bytes after resizing, but the same perceptual hash
+    assert converted[0][2] != converted[1][2]
+    assert converted[0][3] == converted[1][3]
+
+    for scan in scans:
+        result = await pipeline.run_analysis({'image_data': base64.b64encode(scan).decode('ascii')})
+        assert result['status'] == 'ok'
+
+    # Each image gets its own verdict, and both count towards one popular query
+    assert len(calls) == 2
+    digest = converted[0][2].rsplit('.', 1)[0]
+    assert popularity.get(scan_key(digest, converted[0][3]))[0] >= 2
@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+
+from analyzer.utils.write_behind import WriteBehindQueue
+
+
+def make_queue(**options):
+    options.setdefault('backoff', 0.01)
+    return WriteBehindQueue(**options)
+
+
+async def test_runs_submitted_jobs():
+    queue = make_queue()
+    done = []
+    queue.register('record', done.append)
+
+    assert queue.submit('record', 1)
+    assert queue.submit('record', 2)
+    await queue.join()
+
+    assert done == [1, 2]
+    assert queue.stats['completed'] == 2
+
+
+async def test_unknown_job_is_refused():
+    queue = make_queue()
+    with pytest.raises(ValueError):
+        queue.submit('missing')
+
+
+async def test_failed_job_is_retried_until_it_succeeds():
+    queue = make_queue(max_retries=3)
+    attempts = []
+
+    def flaky(value):
+        attempts.append(value)
+        if len(attempts) < 3:
+            raise OSError("disk busy")
+
+    queue.register('flaky', flaky)
+    queue.submit('flaky', 'x')
+    for _ in range(100):
+        if queue.stats['completed']:
+            break
+        await asyncio.sleep(0.01)
+
+    assert attempts == ['x', 'x', 'x']
+    assert queue.stats['retried'] == 2
+    assert queue.stats['completed'] == 1
+    assert queue.stats['failed'] == 0
+
+
+async def test_job_fails_after_max_retries():
+    queue = make_queue(max_retries=2)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise OSError("gone")
+
+    queue.register('broken', broken)
+    queue.submit('broken')
+    for _ in range(100):
+        if queue.stats['failed']:
+            break
+        await asyncio.sleep(0.01)
+
+    assert len(attempts) == 3
+    assert queue.stats['failed'] == 1
+
+
+async def test_full_queue_drops_newest():
+    queue = make_queue(maxsize=1, overflow='drop_newest')
+    queue.register('noop', lambda value: None)
+
+    assert queue.submit('noop', 1)
+    assert not queue.submit('noop', 2)
+    assert queue.stats['dropped'] == 1
+
+
+async def test_full_queue_drops_oldest():
+    queue = make_queue(maxsize=1, overflow='drop_oldest')
+    done = []
+    queue.register('record', done.append)
+
+    queue.submit('record', 1)
+    assert queue.submit('record', 2)
+    await queue.join()
+
+    assert done == [2]
+    assert queue.stats['dropped'] == 1
+
+
+async def test_full_queue_spills_and_replays_on_restart(tmp_path):
+    spill_path = tmp_path / 'spill.jsonl'
+    queue = make_queue(maxsize=1, overflow='spill', spill_path=str(spill_path))
+    queue.register('noop', lambda value: None)
+
+    queue.submit('noop', 'kept')
+    assert not queue.submit('noop', 'spilled')
+    assert queue.stats['spilled'] == 1
+    assert [json.loads(line) for line in spill_path.read_text().splitlines()] == [
+        {'job': 'noop', 'args': ['spilled']},
+    ]
+
+    # A new process replays the spilled jobs when its queue starts
+    done = []
+    restarted = make_queue(maxsize=10, spill_path=str(spill_path))
+    restarted.register('noop', done.append)
+    restarted.submit('noop', 'new')
+    await restarted.join()
+
+    assert done == ['spilled', 'new']
+    assert not spill_path.exists()
@@ -1,8 +1,13 @@
 from django.urls import path
-from .views import home_view
+from .views import AlternativesView, BulkCheckView, catalog_view, home_view, image_view, metrics_view
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('', home_view, name='home'),
+    path('images/<str:digest>.jpeg', image_view, name='image'),
+    path('api/check/', BulkCheckView.as_view(), name='bulk-check'),
+    path('api/alternatives/', AlternativesView.as_view(), name='alternatives'),
+    path('api/catalog/', catalog_view, name='catalog'),
+    path('metrics', metrics_view, name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+
+from analyzer.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued"""
+
+
+class _Ticket:
+    __slots__ = ('client_key', 'cost_class', 'cost', 'future', 'on_position', 'position', 'enqueued')
+
+    def __init__(self, client_key, cost_class, cost, on_position):
+        self.client_key = client_key
+        self.cost_class = cost_class
+        self.cost = cost
+        self.future = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = None
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Admission control in front of the LLM provider.
+
+    At most `capacity` cost units run at once; an image query costs more
+    units than a text query. Waiting requests are queued per client and
+    clients are served round robin, so one client sending many scans cannot
+    starve the others. Before queueing, the expected wait is estimated from
+    the work ahead and the recent service time; a request that would not
+    start before its deadline, or that finds the queue full, is rejected at
+    once instead of timing out later.
+    """
+
+    def __init__(self, capacity, max_queue, costs, initial_service_time=5.0):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.costs = costs
+        self.stats = Counter()
+        self._in_use = 0
+        self._queued = 0
+        self._clients = OrderedDict()
+        self._callbacks = set()
+        self._service_time = {cost_class: initial_service_time for cost_class in costs}
+
+    @asynccontextmanager
+    async def admit(self, client_key, cost_class, deadline=None, on_position=None):
+        """
+        Wait for a slot and hold it for the duration of the block.
+
+        Args:
+            client_key: Fairness key, e.g. the client IP
+            cost_class: One of the keys of `costs`, e.g. 'text' or 'image'
+            deadline: time.monotonic() value by which the work must be done
+            on_position: Async callback called with (position, expected wait)
+                while the request is queued
+        """
+        ticket = await self._acquire(client_key, cost_class, deadline, on_position)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(ticket, time.monotonic() - start)
+
+    def expected_wait(self, client_key, cost):
+        """Seconds until a new request of `cost` units from `client_key` would start"""
+        work_ahead = self._work_ahead(client_key, len(self._clients.get(client_key, ())) + 1)
+        backlog = self._in_use + work_ahead + cost - self.capacity
+        if backlog <= 0:
+            return 0.0
+        return backlog * self._unit_time() / self.capacity
+
+    async def _acquire(self, client_key, cost_class, deadline, on_position):
+        cost = min(self.costs[cost_class], self.capacity)
+        if not self._clients and self._in_use + cost <= self.capacity:
+            self._in_use += cost
+            self.stats['admitted'] += 1
+            return _Ticket(client_key, cost_class, cost, None)
+
+        if self._queued >= self.max_queue:
+            self.stats['rejected_queue_full'] += 1
+            raise AdmissionRejected("Server busy, please try again later")
+
+        wait = self.expected_wait(client_key, cost)
+        if deadline is not None:
+            remaining = deadline - time.monotonic() - self._service_time[cost_class]
+            if wait > remaining:
+                self.stats['rejected_deadline'] += 1
+                logger.warning("Shedding %s request: expected wait %.1fs exceeds deadline", cost_class, wait)
+                raise AdmissionRejected("Server busy, please try again later")
+
+        ticket = _Ticket(client_key, cost_class, cost, on_position)
+        self._clients.setdefault(client_key, deque()).append(ticket)
+        self._queued += 1
+        self.stats['queued'] += 1
+        self._notify_positions()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Slot was granted just as we were cancelled
+                self._release(ticket, None)
+            else:
+                self._remove(ticket)
+            raise
+        self.stats['admitted'] += 1
+        return ticket
+
+    def _release(self, ticket, service_time):
+        self._in_use -= ticket.cost
+        if service_time is not None:
+            previous = self._service_time[ticket.cost_class]
+            self._service_time[ticket.cost_class] = 0.8 * previous + 0.2 * service_time
+        self._dispatch()
+
+    def _remove(self, ticket):
+        queue = self._clients.get(ticket.client_key)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._clients[ticket.client_key]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant slots round robin over clients while the head request fits"""
+        granted = False
+        while self._clients:
+            client_key, queue = next(iter(self._clients.items()))
+            ticket = queue[0]
+            if self._in_use + ticket.cost > self.capacity:
+                break
+            queue.popleft()
+            self._queued -= 1
+            # Move the client to the back of the rotation
+            del self._clients[client_key]
+            if queue:
+                self._clients[client_key] = queue
+            if ticket.future.done():
+                # Cancelled while queued, skip it
+                continue
+            self._in_use += ticket.cost
+            ticket.future.set_result(None)
+            granted = True
+        if granted:
+            self._notify_positions()
+
+    def _notify_positions(self):
+        for queue in self._clients.values():
+            for index, ticket in enumerate(queue):
+                if ticket.on_position is None:
+                    continue
+                position = self._position(ticket.client_key, index + 1)
+                if position != ticket.position:
+                    ticket.position = position
+                    wait = max(0.0, (self._in_use + self._work_ahead(ticket.client_key, index + 1) + ticket.cost
+                                     - self.capacity) * self._unit_time() / self.capacity)
+                    task = asyncio.ensure_future(ticket.on_position(position, wait))
+                    self._callbacks.add(task)
+                    task.add_done_callback(self._callbacks.discard)
+
+    def _rounds_ahead(self, client_key, rounds):
+        """Requests of other clients served before the `rounds`-th request of client_key"""
+        for other_key, queue in self._clients.items():
+            if other_key != client_key:
+                yield from list(queue)[:rounds]
+
+    def _position(self, client_key, rounds):
+        return sum(1 for _ in self._rounds_ahead(client_key, rounds)) + rounds
+
+    def _work_ahead(self, client_key, rounds):
+        own = list(self._clients.get(client_key, ()))[:rounds - 1]
+        return sum(ticket.cost for ticket in own) + sum(
+            ticket.cost for ticket in self._rounds_ahead(client_key, rounds)
+        )
+
+    def _unit_time(self):
+        # Average seconds one cost unit holds its slot
+        return max(
+            self._service_time[cost_class] / self.costs[cost_class] for cost_class in self.costs
+        )
+
+
+admission = AdmissionController(
+    capacity=settings.ADMISSION_CAPACITY,
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    costs={'text': settings.ADMISSION_COST_TEXT, 'image': settings.ADMISSION_COST_IMAGE},
+)
+metrics.register_collector(metrics.counter_collector(
+    'gaza_admission_total', 'Admission control decisions', admission.stats, 'outcome',
+))
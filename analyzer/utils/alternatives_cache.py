@@ -0,0 +1,329 @@
+import hashlib
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+MAX_ALTERNATIVES = 6
+MAX_MEMO_ENTRIES = 256
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict shared between requests.
+
+    It is a real dict subclass so json.dumps serializes it without copying.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def _rank_key(entry):
+    # Products available in more countries and with an image come first
+    return (-len(entry['countries']), entry['image_url'] is None, entry['id'])
+
+
+class CountrySnapshot:
+    """
+    Alternatives available in one country, grouped by canonical product type.
+
+    `buckets` maps a canonical product type to a pre-ranked tuple of entries.
+    Lookups for a given requested product type are memoized, so repeated
+    queries are a dictionary lookup plus a slice.
+
+    `version` is a digest of the snapshot's data. Every worker building a
+    snapshot from the same rows gets the same version, so it can be used as
+    an HTTP ETag. `built_at` is the time.monotonic() of the build.
+    """
+
+    __slots__ = ('country_id', 'buckets', 'version', 'built_at', '_memo', '_lock')
+
+    def __init__(self, country_id, buckets):
+        self.country_id = country_id
+        self.buckets = MappingProxyType(buckets)
+        self.version = self._digest(buckets)
+        self.built_at = time.monotonic()
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(buckets):
+        digest = hashlib.sha256()
+        for product_type in sorted(buckets):
+            for entry in buckets[product_type]:
+                digest.update(repr((
+                    entry['id'], entry['product_name'], entry['company_name'], entry['product_type'],
+                    entry['company_website'], entry['image_url'], sorted(entry['countries']),
+                )).encode('utf-8'))
+        return digest.hexdigest()[:32]
+
+    def lookup(self, product_type):
+        """Every match for product_type, exact matches first, then similar types by rank"""
+        from analyzer.utils.fuzzy_match import canonical_product_type
+
+        key = canonical_product_type(product_type)
+        if not key:
+            return ()
+
+        result = self._memo.get(key)
+        if result is None:
+            # Matched on the key it is memoized under, so spellings sharing it share the result
+            result = self._match(key)
+            with self._lock:
+                if len(self._memo) >= MAX_MEMO_ENTRIES:
+                    self._memo.clear()
+                self._memo[key] = result
+        return result
+
+    def _match(self, key):
+        from analyzer.utils.fuzzy_match import is_similar_product_type
+
+        exact = self.buckets.get(key, ())
+        similar = []
+        for bucket_type, entries in self.buckets.items():
+            if bucket_type != key and is_similar_product_type(key, bucket_type):
+                similar.extend(entries)
+        similar.sort(key=_rank_key)
+
+        result = []
+        for entry, is_exact in [(e, True) for e in exact] + [(e, False) for e in similar]:
+            result.append(FrozenDict(
+                product_name=entry['product_name'],
+                company_name=entry['company_name'],
+                product_type=entry['product_type'],
+                company_website=entry['company_website'],
+                image_url=entry['image_url'],
+                countries=entry['countries'],
+                is_exact_match=is_exact,
+            ))
+        return tuple(result)
+
+
+class AlternativesSnapshotCache:
+    """
+    Read-mostly snapshot of alternative products per Country.
+
+    Readers never take a lock: snapshots are immutable and swapped in whole.
+    Writers (model signals) only mark countries as dirty; a dirty country is
+    rebuilt with a single query on its next lookup. Snapshots and country
+    names older than max_age seconds are rebuilt too, so a worker that
+    missed an invalidation serves stale data for max_age at most.
+
+    With version_check_interval, lookups also read the version stamp of the
+    data (see cache_sync) at most that often, and every snapshot is marked
+    dirty when another process changed it.
+    """
+
+    def __init__(self, max_age=None, version_check_interval=None):
+        self.max_age = max_age
+        self.version_check_interval = version_check_interval
+        self._lock = threading.RLock()
+        self._countries = MappingProxyType({})
+        self._country_ids = None
+        self._country_ids_at = 0.0
+        self._dirty = frozenset()
+        self._version = None
+        self._version_checked_at = None
+
+    def get(self, country, product_type, limit=MAX_ALTERNATIVES):
+        if not country or not product_type:
+            return ()
+        snapshot = self.snapshot(country)
+        if snapshot is None:
+            return ()
+        return snapshot.lookup(product_type)[:limit]
+
+    def snapshot(self, country):
+        """Current snapshot of a country by name, None for unknown countries"""
+        self._check_version()
+        country_id = self.resolve_country(country)
+        if country_id is None:
+            return None
+
+        snapshot = self._countries.get(country_id)
+        if snapshot is None or country_id in self._dirty or self._expired(snapshot.built_at):
+            snapshot = self._refresh_country(country_id)
+        return snapshot
+
+    def resolve_country(self, name):
+        country_ids = self._country_ids
+        if country_ids is None or self._expired(self._country_ids_at):
+            country_ids = self._load_country_ids()
+        return country_ids.get(name)
+
+    def _expired(self, built_at):
+        return self.max_age is not None and time.monotonic() - built_at > self.max_age
+
+    def _read_version(self):
+        from analyzer.utils.cache_sync import current_version
+
+        if self.version_check_interval is None:
+            return None
+        try:
+            return current_version()
+        except DatabaseError as e:
+            logger.warning("Could not read the alternatives cache version: %s", e)
+            return None
+
+    def _check_version(self):
+        if self.version_check_interval is None:
+            return
+        now = time.monotonic()
+        checked_at = self._version_checked_at
+        if checked_at is not None and now - checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        version = self._read_version()
+        if version is None:
+            return
+        with self._lock:
+            if self._version is not None and version != self._version:
+                logger.info("Alternatives changed in another process, rebuilding every snapshot")
+                self._dirty = frozenset(self._countries)
+                self._country_ids = None
+            self._version = version
+
+    def saw_version(self, version):
+        """Record a version bump of this worker, whose change is already applied"""
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def prewarm(self):
+        """Build snapshots for every country with a single pass over the table."""
+        from analyzer.models import AlternativeProducts
+
+        # Read before the rows, so a change made meanwhile is seen as a new version
+        version = self._read_version()
+        per_country = {}
+        products = (AlternativeProducts.objects
+                    .select_related('company_name', 'product_type')
+                    .prefetch_related('countries'))
+        for product in products:
+            countries = list(product.countries.all())
+            entry = self._make_entry(product, countries)
+            for country in countries:
+                per_country.setdefault(country.id, []).append(entry)
+
+        with self._lock:
+            self._load_country_ids()
+            self._countries = MappingProxyType({
+                country_id: self._make_snapshot(country_id, entries)
+                for country_id, entries in per_country.items()
+            })
+            self._dirty = frozenset()
+            if version is not None:
+                self._version = version
+                self._version_checked_at = time.monotonic()
+        logger.info("Alternatives cache prewarmed for %d countries", len(per_country))
+
+    def invalidate_countries(self, country_ids):
+        country_ids = frozenset(cid for cid in country_ids if cid is not None)
+        if not country_ids:
+            return
+        with self._lock:
+            self._dirty = self._dirty | country_ids
+
+    def invalidate_country_names(self):
+        with self._lock:
+            self._country_ids = None
+
+    def drop_country(self, country_id):
+        with self._lock:
+            countries = dict(self._countries)
+            countries.pop(country_id, None)
+            self._countries = MappingProxyType(countries)
+            self._country_ids = None
+
+    def clear(self):
+        with self._lock:
+            self._countries = MappingProxyType({})
+            self._country_ids = None
+            self._dirty = frozenset()
+
+    def _load_country_ids(self):
+        from analyzer.models import Country
+
+        loaded_at = time.monotonic()
+        country_ids = MappingProxyType(dict(Country.objects.values_list('name', 'id')))
+        self._country_ids = country_ids
+        self._country_ids_at = loaded_at
+        return country_ids
+
+    def _refresh_country(self, country_id):
+        from analyzer.models import AlternativeProducts
+
+        with self._lock:
+            # Clear the dirty flag before reading so a concurrent write
+            # re-marks the country instead of being lost.
+            self._dirty = self._dirty - {country_id}
+
+        products = (AlternativeProducts.objects
+                    .filter(countries__id=country_id)
+                    .select_related('company_name', 'product_type')
+                    .prefetch_related('countries'))
+        entries = [self._make_entry(product, list(product.countries.all())) for product in products]
+        snapshot = self._make_snapshot(country_id, entries)
+
+        with self._lock:
+            countries = dict(self._countries)
+            countries[country_id] = snapshot
+            self._countries = MappingProxyType(countries)
+        return snapshot
+
+    @staticmethod
+    def _make_entry(product, countries):
+        return FrozenDict(
+            id=product.id,
+            product_name=product.product_name,
+            company_name=product.company_name.company_name,
+            product_type=product.product_type.product_type,
+            company_website=product.company_name.website,
+            image_url=product.image_url,
+            countries=tuple(country.name for country in countries),
+        )
+
+    @staticmethod
+    def _make_snapshot(country_id, entries):
+        from analyzer.utils.fuzzy_match import canonical_product_type
+
+        buckets = {}
+        for entry in entries:
+            buckets.setdefault(canonical_product_type(entry['product_type']), []).append(entry)
+        return CountrySnapshot(country_id, {
+            product_type: tuple(sorted(bucket, key=_rank_key))
+            for product_type, bucket in buckets.items()
+        })
+
+
+alternatives_cache = AlternativesSnapshotCache(
+    max_age=settings.ALTERNATIVES_SNAPSHOT_MAX_AGE,
+    # With Redis, changes are broadcast to the workers instead (see cache_sync)
+    version_check_interval=None if settings.USE_REDIS else settings.ALTERNATIVES_VERSION_CHECK_SECONDS,
+)
+
+
+def prewarm_alternatives_cache():
+    """Build the snapshot at startup; a missing or unmigrated DB is not fatal."""
+    try:
+        alternatives_cache.prewarm()
+    except Exception as e:
+        logger.warning("Could not prewarm alternatives cache: %s", e)
@@ -0,0 +1,207 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def alternative_description(country=None):
+    return f'Alternative company identified from image analysis{f" in {country}" if country else ""}'
+
+
+class AlternativeBulkWriter:
+    """
+    Buffers learned alternatives and writes them in coalesced batches.
+
+    Each pending item is a (company name, product type, country, image url)
+    tuple, deduplicated on the first three. The buffer is flushed when it
+    holds `flush_size` items or `flush_interval` seconds after the first
+    pending item, whichever comes first. A flush is one transaction with a
+    bulk_create per table and one bulk insert into the countries M2M table,
+    instead of four get_or_create calls and an M2M add per scan.
+    """
+
+    def __init__(self, flush_size=50, flush_interval=5.0, max_pending=1000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = Counter()
+        self.last_flush_size = 0
+        self.last_flush_seconds = 0.0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def add(self, company_name, product_type, country=None, image_url=None):
+        key = (company_name, product_type, country)
+        with self._lock:
+            # Re-inserting moves a duplicate to the end, so eviction drops the oldest item
+            previous_url = self._pending.pop(key, None)
+            self._pending[key] = image_url or previous_url
+            self.stats['added'] += 1
+            if len(self._pending) > self.max_pending:
+                self._pending.pop(next(iter(self._pending)))
+                self.stats['dropped'] += 1
+            should_flush = len(self._pending) >= self.flush_size
+            if not should_flush and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._timer_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write every pending item. Returns the number of items flushed."""
+        with self._flush_lock:
+            with self._lock:
+                items = self._pending
+                self._pending = {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not items:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                country_ids = self._write(items)
+            except Exception as e:
+                self.stats['failed_flushes'] += 1
+                logger.error("Bulk write of %d alternatives failed: %s", len(items), e)
+                with self._lock:
+                    # Keep failed items for the next flush, newer items win
+                    items.update(self._pending)
+                    self._pending = items
+                return 0
+
+            elapsed = time.perf_counter() - start
+            self.last_flush_size = len(items)
+            self.last_flush_seconds = elapsed
+            self.stats['flushes'] += 1
+            self.stats['flushed_items'] += len(items)
+            self.stats['write_ms'] += int(elapsed * 1000)
+            logger.info("Flushed %d alternatives in %.1f ms", len(items), elapsed * 1000)
+
+        from analyzer.utils.cache_sync import invalidate_alternatives
+        # bulk_create does not send model signals, so invalidate explicitly
+        invalidate_alternatives(country_ids, country_names=True)
+        return len(items)
+
+    def _timer_flush(self):
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def _write(self, items):
+        from analyzer.models import AlternativeCompanies, AlternativeProducts, Country, ProductType
+
+        CountryLinks = AlternativeProducts.countries.through
+        company_names = {company for company, _, _ in items}
+        type_names = {product_type for _, product_type, _ in items}
+        country_names = {country for _, _, country in items if country}
+        # A new company is described with the country of its first scan, as in save_product_as_alternative_sync
+        first_country = {}
+        for company, _, country in items:
+            first_country.setdefault(company, country)
+
+        with transaction.atomic():
+            companies = self._get_or_bulk_create(
+                AlternativeCompanies, 'company_name', company_names,
+                lambda name: AlternativeCompanies(
+                    company_name=name,
+                    description=alternative_description(first_country[name]),
+                ),
+            )
+            types = self._get_or_bulk_create(
+                ProductType, 'product_type', type_names,
+                lambda name: ProductType(product_type=name),
+            )
+            countries = self._get_or_bulk_create(
+                Country, 'name', country_names,
+                lambda name: Country(name=name),
+            )
+
+            wanted = {}
+            for (company, product_type, _), image_url in items.items():
+                product_key = (company, companies[company].id, types[product_type].id)
+                wanted[product_key] = wanted.get(product_key) or image_url
+
+            def existing_products():
+                products = AlternativeProducts.objects.filter(
+                    company_name_id__in=[company_id for _, company_id, _ in wanted],
+                    product_type_id__in=[type_id for _, _, type_id in wanted],
+                )
+                found = {}
+                for product in products:
+                    found.setdefault((product.product_name, product.company_name_id, product.product_type_id), product)
+                return found
+
+            products = existing_products()
+            missing = [key for key in wanted if key not in products]
+            AlternativeProducts.objects.bulk_create([
+                AlternativeProducts(
+                    product_name=name, company_name_id=company_id,
+                    product_type_id=type_id, image_url=wanted[(name, company_id, type_id)],
+                )
+                for name, company_id, type_id in missing
+            ])
+            if missing:
+                products = existing_products()
+
+            without_image = []
+            for key, image_url in wanted.items():
+                product = products[key]
+                if image_url and not product.image_url:
+                    product.image_url = image_url
+                    without_image.append(product)
+            if without_image:
+                AlternativeProducts.objects.bulk_update(without_image, ['image_url'])
+
+            links = []
+            for company, product_type, country in items:
+                if not country:
+                    continue
+                product = products[(company, companies[company].id, types[product_type].id)]
+                links.append(CountryLinks(alternativeproducts_id=product.id, country_id=countries[country].id))
+            CountryLinks.objects.bulk_create(links, ignore_conflicts=True)
+
+            product_ids = [product.id for product in products.values()]
+            return set(
+                CountryLinks.objects.filter(alternativeproducts_id__in=product_ids)
+                .values_list('country_id', flat=True)
+            )
+
+    @staticmethod
+    def _get_or_bulk_create(model, field, names, build):
+        """
+        Rows of model by the unique field, creating the missing ones. Rows
+        created meanwhile by another worker or the admin conflict on the
+        unique constraint and are read back instead.
+        """
+        if not names:
+            return {}
+        found = {getattr(obj, field): obj for obj in model.objects.filter(**{f'{field}__in': names})}
+        missing = [name for name in names if name not in found]
+        if missing:
+            model.objects.bulk_create([build(name) for name in missing], ignore_conflicts=True)
+            found.update({
+                getattr(obj, field): obj
+                for obj in model.objects.filter(**{f'{field}__in': missing})
+            })
+        return found
+
+
+alternative_writer = AlternativeBulkWriter(
+    flush_size=settings.ALTERNATIVE_FLUSH_SIZE,
+    flush_interval=settings.ALTERNATIVE_FLUSH_INTERVAL,
+)
+atexit.register(alternative_writer.flush)
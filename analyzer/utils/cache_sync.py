@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from analyzer.utils.alternatives_cache import alternatives_cache
+
+logger = logging.getLogger(__name__)
+
+GROUP = 'alternatives-cache'
+# CacheVersion row bumped on every invalidation without USE_REDIS
+VERSION_NAME = 'alternatives'
+WORKER_ID = uuid.uuid4().hex
+# Channel layer groups expire, so the listener re-joins well before that
+REJOIN_INTERVAL = 3600
+
+_listener = None
+
+
+def invalidate_alternatives(country_ids=(), country_names=False, dropped=()):
+    """
+    Invalidate alternatives snapshots in this worker and, in multi-worker
+    mode, in every other worker through the shared channel layer. Without
+    Redis, the version stamp in the database is bumped instead, so other
+    processes sharing the database (a server, when this runs in a
+    management command) drop their snapshots on their next version check.
+
+    dropped holds ids of deleted countries, whose snapshots are removed.
+    """
+    country_ids = [country_id for country_id in country_ids if country_id is not None]
+    dropped = [country_id for country_id in dropped if country_id is not None]
+    _apply(country_ids, country_names, dropped)
+    if not (country_ids or country_names or dropped):
+        return
+    if not settings.USE_REDIS:
+        _bump_version()
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(GROUP, {
+            'type': 'alternatives.invalidate',
+            'origin': WORKER_ID,
+            'country_ids': country_ids,
+            'country_names': country_names,
+            'dropped': dropped,
+        })
+    except Exception as e:
+        logger.error("Could not broadcast alternatives cache invalidation: %s", e)
+
+
+def _bump_version():
+    from analyzer.models import CacheVersion
+
+    try:
+        with transaction.atomic():
+            if not CacheVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1):
+                CacheVersion.objects.get_or_create(name=VERSION_NAME)
+                CacheVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+            version = CacheVersion.objects.get(name=VERSION_NAME).version
+    except DatabaseError as e:
+        logger.error("Could not bump the alternatives cache version: %s", e)
+        return
+    # Our own change is already applied to this worker's snapshots
+    alternatives_cache.saw_version(version)
+
+
+def current_version():
+    """Version stamp of the alternatives data, 0 before the first bump"""
+    from analyzer.models import CacheVersion
+    return CacheVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first() or 0
+
+
+def _apply(country_ids, country_names, dropped):
+    for country_id in dropped:
+        alternatives_cache.drop_country(country_id)
+    if country_names:
+        alternatives_cache.invalidate_country_names()
+    if country_ids:
+        alternatives_cache.invalidate_countries(country_ids)
+
+
+def ensure_listener():
+    """Start this worker's invalidation listener, once, on the running loop"""
+    global _listener
+    if not settings.USE_REDIS:
+        return
+    if _listener is None or _listener.done():
+        _listener = asyncio.get_running_loop().create_task(_listen())
+
+
+async def _listen():
+    layer = get_channel_layer()
+    channel = await layer.new_channel()
+    loop = asyncio.get_running_loop()
+    joined = None
+    while True:
+        try:
+            if joined is None or loop.time() - joined > REJOIN_INTERVAL:
+                await layer.group_add(GROUP, channel)
+                joined = loop.time()
+            message = await asyncio.wait_for(layer.receive(channel), timeout=REJOIN_INTERVAL)
+        except asyncio.TimeoutError:
+            continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Alternatives cache listener error: %s", e)
+            await asyncio.sleep(5)
+            continue
+
+        if message.get('origin') != WORKER_ID:
+            _apply(message.get('country_ids', []), message.get('country_names', False), message.get('dropped', []))
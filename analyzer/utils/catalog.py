@@ -0,0 +1,218 @@
+"""
+Versioned offline catalog for on-device matching.
+
+A catalog holds the boycotted companies (normalized names, aliases from
+their products, parent links, causes) and the alternatives per country.
+Every export that changes the data gets the next version number and is
+written as a gzipped JSON bundle, together with deltas from the previous
+CATALOG_KEEP_VERSIONS versions, so an app that has version N only downloads
+what changed since N:
+
+    catalog/manifest.json              latest version and digest
+    catalog/full-<version>.json.gz     whole catalog
+    catalog/delta-<from>-<to>.json.gz  upserts and deletes from <from> to <to>
+
+Sections are maps keyed by id (countries by name); a delta lists, per
+section, the records to upsert and the keys to delete.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from analyzer.utils.fuzzy_match import COMPANY_SUFFIXES, NORMALIZATION_VERSION, normalize_company_name
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+SECTIONS = ('companies', 'alternatives', 'countries')
+
+
+def catalog_dir():
+    return os.path.join(settings.MEDIA_ROOT, settings.CATALOG_DIR)
+
+
+def full_path(version):
+    return os.path.join(catalog_dir(), f"full-{version}.json.gz")
+
+
+def delta_path(from_version, to_version):
+    return os.path.join(catalog_dir(), f"delta-{from_version}-{to_version}.json.gz")
+
+
+def manifest_path():
+    return os.path.join(catalog_dir(), "manifest.json")
+
+
+def build_catalog():
+    """Current catalog sections, read from the database"""
+    from analyzer.models import AlternativeProducts, BoycottCompanies, BoycottProducts, CompanyCauseTranslation
+
+    aliases = {}
+    for company_id, product_name in BoycottProducts.objects.values_list('company_name_id', 'product_name'):
+        alias = normalize_company_name(product_name)
+        if alias:
+            aliases.setdefault(company_id, set()).add(alias)
+
+    translated = {}
+    for company_id, language, cause, source in CompanyCauseTranslation.objects.values_list(
+            'company_id', 'language', 'cause', 'source_cause'):
+        translated.setdefault(company_id, []).append((language, cause, source))
+
+    companies = {}
+    for company in BoycottCompanies.objects.all():
+        normalized = normalize_company_name(company.company_name)
+        causes = {'default': company.cause} if company.cause else {}
+        if company.cause:
+            # Translations of an older cause are left out until they are redone
+            causes.update((language, cause) for language, cause, source in translated.get(company.id, ())
+                          if source == company.cause)
+        companies[str(company.id)] = {
+            'name': company.company_name,
+            'normalized': normalized,
+            'aliases': sorted(aliases.get(company.id, set()) - {normalized}),
+            'parent': company.parent_company_id,
+            'causes': causes,
+        }
+
+    alternatives = {}
+    countries = {}
+    products = (AlternativeProducts.objects
+                .select_related('company_name', 'product_type')
+                .prefetch_related('countries'))
+    for product in products:
+        alternatives[str(product.id)] = {
+            'product_name': product.product_name,
+            'company_name': product.company_name.company_name,
+            'product_type': product.product_type.product_type,
+            'website': product.company_name.website,
+            'image_url': product.image_url,
+        }
+        for country in product.countries.all():
+            countries.setdefault(country.name, []).append(product.id)
+
+    return {
+        'companies': companies,
+        'alternatives': alternatives,
+        'countries': {name: sorted(ids) for name, ids in countries.items()},
+    }
+
+
+def catalog_digest(sections):
+    payload = json.dumps([NORMALIZATION_VERSION, sections], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def make_delta(old_sections, new_sections):
+    """Per section, records that were added or changed and keys that were removed"""
+    delta = {}
+    for section in SECTIONS:
+        old = old_sections.get(section, {})
+        new = new_sections.get(section, {})
+        delta[section] = {
+            'upsert': {key: value for key, value in new.items() if old.get(key) != value},
+            'delete': sorted(key for key in old if key not in new),
+        }
+    return delta
+
+
+def normalization():
+    """What the app needs to normalize names exactly like normalize_company_name"""
+    return {
+        'version': NORMALIZATION_VERSION,
+        'strip_accents': True,
+        'lowercase': True,
+        'word_pattern': r'\b\w+\b',
+        'drop_words': COMPANY_SUFFIXES,
+    }
+
+
+def read_manifest():
+    try:
+        with open(manifest_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_bundle(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_atomic(path, data, compress=True):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    if compress:
+        # mtime=0 keeps the bytes identical for identical data
+        payload = gzip.compress(payload, compresslevel=9, mtime=0)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(payload)
+
+
+def export_catalog(keep=None):
+    """
+    Write a new catalog version if the data changed since the last export.
+
+    Returns:
+        tuple: (manifest, created) where created is False when the catalog
+        was already up to date
+    """
+    keep = settings.CATALOG_KEEP_VERSIONS if keep is None else keep
+    sections = build_catalog()
+    digest = catalog_digest(sections)
+    manifest = read_manifest()
+    if manifest and manifest['digest'] == digest:
+        return manifest, False
+
+    version = manifest['version'] + 1 if manifest else 1
+    created = datetime.now(timezone.utc).isoformat()
+    header = {'format': FORMAT, 'version': version, 'digest': digest, 'created': created}
+
+    size = _write_atomic(full_path(version), dict(header, normalization=normalization(), **sections))
+    logger.info("Catalog version %s written (%d bytes compressed)", version, size)
+
+    previous = [v for v in (manifest or {}).get('versions', []) if v > version - 1 - keep]
+    for old_version in previous:
+        try:
+            old = read_bundle(full_path(old_version))
+        except FileNotFoundError:
+            continue
+        delta = dict(header, base_version=old_version, **make_delta(old, sections))
+        if old.get('normalization') != normalization():
+            delta['normalization'] = normalization()
+        _write_atomic(delta_path(old_version, version), delta)
+
+    versions = previous + [version]
+    manifest = dict(header, versions=versions)
+    _write_atomic(manifest_path(), manifest, compress=False)
+    _prune(versions)
+    return manifest, True
+
+
+def _prune(versions):
+    """Remove bundles of versions that are no longer kept"""
+    kept = set(versions)
+    latest = max(versions)
+    for name in os.listdir(catalog_dir()):
+        parts = name.split('.', 1)[0].split('-')
+        try:
+            if parts[0] == 'full' and int(parts[1]) not in kept:
+                os.remove(os.path.join(catalog_dir(), name))
+            elif parts[0] == 'delta' and (int(parts[1]) not in kept or int(parts[2]) != latest):
+                os.remove(os.path.join(catalog_dir(), name))
+        except (IndexError, ValueError):
+            continue
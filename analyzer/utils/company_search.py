@@ -0,0 +1,236 @@
+"""
+Candidate generation for fuzzy company matching.
+
+check_company_and_get_cause used to score every BoycottCompanies row in
+Python. A search backend instead asks the database for the top
+COMPANY_SEARCH_CANDIDATES names sharing the most trigrams with the query,
+and only those are rescored with calculate_similarity:
+
+    python    every row (the old behaviour, and the fallback)
+    sqlite    an FTS5 trigram table of normalized names kept in sync by triggers
+    postgres  pg_trgm similarity over a GIN index of normalized names
+
+COMPANY_SEARCH_BACKEND=auto picks the backend of the database vendor.
+`manage.py build_search_index` creates the table, triggers or index;
+until it has run, lookups fall back to the python backend. Both
+structures live in the database, so every write (admin, signals,
+bulk_create, import_dataset) keeps them in sync.
+
+Both backends index BoycottCompanies.normalized_name, which the model
+fills with normalize_company_name on save and bulk writes, and query with
+the normalized name, so they find what the rescoring compares. The SQLite
+triggers are plain SQL and work from any client. Rows written outside
+Django without normalized_name are not found until the command runs again.
+
+Names too short to have a trigram ("HP", "3M") are matched by scanning
+every row, as before, on both backends.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from analyzer.utils.fuzzy_match import normalize_company_name
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'analyzer_boycottcompanies'
+FTS_TABLE = 'analyzer_boycottcompanies_names'
+# Table of raw names from before names were normalized, dropped by install()
+LEGACY_FTS_TABLE = 'analyzer_boycottcompanies_fts'
+TRGM_INDEX = 'analyzer_boycottcompanies_normalized_trgm'
+# Index of lower(company_name) from before names were normalized, dropped by install()
+LEGACY_TRGM_INDEX = 'analyzer_boycottcompanies_name_trgm'
+# How long a missing index is assumed missing before it is looked up again
+RECHECK_SECONDS = 60
+
+
+def trigrams(name):
+    """Distinct trigrams of a name normalized like the rescoring does, in order"""
+    return _trigrams(normalize_company_name(name))
+
+
+def _trigrams(normalized):
+    return list(dict.fromkeys(normalized[i:i + 3] for i in range(len(normalized) - 2)))
+
+
+def query_names(names):
+    """Normalized names to search for, or None when one has no trigrams and every row must be scanned"""
+    normalized = [normalize_company_name(name) for name in names if name]
+    if not normalized or not all(_trigrams(name) for name in normalized):
+        return None
+    return normalized
+
+
+def backfill_normalized_names():
+    """Set normalized_name on rows written without it or before normalization changed"""
+    from analyzer.models import BoycottCompanies
+
+    stale = []
+    for company in BoycottCompanies.objects.only('id', 'company_name', 'normalized_name'):
+        normalized = normalize_company_name(company.company_name)
+        if company.normalized_name != normalized:
+            company.normalized_name = normalized
+            stale.append(company)
+    BoycottCompanies.objects.bulk_update(stale, ['normalized_name'], batch_size=1000)
+    if stale:
+        logger.info("Normalized the names of %d companies", len(stale))
+
+
+class PythonSearch:
+    name = 'python'
+
+    def available(self):
+        return True
+
+    def candidate_ids(self, names, limit):
+        return None  # every row
+
+    def install(self):
+        pass
+
+
+class SQLiteTrigramSearch:
+    """FTS5 table of (rowid = company id, normalized name) with the trigram tokenizer"""
+    name = 'sqlite'
+
+    def available(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            return cursor.fetchone() is not None
+
+    def candidate_ids(self, names, limit):
+        names = query_names(names)
+        if names is None:
+            return None
+        grams = list(dict.fromkeys(gram for name in names for gram in _trigrams(name)))
+        # Each trigram is a quoted phrase; bm25 ranks rows sharing more of them first
+        query = ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in grams)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+                [query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def install(self):
+        backfill_normalized_names()
+        with connection.cursor() as cursor:
+            for table in (LEGACY_FTS_TABLE, FTS_TABLE):
+                for trigger in ('insert', 'delete', 'update'):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {table}_{trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {LEGACY_FTS_TABLE}")
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, tokenize = 'trigram')")
+            cursor.execute(
+                f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE} (rowid, name) VALUES (new.id, new.normalized_name); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {TABLE} BEGIN "
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF normalized_name ON {TABLE} BEGIN "
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+                f"INSERT INTO {FTS_TABLE} (rowid, name) VALUES (new.id, new.normalized_name); END"
+            )
+            # Rebuild from the table, for rows written before the triggers existed
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name) SELECT id, normalized_name FROM {TABLE}"
+            )
+
+
+class PostgresTrigramSearch:
+    """pg_trgm similarity, filtered with the % operator through a GIN index on normalized_name"""
+    name = 'postgres'
+
+    def available(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [TRGM_INDEX])
+            return cursor.fetchone() is not None
+
+    def candidate_ids(self, names, limit):
+        names = query_names(names)
+        if names is None:
+            return None
+        ids = {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.similarity_threshold', %s, false)",
+                [str(settings.COMPANY_SEARCH_MIN_SIMILARITY)],
+            )
+            for name in names:
+                cursor.execute(
+                    f"SELECT id, similarity(normalized_name, %s) AS score FROM {TABLE} "
+                    f"WHERE normalized_name %% %s ORDER BY score DESC LIMIT %s",
+                    [name, name, limit],
+                )
+                for company_id, score in cursor.fetchall():
+                    ids[company_id] = max(score, ids.get(company_id, 0))
+        return sorted(ids, key=ids.get, reverse=True)[:limit]
+
+    def install(self):
+        backfill_normalized_names()
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            # Check deferred foreign keys of rows written in this transaction now, CREATE INDEX refuses to run before
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"DROP INDEX IF EXISTS {LEGACY_TRGM_INDEX}")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TRGM_INDEX} ON {TABLE} USING gin (normalized_name gin_trgm_ops)"
+            )
+
+
+BACKENDS = {backend.name: backend for backend in (PythonSearch, SQLiteTrigramSearch, PostgresTrigramSearch)}
+VENDOR_BACKENDS = {'sqlite': 'sqlite', 'postgresql': 'postgres'}
+
+_state = {'backend': None, 'checked_at': None, 'available': False}
+
+
+def get_backend(name=None):
+    """Search backend for COMPANY_SEARCH_BACKEND (or name), resolving auto by database vendor"""
+    name = name or settings.COMPANY_SEARCH_BACKEND
+    if name == 'auto':
+        name = VENDOR_BACKENDS.get(connection.vendor, 'python')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown company search backend: {name}")
+    return BACKENDS[name]()
+
+
+def _active_backend():
+    backend = _state['backend']
+    if backend is None:
+        backend = _state['backend'] = get_backend()
+    now = time.monotonic()
+    if _state['checked_at'] is None or (not _state['available'] and now - _state['checked_at'] > RECHECK_SECONDS):
+        try:
+            _state['available'] = backend.available()
+        except Exception as e:
+            logger.error("Company search backend %s failed its check: %s", backend.name, e)
+            _state['available'] = False
+        _state['checked_at'] = now
+        if not _state['available']:
+            logger.warning("Company search index missing, scanning every company (run manage.py build_search_index)")
+    return backend if _state['available'] else PythonSearch()
+
+
+def candidates(names, limit=None):
+    """
+    BoycottCompanies worth rescoring for any of names, best first for
+    database backends; every company when no index is available.
+    """
+    from analyzer.models import BoycottCompanies
+
+    limit = limit or settings.COMPANY_SEARCH_CANDIDATES
+    backend = _active_backend()
+    try:
+        ids = backend.candidate_ids(names, limit)
+    except Exception as e:
+        logger.error("Company search with %s failed, scanning every company: %s", backend.name, e)
+        ids = None
+    if ids is None:
+        return list(BoycottCompanies.objects.all())
+    companies = BoycottCompanies.objects.in_bulk(ids)
+    return [companies[company_id] for company_id in ids if company_id in companies]
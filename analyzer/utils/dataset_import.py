@@ -0,0 +1,330 @@
+"""
+Streaming import of boycott and alternatives datasets.
+
+Rows are read one at a time from CSV or JSON Lines files (optionally
+gzipped) and written in batches: every batch is one transaction with a
+bulk_create per table, so memory stays flat however long the file is.
+Only the name indexes of companies, product types and countries are held
+in memory, to match rows against what is already in the database.
+
+Companies and products are matched on normalize_company_name, the same
+normalization the analysis uses, so "Nestlé SA" updates "Nestle".
+Product types and countries are matched ignoring case.
+
+Boycott rows: company, cause, parent, product, product_type
+Alternatives rows: company, product, product_type, countries (separated by
+";"), website, description, image_url
+
+Only company is required. Non-empty values overwrite the stored ones.
+"""
+import csv
+import gzip
+import io
+import itertools
+import json
+import time
+from collections import Counter
+
+from django.db import transaction
+
+from analyzer.utils.fuzzy_match import normalize_company_name
+
+KINDS = ('boycott', 'alternatives')
+
+
+class ImportRowError(ValueError):
+    """A row that cannot be imported; the importer skips it and counts it"""
+
+
+def name_key(name):
+    """Key a company or product name is matched on"""
+    return normalize_company_name(name) or name.strip().lower()
+
+
+def read_rows(path):
+    """Yields (line number, row dict) from a .csv or .jsonl file, optionally .gz"""
+    compressed = path.endswith('.gz')
+    base = path[:-3] if compressed else path
+    raw = gzip.open(path, 'rb') if compressed else open(path, 'rb')
+    with io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as f:
+        if base.endswith(('.jsonl', '.ndjson')):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, ImportRowError(f"invalid JSON: {e}")
+                    continue
+                yield line_number, row if isinstance(row, dict) else ImportRowError("not a JSON object")
+        elif base.endswith('.csv'):
+            # Line 1 is the header
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                yield line_number, row
+        else:
+            raise ValueError(f"Unsupported file type: {path} (use .csv or .jsonl, optionally .gz)")
+
+
+def _text(row, field):
+    value = row.get(field)
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+class DatasetImporter:
+    """
+    Upserts dataset rows in batches of `batch_size`.
+
+    stats counts rows read, skipped and imported, and records created and
+    updated per model. touched_countries holds the ids of countries whose
+    alternatives changed, for cache invalidation.
+    """
+
+    def __init__(self, kind, batch_size=1000, dry_run=False):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown dataset kind: {kind}")
+        self.kind = kind
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = Counter()
+        self.errors = []
+        self.touched_countries = set()
+        self._indexes_loaded = False
+
+    def run(self, rows, progress=None):
+        """
+        Import (line number, row) pairs. progress(stats, rows per second) is
+        called after every committed batch.
+        """
+        start = time.perf_counter()
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            self._import_batch(batch)
+            if progress:
+                progress(self.stats, self.stats['rows'] / max(time.perf_counter() - start, 1e-9))
+        return self.stats
+
+    def _import_batch(self, batch):
+        parsed = []
+        for line_number, row in batch:
+            self.stats['rows'] += 1
+            try:
+                if isinstance(row, ImportRowError):
+                    raise row
+                parsed.append(self._parse(row))
+            except ImportRowError as e:
+                self.stats['skipped'] += 1
+                if len(self.errors) < 100:
+                    self.errors.append((line_number, str(e)))
+        if not parsed:
+            return
+
+        # Indexes only grow with what the import creates. A batch that fails
+        # leaves ids of rolled back rows in them, so it ends the import, and
+        # dry runs reload them for every batch.
+        with transaction.atomic():
+            if not self._indexes_loaded:
+                self._load_indexes()
+            if self.kind == 'boycott':
+                self._write_boycott(parsed)
+            else:
+                self._write_alternatives(parsed)
+            if self.dry_run:
+                transaction.set_rollback(True)
+                self._indexes_loaded = False
+        self.stats['imported'] += len(parsed)
+        self.stats['last_line'] = batch[-1][0]
+
+    def _parse(self, row):
+        company = _text(row, 'company')
+        if not company:
+            raise ImportRowError("missing company")
+        parsed = {field: _text(row, field) for field in ('product', 'product_type')}
+        parsed['company'] = company
+        if parsed['product'] and not parsed['product_type']:
+            raise ImportRowError("product without product_type")
+        if self.kind == 'boycott':
+            parsed['cause'] = _text(row, 'cause')
+            parsed['parent'] = _text(row, 'parent')
+        else:
+            if not parsed['product']:
+                raise ImportRowError("missing product")
+            countries = row.get('countries') or ''
+            if isinstance(countries, str):
+                countries = countries.split(';')
+            parsed['countries'] = [str(country).strip() for country in countries if str(country).strip()]
+            for field in ('website', 'description', 'image_url'):
+                parsed[field] = _text(row, field)
+        return parsed
+
+    def _load_indexes(self):
+        from analyzer.models import AlternativeCompanies, BoycottCompanies, Country, ProductType
+
+        company_model = BoycottCompanies if self.kind == 'boycott' else AlternativeCompanies
+        self._companies = {}
+        # Lowest id wins when existing rows normalize to the same name
+        for company_id, name in company_model.objects.order_by('-id').values_list('id', 'company_name'):
+            self._companies[name_key(name)] = company_id
+        self._types = {}
+        for type_id, name in ProductType.objects.order_by('-id').values_list('id', 'product_type'):
+            self._types[name.strip().lower()] = type_id
+        self._countries = {name.lower(): country_id for country_id, name in Country.objects.values_list('id', 'name')}
+        self._indexes_loaded = True
+
+    def _ensure(self, model, field, index, names, key, stat, changes=None):
+        """
+        Bulk create the names missing from index and add their ids to it.
+        changes maps a name key to field values for the created row.
+        """
+        missing = {}
+        for name in names:
+            if name and key(name) not in index:
+                missing.setdefault(key(name), name)
+        if not missing:
+            return
+        objects = [model(**{field: name}, **(changes or {}).get(missing_key, {}))
+                   for missing_key, name in missing.items()]
+        model.objects.bulk_create(objects)
+        if any(obj.pk is None for obj in objects):
+            # Backends that do not return ids from bulk inserts
+            objects = model.objects.filter(**{f'{field}__in': list(missing.values())})
+        for obj in objects:
+            index.setdefault(key(getattr(obj, field)), obj.pk)
+        self.stats[f'{stat}_created'] += len(missing)
+
+    def _ensure_types(self, rows):
+        from analyzer.models import ProductType
+
+        self._ensure(ProductType, 'product_type', self._types, (row['product_type'] for row in rows),
+                     lambda name: name.strip().lower(), 'product_types')
+
+    def _write_boycott(self, rows):
+        from analyzer.models import BoycottCompanies, BoycottProducts
+
+        # Later rows win over earlier rows of the same company
+        causes = {}
+        for row in rows:
+            if row['cause']:
+                causes[name_key(row['company'])] = {'cause': row['cause']}
+        names = [row['company'] for row in rows] + [row['parent'] for row in rows]
+        self._ensure(BoycottCompanies, 'company_name', self._companies, names, name_key, 'companies', causes)
+        self._ensure_types(rows)
+
+        changes = {}
+        for row in rows:
+            company_id = self._companies[name_key(row['company'])]
+            change = changes.setdefault(company_id, {})
+            change.update(causes.get(name_key(row['company']), {}))
+            if row['parent']:
+                parent_id = self._companies[name_key(row['parent'])]
+                if parent_id != company_id:
+                    change['parent_company_id'] = parent_id
+        self._update(BoycottCompanies, changes, 'companies')
+
+        wanted = {}
+        for row in rows:
+            if row['product']:
+                company_id = self._companies[name_key(row['company'])]
+                wanted[(company_id, name_key(row['product']))] = (row['product'], self._types[row['product_type'].lower()])
+        existing = {}
+        for product in BoycottProducts.objects.filter(company_name_id__in={key[0] for key in wanted}):
+            existing.setdefault((product.company_name_id, name_key(product.product_name)), product)
+
+        new, changed = [], []
+        for (company_id, key), (name, type_id) in wanted.items():
+            product = existing.get((company_id, key))
+            if product is None:
+                new.append(BoycottProducts(product_name=name, company_name_id=company_id, product_type_id=type_id))
+            elif product.product_type_id != type_id:
+                product.product_type_id = type_id
+                changed.append(product)
+        BoycottProducts.objects.bulk_create(new)
+        BoycottProducts.objects.bulk_update(changed, ['product_type'])
+        self.stats['products_created'] += len(new)
+        self.stats['products_updated'] += len(changed)
+
+    def _write_alternatives(self, rows):
+        from analyzer.models import AlternativeCompanies, AlternativeProducts, Country
+
+        details = {}
+        for row in rows:
+            detail = details.setdefault(name_key(row['company']), {})
+            for field in ('website', 'description'):
+                if row[field]:
+                    detail[field] = row[field]
+        self._ensure(AlternativeCompanies, 'company_name', self._companies, (row['company'] for row in rows),
+                     name_key, 'companies', details)
+        self._ensure_types(rows)
+        self._ensure(Country, 'name', self._countries,
+                     (country for row in rows for country in row['countries']), str.lower, 'countries')
+        self._update(AlternativeCompanies, {self._companies[key]: detail for key, detail in details.items()},
+                     'companies')
+
+        wanted = {}
+        for row in rows:
+            company_id = self._companies[name_key(row['company'])]
+            key = (company_id, self._types[row['product_type'].lower()], name_key(row['product']))
+            name, image_url, countries = wanted.get(key, (row['product'], '', set()))
+            countries.update(self._countries[country.lower()] for country in row['countries'])
+            wanted[key] = (name, row['image_url'] or image_url, countries)
+
+        def existing_products():
+            found = {}
+            products = AlternativeProducts.objects.filter(company_name_id__in={key[0] for key in wanted})
+            for product in products:
+                key = (product.company_name_id, product.product_type_id, name_key(product.product_name))
+                found.setdefault(key, product)
+            return found
+
+        existing = existing_products()
+        new = [
+            AlternativeProducts(product_name=name, company_name_id=key[0], product_type_id=key[1],
+                                image_url=image_url or None)
+            for key, (name, image_url, _) in wanted.items() if key not in existing
+        ]
+        AlternativeProducts.objects.bulk_create(new)
+        if new:
+            existing = existing_products()
+
+        changed = []
+        for key, (_, image_url, _) in wanted.items():
+            product = existing[key]
+            if image_url and product.image_url != image_url:
+                product.image_url = image_url
+                changed.append(product)
+        AlternativeProducts.objects.bulk_update(changed, ['image_url'])
+        self.stats['products_created'] += len(new)
+        self.stats['products_updated'] += len(changed)
+
+        CountryLinks = AlternativeProducts.countries.through
+        links = [
+            CountryLinks(alternativeproducts_id=existing[key].id, country_id=country_id)
+            for key, (_, _, countries) in wanted.items() for country_id in countries
+        ]
+        CountryLinks.objects.bulk_create(links, ignore_conflicts=True)
+        self.touched_countries.update(link.country_id for link in links)
+        # A changed image shows in every country of the product
+        self.touched_countries.update(
+            CountryLinks.objects.filter(alternativeproducts_id__in=[product.id for product in changed])
+            .values_list('country_id', flat=True)
+        )
+
+    def _update(self, model, changes, stat):
+        """Apply {id: {field: value}} to the rows whose values differ"""
+        changes = {pk: fields for pk, fields in changes.items() if fields}
+        if not changes:
+            return
+        fields = sorted({field for values in changes.values() for field in values})
+        changed = []
+        for obj in model.objects.filter(pk__in=changes).only('pk', *fields):
+            values = changes[obj.pk]
+            if any(getattr(obj, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(obj, field, value)
+                changed.append(obj)
+        model.objects.bulk_update(changed, fields)
+        self.stats[f'{stat}_updated'] += len(changed)
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import close_old_connections
+
+# Each thread keeps its own database connection, so the pool size is also the
+# number of read connections a worker process opens.
+read_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_READ_WORKERS,
+    thread_name_prefix='db-read',
+)
+
+
+class DatabaseReadToAsync(SyncToAsync):
+    """
+    Runs read-only ORM code on a dedicated thread pool.
+
+    database_sync_to_async is thread sensitive: every call in the process is
+    queued onto one shared thread, so a slow query delays all others. Reads
+    don't need that isolation, so they run concurrently on `read_executor`
+    and clean up old connections like database_sync_to_async does. Writes
+    keep using database_sync_to_async or the write-behind queue.
+    """
+
+    def __init__(self, func):
+        super().__init__(func, thread_sensitive=False, executor=read_executor)
+
+    def thread_handler(self, loop, *args, **kwargs):
+        close_old_connections()
+        try:
+            return super().thread_handler(loop, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+
+# Used as a decorator like database_sync_to_async
+database_read_to_async = DatabaseReadToAsync
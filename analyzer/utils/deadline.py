@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when a stage starts or checks in after the request deadline"""
+
+
+class Deadline:
+    """
+    Absolute time.monotonic() deadline of one request.
+
+    Created once when the request arrives and passed down through every
+    stage, so each stage gets what is left of the budget instead of a fixed
+    timeout of its own. It is plain data, safe to read from worker threads.
+    """
+
+    __slots__ = ('expires_at',)
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage="request"):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+    async def run(self, awaitable, stage="request"):
+        """Await `awaitable` within the remaining budget, raising DeadlineExceeded when it runs out"""
+        budget = self.remaining()
+        if budget <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(f"No time left for {stage}")
+        try:
+            return await asyncio.wait_for(awaitable, timeout=budget)
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            raise DeadlineExceeded(f"Deadline exceeded during {stage}") from e
+
+    def reserving(self, seconds):
+        """A deadline `seconds` earlier, for a stage that must leave time to the ones after it"""
+        deadline = Deadline(0)
+        deadline.expires_at = self.expires_at - seconds
+        return deadline
+
+
+async def within(deadline, awaitable, stage="request"):
+    """deadline.run(awaitable), or a plain await when there is no deadline"""
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, stage=stage)
@@ -3,6 +3,16 @@ import re
 from difflib import SequenceMatcher
 from typing import List, Dict, Tuple, Optional
 
+# Words dropped from company names before matching. The offline catalog ships
+# this list so the app normalizes names exactly like the server does; bump
+# NORMALIZATION_VERSION whenever normalize_company_name changes.
+COMPANY_SUFFIXES = [
+    'inc', 'corp', 'corporation', 'company', 'co', 'ltd', 'limited',
+    'llc', 'plc', 'sa', 'ag', 'gmbh', 'bv', 'nv', 'spa', 'srl',
+    'the', 'group', 'international', 'global', 'worldwide'
+]
+NORMALIZATION_VERSION = 1
+
 def normalize_company_name(name):
     """
     Normalize company name for better matching:
@@ -21,16 +31,9 @@ def normalize_company_name(name):
     # Convert to lowercase
     normalized = normalized.lower()
     
-    # Remove common company suffixes and words
-    company_suffixes = [
-        'inc', 'corp', 'corporation', 'company', 'co', 'ltd', 'limited', 
-        'llc', 'plc', 'sa', 'ag', 'gmbh', 'bv', 'nv', 'spa', 'srl',
-        'the', 'group', 'international', 'global', 'worldwide'
-    ]
-    
-    # Split into words and filter out suffixes
+    # Split into words and filter out common company suffixes and words
     words = re.findall(r'\b\w+\b', normalized)
-    filtered_words = [word for word in words if word not in company_suffixes]
+    filtered_words = [word for word in words if word not in COMPANY_SUFFIXES]
     
     # Join back and clean up
     normalized = ' '.join(filtered_words)
@@ -109,6 +112,15 @@ def get_product_type_variations(product_type: str) -> List[str]:
     
     return list(variations)
 
+def canonical_product_type(product_type: str) -> str:
+    """
+    Canonical form of a product type used as a grouping key:
+    lowercase with surrounding and repeated whitespace removed.
+    """
+    if not product_type:
+        return ""
+    return re.sub(r'\s+', ' ', product_type.lower()).strip()
+
 def is_similar_product_type(type1: str, type2: str, threshold: float = 0.7) -> bool:
     """
     Check if two product types are similar using fuzzy matching and variations.
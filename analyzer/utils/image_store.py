@@ -0,0 +1,166 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+
+from analyzer.utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def image_digest(image_bytes):
+    """Content address of an image: sha256 of the resized JPEG bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def image_path(digest):
+    return os.path.join(settings.MEDIA_ROOT, settings.IMAGE_STORE_DIR, digest[:2], f"{digest}.jpeg")
+
+
+def reference_path(digest):
+    """Path of the image a popular scan is refreshed from (see refresh), by its digest"""
+    return os.path.join(settings.MEDIA_ROOT, settings.IMAGE_STORE_DIR, 'refresh', f"{digest}.jpeg")
+
+
+def image_url(digest):
+    return f"{settings.PUBLIC_BASE_URL.rstrip('/')}{reverse('image', args=[digest])}"
+
+
+def check_public_base_url():
+    """Stored image URLs must be absolute: the app cannot load relative ones"""
+    url = urlparse(settings.PUBLIC_BASE_URL)
+    if url.scheme not in ('http', 'https') or not url.netloc:
+        raise ImproperlyConfigured(
+            f"PUBLIC_BASE_URL must be an absolute http(s) URL, got {settings.PUBLIC_BASE_URL!r}"
+        )
+
+
+def store_image(image_base64):
+    """
+    Store a base64 encoded JPEG under its content hash in MEDIA_ROOT.
+
+    Storing the same image again is a no-op, so every product photo is
+    written once however many times it is scanned.
+
+    Returns:
+        tuple: (digest, url, created)
+    """
+    image_bytes = base64.b64decode(image_base64)
+    digest = image_digest(image_bytes)
+    path = image_path(digest)
+
+    if os.path.exists(path):
+        return digest, image_url(digest), False
+
+    _write_atomic(path, image_bytes)
+    logger.info("Stored image %s (%d bytes)", digest, len(image_bytes))
+    return digest, image_url(digest), True
+
+
+def store_reference_image(digest, image_base64):
+    """Keep a base64 encoded JPEG to refresh the verdict of a scan from, unless it is kept already"""
+    path = reference_path(digest)
+    if not os.path.exists(path):
+        _write_atomic(path, base64.b64decode(image_base64))
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file and rename, so readers never see a partial image
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@timed('imgur_upload')
+def mirror_image_to_imgur(digest):
+    """
+    Upload a stored image to Imgur once. The Imgur link is kept next to the
+    image in a `.imgur` file, which also marks the image as mirrored.
+    """
+    from analyzer.utils.imgur_upload import upload_image_to_imgur
+
+    path = image_path(digest)
+    marker_path = f"{path}.imgur"
+    if os.path.exists(marker_path) or not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as image_file:
+        imgur_url = upload_image_to_imgur(base64.b64encode(image_file.read()).decode('utf-8'))
+    if not imgur_url:
+        raise RuntimeError(f"Imgur mirror upload failed for {digest}")
+
+    with open(marker_path, 'w', encoding='utf-8') as marker_file:
+        marker_file.write(imgur_url)
+    return imgur_url
+
+
+def used_digests():
+    """Digests of the stored images an alternative product links to"""
+    from analyzer.models import AlternativeProducts
+
+    digests = set()
+    for url in AlternativeProducts.objects.exclude(image_url__isnull=True).values_list('image_url', flat=True).iterator():
+        digest = os.path.basename(urlparse(url).path).rsplit('.', 1)[0]
+        if DIGEST_RE.match(digest):
+            digests.add(digest)
+    return digests
+
+
+def prune_images(max_age=None, dry_run=False):
+    """
+    Delete the stored images no alternative links to, with their Imgur
+    markers, once they are max_age seconds old (default
+    IMAGE_UNUSED_MAX_AGE). Younger images may still be waiting for their
+    alternative to be written. Images kept for refreshing popular scans are
+    pruned the same way, and kept again the next time the scan is popular.
+
+    Returns:
+        tuple: (deleted images, freed bytes)
+    """
+    max_age = settings.IMAGE_UNUSED_MAX_AGE if max_age is None else max_age
+    used = used_digests()
+    cutoff = time.time() - max_age
+    root = os.path.join(settings.MEDIA_ROOT, settings.IMAGE_STORE_DIR)
+    deleted = freed = 0
+
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            digest, _, suffix = name.partition('.')
+            if suffix not in ('jpeg', 'tmp') or (suffix == 'jpeg' and digest in used):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                for stale_path in (path, f"{path}.imgur"):
+                    try:
+                        os.remove(stale_path)
+                    except FileNotFoundError:
+                        pass
+            deleted += suffix == 'jpeg'
+            freed += stat.st_size
+
+    logger.info("Pruned %d unused images (%d bytes)%s", deleted, freed, " (dry run)" if dry_run else "")
+    return deleted, freed
@@ -40,19 +40,19 @@ def upload_image_to_imgur(image_data):
             data = response.json()
             if data['success']:
                 imgur_url = data['data']['link']
-                logger.info(f"Successfully uploaded image to Imgur: {imgur_url}")
+                logger.info("Successfully uploaded image to Imgur: %s", imgur_url)
                 return imgur_url
             else:
-                logger.error(f"Imgur API error: {data}")
+                logger.error("Imgur API error: %s", data)
                 return None
         else:
-            logger.error(f"Imgur upload failed with status {response.status_code}: {response.text}")
+            logger.error("Imgur upload failed with status %s: %s", response.status_code, response.text)
             return None
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"Network error uploading to Imgur: {str(e)}")
+        logger.error("Network error uploading to Imgur: %s", e)
         return None
     except Exception as e:
-        logger.error(f"Unexpected error uploading to Imgur: {str(e)}")
+        logger.error("Unexpected error uploading to Imgur: %s", e)
         return None
 
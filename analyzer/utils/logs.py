@@ -0,0 +1,92 @@
+"""
+Logging that keeps I/O off the event loop.
+
+settings.LOGGING sends every record to QueuedStreamHandler. The handler
+only puts the record on a queue, and a listener thread formats and writes
+it, so the loop never waits on a stream. Records carry the id of the
+request they were logged for (request_id_var), and per-row or
+per-iteration messages logged with extra=SAMPLED are kept one in
+LOG_SAMPLE_EVERY, per logger and message.
+
+Log with %-style arguments on the request path, so messages are only
+formatted when a record is written:
+
+    logger.info("Fuzzy match found: %s (similarity: %.2f)", name, score)
+"""
+import atexit
+import contextvars
+import itertools
+import logging
+import queue
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+SAMPLED = {'sampled': True}
+
+
+def bind_request_id(request_id=None):
+    """Set the request id for logs of the current task and the threads it starts"""
+    request_id = str(request_id) if request_id else uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    return request_id
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the current request id to every record as %(request_id)s"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps one in `every` records logged with extra=SAMPLED, counted per
+    logger and message template. `rates` overrides `every` per logger, as
+    "analyzer.Boycott=100,analyzer.pipeline=10".
+    """
+
+    def __init__(self, every=100, rates=''):
+        super().__init__()
+        self.every = every
+        self.rates = {}
+        for item in filter(None, (part.strip() for part in rates.split(','))):
+            name, _, value = item.partition('=')
+            self.rates[name.strip()] = int(value)
+        self._counters = {}
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        every = self.rates.get(record.name, self.every)
+        if every <= 1:
+            return True
+        key = (record.name, record.msg)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        # next() on itertools.count is atomic under the GIL
+        return next(counter) % every == 0
+
+
+class QueuedStreamHandler(QueueHandler):
+    """Enqueues records; a listener thread formats them and writes them to the stream"""
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # QueueHandler formats here, in the caller's thread, to make records
+        # picklable. The listener is a thread of this process, so the record
+        # is passed as is and formatted there.
+        return record
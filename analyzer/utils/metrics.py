@@ -0,0 +1,222 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Histograms and counters are plain Python objects updated under a lock, and
+analyzer.views.metrics_view renders them on /metrics. With
+METRICS_ENABLED=False every timer is a shared no-op context manager and
+every inc()/observe() returns at once.
+
+Metrics are per process. In multi-worker mode each scrape reaches one
+worker, identified by gaza_process_info{pid=...}.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+
+ENABLED = settings.METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0)
+
+_NOOP = nullcontext()
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1, **labels):
+        if ENABLED:
+            self.labels(**labels).inc(amount)
+
+    def _render_child(self, key, child):
+        yield f"{self.name}{_format_labels(self.label_names, key)} {child.value}"
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class _Timer:
+    __slots__ = ('child', 'start')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value, **labels):
+        if ENABLED:
+            self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        """Context manager observing the seconds its block takes"""
+        if not ENABLED:
+            return _NOOP
+        return _Timer(self.labels(**labels))
+
+    def _render_child(self, key, child):
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            yield f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', le)])} {cumulative}"
+        labels = _format_labels(self.label_names, key)
+        yield f"{self.name}_sum{labels} {total}"
+        yield f"{self.name}_count{labels} {cumulative}"
+
+
+def timed(stage):
+    """Decorator recording how long a sync function takes as a stage of stage_seconds"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_seconds.time(stage=stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(collect):
+    """
+    Add a callable returning (name, type, help, label names, {label values: value})
+    tuples, for values kept elsewhere, e.g. in collections.Counter stats.
+    """
+    _collectors.append(collect)
+
+
+def counter_collector(name, documentation, counter, label):
+    """Collector exposing a collections.Counter as a counter with one label"""
+    def collect():
+        return [(name, 'counter', documentation, (label,), {(key,): value for key, value in counter.items()})]
+    return collect
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    pid = ('pid', os.getpid())
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, documentation, label_names, samples in collect():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(samples.items()):
+                lines.append(f"{name}{_format_labels(label_names, key)} {value}")
+    lines.append("# HELP gaza_process_info Worker process of these metrics")
+    lines.append("# TYPE gaza_process_info gauge")
+    lines.append(f"gaza_process_info{_format_labels((), (), [pid])} 1")
+    return '\n'.join(lines) + '\n'
+
+
+stage_seconds = Histogram(
+    'gaza_stage_seconds', 'Seconds spent in each analysis stage', labels=('stage',),
+)
+provider_call_seconds = Histogram(
+    'gaza_provider_call_seconds', 'Seconds per LLM provider call', labels=('provider', 'model', 'key_id'),
+)
+requests_total = Counter('gaza_requests_total', 'Analysis requests by result status', labels=('status',))
+errors_total = Counter('gaza_errors_total', 'Errors by stage', labels=('stage',))
+timeouts_total = Counter('gaza_timeouts_total', 'Requests that ran out of time, by stage', labels=('stage',))
+key_rotations_total = Counter('gaza_key_rotations_total', 'API key rotations by reason', labels=('reason',))
+provider_tokens_total = Counter(
+    'gaza_provider_tokens_total', 'Prompt and completion tokens sent to and received from providers',
+    labels=('provider', 'model', 'profile', 'kind'),
+)
+verdict_cache_total = Counter('gaza_verdict_cache_total', 'Verdict cache lookups by result', labels=('result',))
+translation_cache_total = Counter(
+    'gaza_translation_cache_total', 'Translated texts by cache result', labels=('result',),
+)
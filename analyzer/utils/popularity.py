@@ -0,0 +1,141 @@
+"""
+Query popularity, for refreshing the verdicts of the most asked queries.
+
+Queries are counted by their verdict cache key for names, and by the
+perceptual hash of the image for scans (see scan_key), so the same picture
+sent by many users counts as one query even when it was re-encoded or
+resized on the way. Counts live in a Space-Saving sketch of
+POPULARITY_CAPACITY counters: memory stays bounded however many distinct
+queries arrive, and any query asked more than 1/capacity of the time is
+guaranteed to be among them. Counts are halved every POPULARITY_HALF_LIFE
+seconds so the ranking follows what is popular now.
+"""
+import heapq
+import time
+
+from django.conf import settings
+
+from analyzer.utils import metrics
+
+# Set (and unset) bits a perceptual hash needs to identify an image
+MIN_HASH_BITS = 8
+
+
+def scan_key(digest, perceptual_hash=None):
+    """
+    Popularity key of a scan: its perceptual hash. Nearly uniform images,
+    whose hashes have almost all bits equal, hash alike whatever they show,
+    so they are counted by the digest of their resized JPEG.
+    """
+    if perceptual_hash:
+        bits = bin(int(perceptual_hash, 16)).count('1')
+        if MIN_HASH_BITS <= bits <= 64 - MIN_HASH_BITS:
+            return f"image:{perceptual_hash}"
+    return f"image:{digest}"
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters sketch.
+
+    A query not in the sketch takes over the counter with the lowest count
+    and starts from that count, so counts may overestimate by at most the
+    count they inherited (kept as the error). Every counter holds the
+    payload of the last add, which is what a refresh needs to rerun the query.
+
+    The lowest counter is found with a min-heap of (count, key), pushed on
+    every add. Entries whose count is out of date are skipped when popped,
+    and the heap is rebuilt when they outnumber the counters, so adding
+    takes O(log capacity) amortized time.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # key: [count, error, payload]
+        self._counters = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key, payload=None):
+        """Count one occurrence of key and return its count"""
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) < self.capacity:
+                counter = self._counters[key] = [0, 0, None]
+            else:
+                count = self._evict()
+                counter = self._counters[key] = [count, count, None]
+        counter[0] += 1
+        counter[2] = payload
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+        return counter[0]
+
+    def _evict(self):
+        """Drop the counter with the lowest count and return that count"""
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self._counters.get(key)
+            if counter is not None and counter[0] == count:
+                del self._counters[key]
+                return count
+
+    def _rebuild_heap(self):
+        self._heap = [(counter[0], key) for key, counter in self._counters.items()]
+        heapq.heapify(self._heap)
+
+    def get(self, key):
+        """(count, error, payload) of key, or None when it is not counted"""
+        counter = self._counters.get(key)
+        return tuple(counter) if counter is not None else None
+
+    def top(self, n):
+        """Up to n (key, count, payload), most popular first"""
+        ranked = heapq.nlargest(n, self._counters.items(), key=lambda item: item[1][0])
+        return [(key, count, payload) for key, (count, _, payload) in ranked]
+
+    def decay(self):
+        """Halve every count, dropping the counters that reach zero"""
+        for key in list(self._counters):
+            counter = self._counters[key]
+            counter[0] //= 2
+            counter[1] //= 2
+            if counter[0] == 0:
+                del self._counters[key]
+        self._rebuild_heap()
+
+
+class PopularityTracker:
+    """The sketch of this worker, decayed as time passes"""
+
+    def __init__(self, capacity, half_life):
+        self.sketch = SpaceSaving(capacity)
+        self.half_life = half_life
+        self._decayed_at = time.monotonic()
+
+    def track(self, key, payload):
+        """Count a query; returns its count"""
+        now = time.monotonic()
+        if now - self._decayed_at > self.half_life:
+            self.sketch.decay()
+            self._decayed_at = now
+        return self.sketch.add(key, payload)
+
+    def top(self, n):
+        return self.sketch.top(n)
+
+    def get(self, key):
+        return self.sketch.get(key)
+
+
+popularity = PopularityTracker(settings.POPULARITY_CAPACITY, settings.POPULARITY_HALF_LIFE)
+
+
+def _collect():
+    return [('gaza_popularity_tracked', 'gauge', 'Queries counted in the popularity sketch', (), {(): len(popularity.sketch)})]
+
+
+metrics.register_collector(_collect)
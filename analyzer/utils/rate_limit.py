@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryBackend:
+    """
+    Token buckets in a process local LRU map.
+
+    Every update is O(1). Buckets idle for longer than `ttl` are evicted;
+    by then they have refilled to capacity, so dropping them changes nothing.
+    At most `max_keys` buckets are kept, least recently used go first.
+    """
+
+    is_local = True
+
+    def __init__(self, max_keys=10000, ttl=600):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, cost, now):
+        with self._lock:
+            self._evict(now)
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def _evict(self, now):
+        # Least recently used first, so stop at the first fresh bucket
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.ttl:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBackend:
+    """Token buckets in Redis, shared by every worker. Needs the redis package."""
+
+    is_local = False
+
+    SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local rate, capacity, cost, now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], ttl)
+    return allowed
+    """
+
+    def __init__(self, url, ttl=600, prefix='ratelimit:'):
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, capacity, cost, now):
+        # Redis time keeps buckets consistent across hosts with skewed clocks
+        seconds, microseconds = self._client.time()
+        now = seconds + microseconds / 1_000_000
+        return bool(self._script(keys=[self.prefix + key], args=[rate, capacity, cost, now, int(self.ttl)]))
+
+
+class SQLiteBackend:
+    """
+    Token buckets in a SQLite file, shared by the workers of one host.
+
+    A stand-in for Redis on single-host multi-worker deployments.
+    """
+
+    is_local = False
+
+    def __init__(self, path, ttl=600, cleanup_every=1000):
+        self.path = path
+        self.ttl = ttl
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._operations = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, capacity, cost, now):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now)
+            )
+            self._operations += 1
+            if self._operations % self.cleanup_every == 0:
+                connection.execute('DELETE FROM buckets WHERE updated < ?', (now - self.ttl,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed
+
+
+class TokenBucketLimiter:
+    """
+    Allows `per_minute` events per key on average with bursts up to `burst`.
+
+    A backend error fails open: the event is allowed and the error logged,
+    so a Redis outage does not take the service down with it.
+    """
+
+    def __init__(self, name, per_minute, burst, backend):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.backend = backend
+
+    def allow(self, key, cost=1):
+        try:
+            return self.backend.take(f"{self.name}:{key}", self.rate, self.capacity, cost, time.time())
+        except Exception as e:
+            logger.error("Rate limit backend error: %s", e)
+            return True
+
+    async def aallow(self, key, cost=1):
+        if self.backend.is_local:
+            return self.allow(key, cost)
+        return await asyncio.to_thread(self.allow, key, cost)
+
+
+def create_backend(name=None):
+    name = name or settings.RATE_LIMIT_BACKEND
+    if name == 'memory':
+        return InMemoryBackend(max_keys=settings.RATE_LIMIT_MAX_KEYS)
+    if name == 'redis':
+        return RedisBackend(settings.REDIS_URL)
+    if name == 'sqlite':
+        return SQLiteBackend(settings.RATE_LIMIT_SQLITE_PATH)
+    raise ValueError(f"Unsupported rate limit backend: {name}")
+
+
+_backend = create_backend()
+
+# New WebSocket connections per client IP
+connection_limiter = TokenBucketLimiter(
+    'conn', settings.RATE_LIMIT_CONNECTIONS_PER_MINUTE, settings.RATE_LIMIT_CONNECTIONS_BURST, _backend,
+)
+# Analysis requests per client IP, whether or not they share a connection
+message_limiter = TokenBucketLimiter(
+    'msg', settings.RATE_LIMIT_MESSAGES_PER_MINUTE, settings.RATE_LIMIT_MESSAGES_BURST, _backend,
+)
+
+
+def quota_limiter(name, per_minute, burst):
+    """Limiter with its own rate on the shared backend, e.g. for one partner key"""
+    return TokenBucketLimiter(name, per_minute, burst, _backend)
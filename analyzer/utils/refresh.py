@@ -0,0 +1,228 @@
+"""
+Background refresh of the verdicts of popular queries.
+
+Every REFRESH_INTERVAL_SECONDS, inside the REFRESH_WINDOWS (off-peak hours),
+the scheduler walks the REFRESH_TOP_N most popular queries (see popularity)
+asked at least REFRESH_MIN_HITS times, and analyzes again the ones whose
+cached verdict is missing or stale. Stale verdicts are served meanwhile, so
+the hottest queries never wait on the provider in the request path. A stale
+hit on a popular query (see verdict_cache) queues it for the next round,
+whatever the window.
+
+Refreshes are bounded three ways:
+- REFRESH_CALLS_PER_HOUR provider calls, on the shared rate limit backend,
+  so the budget is shared by all workers;
+- a round stops as soon as live requests would have to wait for admission,
+  and refreshes are admitted as their own client, so they never starve users;
+- a refresh lock in the shared cache keeps workers from refreshing the same
+  query at once.
+"""
+import asyncio
+import base64
+import logging
+from collections import Counter
+from datetime import time as clock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from analyzer.utils import metrics, verdict_cache
+from analyzer.utils.image_store import reference_path, store_reference_image
+from analyzer.utils.popularity import popularity
+from analyzer.utils.rate_limit import quota_limiter
+from analyzer.utils.write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+CLIENT_KEY = 'refresh'
+REFRESH_TIMEOUT = 25.0
+
+
+def parse_windows(spec):
+    """"22:00-06:00,13:00-14:00" as [(start, end)] times; an empty spec is always open"""
+    windows = []
+    for window in filter(None, (part.strip() for part in spec.split(','))):
+        start, end = (clock.fromisoformat(value.strip()) for value in window.split('-'))
+        windows.append((start, end))
+    return windows
+
+
+def in_windows(windows, now):
+    if not windows:
+        return True
+    for start, end in windows:
+        if (start <= now < end) if start <= end else (now >= start or now < end):
+            return True
+    return False
+
+
+class RefreshScheduler:
+    """
+    Started on the first tracked query from the running event loop, like
+    the write-behind queue. stats counts refreshes by outcome.
+    """
+
+    def __init__(self, interval, top_n, min_hits, calls_per_hour, windows):
+        self.interval = interval
+        self.top_n = top_n
+        self.min_hits = min_hits
+        self.windows = parse_windows(windows)
+        self.budget = quota_limiter('refresh', calls_per_hour / 60.0, max(1, calls_per_hour // 12))
+        self.stats = Counter()
+        self._stale = {}
+        # Digests whose reference image was queued for storing, in this worker
+        self._images = set()
+        self._loop = None
+        self._task = None
+
+    def ensure_started(self):
+        if not settings.REFRESH_ENABLED:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    def revalidate(self, key, payload):
+        """Queue a popular query whose cached verdict is stale"""
+        self._stale[key] = payload
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_round()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Verdict refresh round failed: %s", e)
+
+    async def run_round(self):
+        """Refresh the stale queries, then the popular ones inside the windows; returns refreshes done"""
+        queue = list(self._stale.items())
+        self._stale.clear()
+        if in_windows(self.windows, timezone.localtime().time()):
+            queue += [(key, payload) for key, count, payload in popularity.top(self.top_n) if count >= self.min_hits]
+
+        done = 0
+        seen = set()
+        for key, payload in queue:
+            if key in seen:
+                continue
+            seen.add(key)
+            kind, value = payload
+            cache_key = verdict_cache.text_key(value) if kind == 'text' else verdict_cache.image_key(value)
+            cached = await asyncio.to_thread(verdict_cache.lookup, cache_key)
+            if cached is not None and cached[1] < settings.VERDICT_REFRESH_AFTER_SECONDS:
+                self.stats['fresh'] += 1
+                continue
+            image_url = None
+            if kind == 'image':
+                # Scans are refreshed from the reference image kept when they became popular
+                image_url = await asyncio.to_thread(_read_image_url, reference_path(value))
+                if image_url is None:
+                    self.stats['no_image'] += 1
+                    self._images.discard(value)
+                    continue
+            if not self._idle():
+                self.stats['busy'] += 1
+                break
+            if not await self.budget.aallow(CLIENT_KEY):
+                self.stats['over_budget'] += 1
+                break
+            lock = f"verdict-refresh:{cache_key}"
+            if not await asyncio.to_thread(cache.add, lock, 1, REFRESH_TIMEOUT * 2):
+                self.stats['locked'] += 1
+                continue
+            try:
+                if await self._refresh(cache_key, payload, image_url):
+                    done += 1
+            finally:
+                await asyncio.to_thread(cache.delete, lock)
+        return done
+
+    def _idle(self):
+        from analyzer.utils.admission import admission
+        return admission.expected_wait(CLIENT_KEY, admission.costs['text']) == 0
+
+    async def _refresh(self, cache_key, payload, image_url=None):
+        from analyzer.API.message import analyze_company_name, analyze_img
+        from analyzer.pipeline import parse_response
+        from analyzer.utils.admission import AdmissionRejected, admission
+        from analyzer.utils.deadline import Deadline
+
+        kind, value = payload
+        deadline = Deadline(REFRESH_TIMEOUT)
+        try:
+            if kind == 'text':
+                call = lambda: analyze_company_name(value, settings.VERDICT_LANGUAGE, deadline)
+            else:
+                call = lambda: analyze_img(image_url, settings.VERDICT_LANGUAGE, deadline)
+            async with admission.admit(CLIENT_KEY, kind, deadline.expires_at):
+                response = await deadline.run(call(), "verdict refresh")
+        except (AdmissionRejected, asyncio.TimeoutError) as e:
+            self.stats['busy'] += 1
+            logger.info("Verdict refresh skipped: %s", e)
+            return False
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.warning("Verdict refresh failed: %s", e)
+            return False
+
+        verdict = parse_response(response)
+        if not verdict[1]:
+            # Keep serving the previous verdict
+            self.stats['unrecognized'] += 1
+            return False
+        await asyncio.to_thread(verdict_cache.store, cache_key, verdict)
+        self.stats['refreshed'] += 1
+        return True
+
+
+def _read_image_url(path):
+    try:
+        with open(path, 'rb') as image_file:
+            return f"data:image/jpeg;base64,{base64.b64encode(image_file.read()).decode('utf-8')}"
+    except FileNotFoundError:
+        return None
+
+
+def track(key, payload, image=None):
+    """
+    Count a query for the refresh scheduler, from the event loop. key is
+    the verdict cache key for names and popularity.scan_key for scans, and
+    payload is ('text', company name) or ('image', image digest). A scan is
+    refreshed under the digest it was last seen with; popular scans get
+    their resized image kept, to refresh from, once per digest and worker
+    unless it goes missing.
+
+    Returns the on_stale callback for verdict_cache.get_or_analyze.
+    """
+    count = popularity.track(key, payload)
+    refresher.ensure_started()
+    if image is not None and count >= refresher.min_hits and payload[1] not in refresher._images:
+        if len(refresher._images) >= settings.POPULARITY_CAPACITY:
+            refresher._images.clear()
+        refresher._images.add(payload[1])
+        # Written off the event loop; the job skips images kept already
+        write_behind.submit('store_popular_image', payload[1], image)
+
+    def on_stale():
+        if count >= refresher.min_hits:
+            refresher.revalidate(key, payload)
+    return on_stale
+
+
+refresher = RefreshScheduler(
+    interval=settings.REFRESH_INTERVAL_SECONDS,
+    top_n=settings.REFRESH_TOP_N,
+    min_hits=settings.REFRESH_MIN_HITS,
+    calls_per_hour=settings.REFRESH_CALLS_PER_HOUR,
+    windows=settings.REFRESH_WINDOWS,
+)
+write_behind.register('store_popular_image', store_reference_image)
+metrics.register_collector(metrics.counter_collector(
+    'gaza_verdict_refresh_total', 'Background verdict refreshes by outcome', refresher.stats, 'outcome',
+))
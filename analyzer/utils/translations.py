@@ -0,0 +1,90 @@
+"""
+Per-language cache of translated texts.
+
+Verdicts are analyzed once, in VERDICT_LANGUAGE (see verdict_cache). What a
+client reads in another language, the cause and the product type label, is
+translated by the provider and kept in the shared Django cache for
+TRANSLATION_CACHE_SECONDS, so each text is translated once per language
+whichever brand or client it comes from. A text that cannot be translated
+is returned unchanged.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from analyzer.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def language_key(language):
+    return (language or '').strip().lower()
+
+
+def is_canonical(language):
+    """True when texts in language need no translation"""
+    return not language_key(language) or language_key(language) == language_key(settings.VERDICT_LANGUAGE)
+
+
+def _cache_key(language, text):
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+    return f"translation:{language_key(language)}:{digest}"
+
+
+def parse_translations(response, count):
+    """The JSON array of count strings in a provider response, or None"""
+    if not isinstance(response, str):
+        return None
+    start, end = response.find('['), response.rfind(']')
+    if start < 0 or end < start:
+        return None
+    try:
+        translated = json.loads(response[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(translated, list) or len(translated) != count:
+        return None
+    if not all(isinstance(text, str) and text.strip() for text in translated):
+        return None
+    return [text.strip() for text in translated]
+
+
+async def translate(texts, language, deadline=None, run=None):
+    """
+    texts translated into language, in the same order.
+
+    Cached texts are not sent again; the others go to the provider in one
+    call. run, if given, is awaited with that call (a coroutine function),
+    e.g. to hold an admission slot while it runs.
+    """
+    if is_canonical(language):
+        return list(texts)
+    wanted = list(dict.fromkeys(text for text in texts if text))
+    if not wanted:
+        return list(texts)
+
+    keys = {text: _cache_key(language, text) for text in wanted}
+    cached = await asyncio.to_thread(cache.get_many, list(keys.values()))
+    translated = {text: cached[key] for text, key in keys.items() if key in cached}
+    missing = [text for text in wanted if text not in translated]
+    metrics.translation_cache_total.inc(len(translated), result='hit')
+
+    if missing:
+        metrics.translation_cache_total.inc(len(missing), result='miss')
+        from analyzer.API.message import translate_texts
+
+        call = lambda: translate_texts(missing, language, deadline)
+        response = await (run(call) if run else call())
+        result = parse_translations(response, len(missing))
+        if result is None:
+            logger.warning("Unusable translation into %s, keeping the original texts", language)
+        else:
+            translated.update(zip(missing, result))
+            await asyncio.to_thread(
+                cache.set_many, {keys[text]: translated[text] for text in missing}, settings.TRANSLATION_CACHE_SECONDS,
+            )
+    return [translated.get(text, text) for text in texts]
@@ -0,0 +1,164 @@
+"""
+Language-independent cache of analysis verdicts.
+
+A verdict is what parse_response returns: (boycott status, brand, parent,
+product type, cause). It is asked of the provider in VERDICT_LANGUAGE
+whatever language the client wants, and kept in the shared Django cache
+for VERDICT_CACHE_SECONDS under the normalized company name, or the digest
+of the resized image for scans. A brand asked in English, Arabic and French
+is analyzed once; only the texts a client reads are translated (see
+translations). Scans are not cached by perceptual hash: two products
+photographed alike can share one, and would share a verdict.
+
+Concurrent misses for the same key in one worker share one provider call.
+It keeps running while any of the requests waiting for it does, and is
+cancelled when all of them are gone. The call is the one of the request
+that started it: admitted under that client's key and shed or timed out
+against that request's deadline. Its queue positions are sent to every
+waiting request, and each request waits for it within its own deadline.
+A request that joined the call and still has time when it fails on the
+starter's deadline or is shed starts a call of its own.
+
+Entries older than VERDICT_REFRESH_AFTER_SECONDS are stale: they are still
+served, and the refresh scheduler (see refresh) analyzes popular ones
+again in the background before they expire.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from analyzer.utils import metrics
+from analyzer.utils.admission import AdmissionRejected
+from analyzer.utils.deadline import DeadlineExceeded, within
+from analyzer.utils.fuzzy_match import normalize_company_name
+
+logger = logging.getLogger(__name__)
+
+# Bump when the verdict format or the prompts change meaning, to drop old entries
+VERSION = 2
+
+# Verdicts being analyzed in this worker, by cache key
+_inflight = {}
+
+
+class _Inflight:
+    """A shared analysis, its number of waiters and their on_queue callbacks"""
+
+    __slots__ = ('task', 'waiters', 'listeners')
+
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.listeners = []
+
+    async def on_position(self, position, wait):
+        for listener in list(self.listeners):
+            await _notify(listener, position, wait)
+
+
+async def _notify(listener, position, wait):
+    try:
+        await listener(position, wait)
+    except Exception as e:
+        # A client that went away must not stop the others' updates
+        logger.debug("Queue position update failed: %s", e)
+
+
+def _cache_key(kind, value):
+    digest = hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]
+    return f"verdict:{VERSION}:{kind}:{digest}"
+
+
+def text_key(company_name):
+    return _cache_key('text', normalize_company_name(company_name) or company_name.strip().lower())
+
+
+def image_key(digest):
+    """Key of a scan, by the digest of its resized JPEG (see image_digest)"""
+    return _cache_key('image', digest)
+
+
+def lookup(key):
+    """(verdict, age in seconds) cached for key, or None"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    return tuple(entry['verdict']), time.time() - entry['at']
+
+
+def store(key, verdict):
+    cache.set(key, {'verdict': list(verdict), 'at': time.time()}, settings.VERDICT_CACHE_SECONDS)
+
+
+async def _analyze_and_store(key, analyze, on_position):
+    verdict = await analyze(on_position)
+    # Unrecognized names and images are not cached, they may be recognized next time
+    if verdict[1]:
+        await asyncio.to_thread(store, key, verdict)
+    return verdict
+
+
+async def get_or_analyze(key, analyze, on_stale=None, deadline=None, on_queue=None):
+    """
+    Cached verdict for key, or the verdict of `await analyze(on_position)`,
+    which is cached when it recognized a brand. analyze is the provider call
+    of this request: admitted under its client key with on_position, within
+    its deadline. It runs once for concurrent misses, and only when this
+    request is the one starting the call.
+
+    on_stale, if given, is called when the cached verdict is stale.
+    deadline bounds the wait of this request, which raises DeadlineExceeded
+    when it runs out; on_queue is awaited with (position, expected wait)
+    while the shared call is queued.
+    """
+    cached = await asyncio.to_thread(lookup, key)
+    if cached is not None:
+        verdict, age = cached
+        metrics.verdict_cache_total.inc(result='hit')
+        if on_stale is not None and age > settings.VERDICT_REFRESH_AFTER_SECONDS:
+            on_stale()
+        return verdict
+
+    while True:
+        entry = _inflight.get(key)
+        started = entry is None or entry.task.done()
+        if started:
+            metrics.verdict_cache_total.inc(result='miss')
+            entry = _inflight[key] = _Inflight()
+            entry.task = asyncio.ensure_future(_analyze_and_store(key, analyze, entry.on_position))
+            entry.task.add_done_callback(
+                lambda _, entry=entry: _inflight.pop(key, None) if _inflight.get(key) is entry else None
+            )
+        else:
+            metrics.verdict_cache_total.inc(result='shared')
+
+        try:
+            return await _wait(key, entry, deadline, on_queue)
+        except (AdmissionRejected, DeadlineExceeded) as e:
+            # Shed or out of time on the deadline of the request that started
+            # the call; this one tries on its own while it has time
+            failed_call = entry.task.done() and not entry.task.cancelled() and entry.task.exception() is e
+            if started or not failed_call or (deadline is not None and deadline.expired()):
+                raise
+            logger.info("Shared verdict call failed for another request (%s), starting one", e)
+
+
+async def _wait(key, entry, deadline, on_queue):
+    entry.waiters += 1
+    if on_queue is not None:
+        entry.listeners.append(on_queue)
+    try:
+        return await within(deadline, asyncio.shield(entry.task), "verdict")
+    finally:
+        entry.waiters -= 1
+        if on_queue is not None:
+            entry.listeners.remove(on_queue)
+        if entry.waiters == 0 and not entry.task.done():
+            # Requests arriving from now on start a new call instead of joining the cancelled one
+            if _inflight.get(key) is entry:
+                del _inflight[key]
+            entry.task.cancel()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from analyzer.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'spill')
+
+
+class WriteBehindQueue:
+    """
+    Background queue for writes the client does not need to wait for.
+
+    Jobs are registered by name and submitted from the event loop without
+    blocking. A worker task drains the queue and runs each job on a dedicated
+    thread pool, so slow jobs (Imgur uploads, SQLite writes) never occupy the
+    thread shared by database_sync_to_async. Failed jobs are retried with
+    exponential backoff. When the queue is full the overflow policy decides
+    whether the new job is dropped, the oldest job is dropped, or the new job
+    is spilled to a JSONL file and replayed once the worker restarts.
+    """
+
+    def __init__(self, maxsize=100, workers=1, max_retries=3, backoff=1.0,
+                 max_backoff=30.0, overflow='spill', spill_path=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported overflow policy: {overflow}")
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.stats = Counter()
+        self._jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='write-behind')
+        self._workers = workers
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._spill_lock = threading.Lock()
+
+    def register(self, name, func):
+        self._jobs[name] = func
+
+    def submit(self, name, *args):
+        """
+        Queue a registered job. Must be called from the event loop.
+
+        Returns False when the job was dropped or spilled instead of queued.
+        """
+        if name not in self._jobs:
+            raise ValueError(f"Unknown write-behind job: {name}")
+        self._ensure_started()
+        self.stats['submitted'] += 1
+
+        job = (name, args, 0)
+        if not self._queue.full():
+            self._queue.put_nowait(job)
+            return True
+
+        if self.overflow == 'drop_oldest':
+            dropped_name, _, _ = self._queue.get_nowait()
+            self._queue.task_done()
+            self._queue.put_nowait(job)
+            self.stats['dropped'] += 1
+            logger.warning("Write-behind queue full, dropped oldest job: %s", dropped_name)
+            return True
+        if self.overflow == 'spill' and self.spill_path:
+            self._spill(job)
+            return False
+
+        self.stats['dropped'] += 1
+        logger.warning("Write-behind queue full, dropped job: %s", name)
+        return False
+
+    def submit_threadsafe(self, name, *args):
+        """Queue a registered job from a worker thread, e.g. from another job."""
+        if self._loop is None or self._loop.is_closed():
+            logger.warning("Write-behind queue not running, dropped job: %s", name)
+            self.stats['dropped'] += 1
+            return
+        self._loop.call_soon_threadsafe(self.submit, name, *args)
+
+    async def join(self):
+        """Wait until the queue is drained; retries waiting on backoff are not awaited."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not any(task.done() for task in self._tasks):
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self._workers)]
+        self._replay_spill()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            name, args, attempt = await self._queue.get()
+            try:
+                await loop.run_in_executor(self._executor, self._run_job, name, args)
+                self.stats['completed'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt < self.max_retries:
+                    self.stats['retried'] += 1
+                    delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+                    logger.warning("Write-behind job %s failed (%s), retrying in %.1fs", name, e, delay)
+                    loop.call_later(delay, self._requeue, (name, args, attempt + 1))
+                else:
+                    self.stats['failed'] += 1
+                    logger.error("Write-behind job %s failed after %d attempts: %s", name, attempt + 1, e)
+            finally:
+                self._queue.task_done()
+
+    def _requeue(self, job):
+        if self._queue.full():
+            if self.overflow == 'spill' and self.spill_path:
+                self._spill(job)
+            else:
+                self.stats['dropped'] += 1
+            return
+        self._queue.put_nowait(job)
+
+    def _run_job(self, name, args):
+        close_old_connections()
+        try:
+            return self._jobs[name](*args)
+        finally:
+            close_old_connections()
+
+    def _spill(self, job):
+        name, args, _ = job
+        try:
+            with self._spill_lock, open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                spill_file.write(json.dumps({'job': name, 'args': list(args)}) + '\n')
+            self.stats['spilled'] += 1
+            logger.warning("Write-behind queue full, spilled job to disk: %s", name)
+        except (OSError, TypeError) as e:
+            self.stats['dropped'] += 1
+            logger.error("Could not spill write-behind job %s: %s", name, e)
+
+    def _replay_spill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with self._spill_lock:
+            replay_path = f"{self.spill_path}.replay"
+            os.replace(self.spill_path, replay_path)
+
+        replayed = 0
+        with open(replay_path, encoding='utf-8') as spill_file:
+            for line in spill_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('job') not in self._jobs:
+                    continue
+                job = (record['job'], tuple(record.get('args', ())), 0)
+                if self._queue.full():
+                    self._spill(job)
+                else:
+                    self._queue.put_nowait(job)
+                    replayed += 1
+        os.remove(replay_path)
+        if replayed:
+            logger.info("Replayed %d spilled write-behind jobs", replayed)
+
+
+write_behind = WriteBehindQueue(
+    maxsize=settings.WRITE_BEHIND_QUEUE_SIZE,
+    workers=settings.WRITE_BEHIND_WORKERS,
+    max_retries=settings.WRITE_BEHIND_MAX_RETRIES,
+    backoff=settings.WRITE_BEHIND_BACKOFF_SECONDS,
+    overflow=settings.WRITE_BEHIND_OVERFLOW,
+    spill_path=settings.WRITE_BEHIND_SPILL_PATH,
+)
+metrics.register_collector(metrics.counter_collector(
+    'gaza_write_behind_jobs_total', 'Background write jobs by outcome', write_behind.stats, 'outcome',
+))
@@ -1,4 +1,25 @@
-from django.http import HttpResponse
+import gzip
+import hashlib
+import json
+import os
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from analyzer import protocol
+from analyzer.authentication import IsPartner, PartnerKeyAuthentication
+from analyzer.pipeline import check_names
+from analyzer.serializers import BulkCheckSerializer
+from analyzer.utils.alternatives_cache import alternatives_cache
+from analyzer.utils import metrics
+from analyzer.utils.catalog import delta_path, full_path, read_manifest
+from analyzer.utils.image_store import DIGEST_RE, image_path
+from analyzer.utils.rate_limit import quota_limiter
 
 def home_view(request):
     html_content = """
@@ -76,3 +97,158 @@ def home_view(request):
     </html>
     """
     return HttpResponse(html_content)
+
+@require_GET
+def image_view(request, digest):
+    """Serve a stored image. Its URL is its content hash, so it can be cached forever."""
+    if not DIGEST_RE.match(digest):
+        raise Http404("Image not found")
+
+    etag = f'"{digest}"'
+    cache_control = f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}, immutable"
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        path = image_path(digest)
+        if not os.path.exists(path):
+            raise Http404("Image not found")
+        response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+@require_GET
+def catalog_view(request):
+    """
+    Offline catalog bundle as gzipped JSON.
+
+    ?since=<version> returns the delta from that version if it is still kept,
+    otherwise the full catalog; 204 when the client is already up to date.
+    """
+    manifest = read_manifest()
+    if manifest is None:
+        raise Http404("Catalog not exported yet")
+
+    version = manifest['version']
+    since = request.GET.get('since', '')
+    if since == str(version):
+        response = HttpResponse(status=204)
+    else:
+        if since.isdigit() and int(since) in manifest['versions']:
+            kind, path = f"delta-{since}", delta_path(int(since), version)
+        else:
+            kind, path = "full", full_path(version)
+
+        etag = f'"{manifest["digest"]}-{kind}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        elif not os.path.exists(path):
+            raise Http404("Catalog bundle not found")
+        elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = FileResponse(open(path, 'rb'), content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = FileResponse(gzip.open(path, 'rb'), content_type='application/json')
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+    response['X-Catalog-Version'] = str(version)
+    response['Cache-Control'] = f"public, max-age={settings.CATALOG_CACHE_MAX_AGE}"
+    return response
+
+@require_GET
+def metrics_view(request):
+    """Metrics in the Prometheus text format, 404 when metrics are disabled"""
+    if not settings.METRICS_ENABLED:
+        raise Http404("Metrics are disabled")
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse("Unauthorized", status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class BulkCheckView(APIView):
+    """
+    Check a list of company names in one request.
+
+    POST {"names": [...], "country": "...", "language": "..."} with an
+    X-API-Key header. Results are streamed as NDJSON, one line per name in
+    completion order, each carrying the name's index in the request.
+    Every name counts against the partner key's quota.
+    """
+
+    authentication_classes = [PartnerKeyAuthentication]
+    permission_classes = [IsPartner]
+
+    def post(self, request):
+        serializer = BulkCheckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        names = serializer.validated_data['names']
+
+        partner = request.auth
+        limiter = quota_limiter('bulk', partner.names_per_minute, partner.burst)
+        if not limiter.allow(str(partner.pk), cost=len(names)):
+            return Response({'detail': "Quota exceeded"}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        results = check_names(
+            names,
+            country=serializer.validated_data.get('country') or None,
+            language=serializer.validated_data['language'],
+            client_key=f"partner:{partner.pk}",
+            concurrency=settings.BULK_CHECK_CONCURRENCY,
+        )
+        return StreamingHttpResponse(ndjson_lines(results), content_type='application/x-ndjson')
+
+
+class AlternativesPagination(PageNumberPagination):
+    page_size = settings.ALTERNATIVES_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.ALTERNATIVES_MAX_PAGE_SIZE
+
+
+class AlternativesView(APIView):
+    """
+    Alternatives of a product type in a country, the same matches a boycott
+    verdict gets, paginated: GET ?country=...&product_type=...&page=...
+
+    Responses are public and carry a strong ETag from the country snapshot's
+    data version and the requested product type and page, so a CDN can serve
+    repeats and revalidate with If-None-Match, which is answered with 304
+    before anything is serialized when it lists that exact tag.
+    """
+
+    authentication_classes = []
+    permission_classes = []
+    renderer_classes = [JSONRenderer]
+    pagination_class = AlternativesPagination
+
+    def get(self, request):
+        country = request.query_params.get('country', '').strip()
+        product_type = request.query_params.get('product_type', '').strip()
+        if not country or not product_type:
+            return Response({'detail': "country and product_type are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        snapshot = alternatives_cache.snapshot(country)
+        etag = self.etag(snapshot, product_type, request)
+        # Strong comparison: weak tags and other pages' tags do not match
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            alternatives = snapshot.lookup(product_type) if snapshot else ()
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(alternatives, request, view=self)
+            response = paginator.get_paginated_response(page)
+        response['ETag'] = etag
+        response['Cache-Control'] = f"public, max-age={settings.ALTERNATIVES_CACHE_MAX_AGE}"
+        return response
+
+    def etag(self, snapshot, product_type, request):
+        version = snapshot.version if snapshot else 'unknown-country'
+        page = [request.query_params.get(param, '') for param in ('page', AlternativesPagination.page_size_query_param)]
+        digest = hashlib.sha256('\n'.join([product_type.lower(), *page]).encode('utf-8')).hexdigest()[:16]
+        return f'"{version}-{digest}"'
+
+
+async def ndjson_lines(results):
+    async for index, name, result in results:
+        line = {'index': index, 'name': name}
+        line.update(protocol.result_fields(result))
+        yield json.dumps(line) + '\n'
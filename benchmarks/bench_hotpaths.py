@@ -0,0 +1,154 @@
+"""
+Microbenchmarks for the pure Python hot paths, run with pytest-benchmark.
+
+Covers normalize_company_name, calculate_similarity, find_best_company_match
+and is_similar_product_type on generated corpora of 1k/10k/100k names and
+product types, and convert_and_resize_image on generated JPEG, PNG and SVG
+inputs at several resolutions. Corpora and images are generated from a
+fixed seed, so runs on the same machine are comparable.
+
+    pytest benchmarks/bench_hotpaths.py --benchmark-save=before
+    pytest benchmarks/bench_hotpaths.py --benchmark-compare --benchmark-compare-fail=median:20%
+
+The file is not collected by a plain `pytest` run; name it on the command
+line. Fuzzy benchmarks time one pass over the corpus, and record the number
+of calls it makes as extra_info['calls']. SVG inputs are skipped when cairo
+is not available. Running the file directly passes its arguments to pytest.
+"""
+import functools
+import io
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEED = 1948
+SYLLABLES = ['al', 'ba', 'co', 'da', 'el', 'fa', 'ga', 'ha', 'in', 'jo', 'ka', 'lu', 'ma', 'no', 'or',
+             'pe', 'qu', 'ra', 'sa', 'ta', 'ur', 'vi', 'wa', 'xo', 'ya', 'ze', 'é', 'ö', 'ñ']
+SUFFIXES = ['', '', '', ' Inc', ' Ltd', ' Group', ' Corporation', ' S.A.', ' GmbH', ' International', ' & Co']
+PRODUCT_TYPES = ['Milk', 'Coffee', 'Chocolate', 'Soft Drink', 'Water', 'Snacks', 'Cereal', 'Shampoo',
+                 'Toothpaste', 'Detergent', 'Chips', 'Cola', 'Yogurt', 'Espresso', 'Candy', 'Juice']
+SIZES = (1000, 10000, 100000)
+RESOLUTIONS = ((640, 480), (1920, 1080), (4000, 3000))
+# find_best_company_match scans the whole corpus per query
+MATCH_QUERIES = 5
+
+
+def company_names(count, rng):
+    names = []
+    for _ in range(count):
+        words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+                 for _ in range(rng.randint(1, 3))]
+        names.append(' '.join(words) + rng.choice(SUFFIXES))
+    return names
+
+
+def product_types(count, rng):
+    types = []
+    for _ in range(count):
+        base = rng.choice(PRODUCT_TYPES)
+        variant = rng.choice(['', 'Organic ', 'Diet ', 'Instant ', 'Mini '])
+        types.append(variant + (base.lower() if rng.random() < 0.3 else base))
+    return types
+
+
+def make_image(fmt, size, rng):
+    """A gradient with noise, encoded as fmt ('jpeg', 'png' or 'svg')"""
+    width, height = size
+    if fmt == 'svg':
+        shapes = ''.join(
+            f'<circle cx="{rng.randint(0, width)}" cy="{rng.randint(0, height)}" r="{rng.randint(5, width // 8)}" '
+            f'fill="#{rng.randint(0, 0xFFFFFF):06x}"/>' for _ in range(200)
+        )
+        return (f'<?xml version="1.0"?><svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+                f'height="{height}">{shapes}</svg>').encode('utf-8')
+
+    from PIL import Image
+
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    noise = Image.frombytes('RGB', (width // 4, height // 4), rng.randbytes((width // 4) * (height // 4) * 3))
+    image = Image.blend(image, noise.resize(size), 0.5)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG' if fmt == 'jpeg' else 'PNG', **({'quality': 90} if fmt == 'jpeg' else {}))
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def corpus(size):
+    """Names, shuffled names, product types and shuffled types of a corpus, built once per run"""
+    rng = random.Random(SEED + size)
+    names = company_names(size, rng)
+    others = rng.sample(names, len(names))
+    types = product_types(size, rng)
+    other_types = rng.sample(types, len(types))
+    return SimpleNamespace(names=names, others=others, types=types, other_types=other_types)
+
+
+sizes = pytest.mark.parametrize('size', SIZES)
+
+
+def run(benchmark, func, calls):
+    benchmark.extra_info['calls'] = calls
+    return benchmark(func)
+
+
+@sizes
+def test_normalize_company_name(benchmark, size):
+    from analyzer.utils.fuzzy_match import normalize_company_name
+
+    names = corpus(size).names
+    run(benchmark, lambda: [normalize_company_name(name) for name in names], size)
+
+
+@sizes
+def test_calculate_similarity(benchmark, size):
+    from analyzer.utils.fuzzy_match import calculate_similarity
+
+    data = corpus(size)
+    run(benchmark, lambda: [calculate_similarity(a, b) for a, b in zip(data.names, data.others)], size)
+
+
+@sizes
+def test_is_similar_product_type(benchmark, size):
+    from analyzer.utils.fuzzy_match import is_similar_product_type
+
+    data = corpus(size)
+    run(benchmark, lambda: [is_similar_product_type(a, b) for a, b in zip(data.types, data.other_types)], size)
+
+
+@sizes
+def test_find_best_company_match(benchmark, size):
+    from analyzer.utils.fuzzy_match import find_best_company_match
+
+    names = corpus(size).names
+    companies = [SimpleNamespace(company_name=name) for name in names]
+    queries = [names[i] for i in range(0, size, max(1, size // MATCH_QUERIES))][:MATCH_QUERIES]
+    benchmark.extra_info['calls'] = len(queries)
+    # Seconds per round at 100k, so a fixed number of rounds instead of calibration
+    benchmark.pedantic(lambda: [find_best_company_match(query, companies) for query in queries],
+                       rounds=5 if size <= 10000 else 1, warmup_rounds=1)
+
+
+@pytest.mark.parametrize('size', RESOLUTIONS, ids=lambda size: f'{size[0]}x{size[1]}')
+@pytest.mark.parametrize('fmt', ['jpeg', 'png', 'svg'])
+def test_convert_and_resize_image(benchmark, fmt, size):
+    try:
+        from analyzer.imgProcessor import convert_and_resize_image
+    except (ImportError, OSError) as e:
+        pytest.skip(f"image processing unavailable: {e}")
+
+    data = make_image(fmt, size, random.Random(SEED))
+    try:
+        convert_and_resize_image(data, max_size=(800, 800), quality=70)
+    except Exception as e:
+        pytest.skip(f"cannot convert {fmt} inputs: {e}")
+    benchmark(convert_and_resize_image, data, max_size=(800, 800), quality=70)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, *sys.argv[1:]]))
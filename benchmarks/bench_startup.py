@@ -0,0 +1,103 @@
+"""
+Cold start: import time of the app and time to the first fast response.
+
+Import time is measured in fresh interpreters: django.setup() plus the
+modules a worker loads for the WebSocket API (analyzer.consumers and
+everything it imports). Then a server is started with the simulated
+provider, and one session sends text requests back to back as soon as
+the port accepts connections. The script reports:
+
+    ready      seconds from spawning the server to the first accepted connection
+    first      latency of the first request
+    steady     median latency of requests 10 to --requests
+    fast after seconds from spawning until a request took less than twice steady
+
+Run it against a throwaway database like benchmarks/load_test.py --stub:
+
+    python benchmarks/bench_startup.py --stub "stub?latency_ms=50"
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_workers import API_KEY, ROOT, free_port, start_server  # noqa: E402
+from load_test import setup_stub  # noqa: E402
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import django; django.setup(); "
+    "import analyzer.consumers; print(time.perf_counter() - start)"
+)
+
+
+def import_seconds(runs):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'image_analyzer.settings')
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+async def first_requests(port, spawned_at, count):
+    url = f'ws://127.0.0.1:{port}/ws/analyze/?api_key={API_KEY}&session=1&protocol=v2'
+    while True:
+        try:
+            ws = await websockets.connect(url)
+            break
+        except (OSError, websockets.exceptions.WebSocketException):
+            await asyncio.sleep(0.05)
+    ready = time.perf_counter() - spawned_at
+
+    latencies, finished = [], []
+    async with ws:
+        for request_id in range(1, count + 1):
+            start = time.perf_counter()
+            await ws.send(json.dumps({'request_id': str(request_id), 'company_name': 'Starbucks'}))
+            while True:
+                frame = json.loads(await ws.recv())
+                if frame.get('type') == 'result' and frame.get('request_id') == str(request_id):
+                    break
+            latencies.append(time.perf_counter() - start)
+            finished.append(time.perf_counter() - spawned_at)
+    return ready, latencies, finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stub', default='stub?latency_ms=50', help='Stub provider spec')
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--import-runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"import     {import_seconds(args.import_runs) * 1000:8.0f} ms (median of {args.import_runs})")
+
+    setup_stub(args.stub)
+    port = free_port()
+    spawned_at = time.perf_counter()
+    server = start_server(1, port, False)
+    try:
+        ready, latencies, finished = asyncio.run(first_requests(port, spawned_at, args.requests))
+    finally:
+        server.terminate()
+        server.wait()
+
+    steady = statistics.median(latencies[9:]) if len(latencies) > 9 else statistics.median(latencies)
+    fast_after = next((done for latency, done in zip(latencies, finished) if latency < 2 * steady), None)
+    print(f"ready      {ready * 1000:8.0f} ms")
+    print(f"first      {latencies[0] * 1000:8.0f} ms")
+    print(f"steady     {steady * 1000:8.0f} ms")
+    print(f"fast after {fast_after * 1000:8.0f} ms" if fast_after is not None else "fast after     never")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Throughput of image scans with 1 to N ASGI worker processes.
+
+For each worker count the script starts `uvicorn --workers N` on a free
+port, opens `--clients` session-mode WebSocket connections, keeps one image
+scan in flight per connection for `--duration` seconds and reports scans per
+second. Run it from the repository root after `python manage.py migrate`:
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --clients 16
+
+Without provider API keys in the database the provider call returns at once,
+so the numbers measure the server side of a scan: base64 decoding, image
+resizing and framing. That is the CPU work a single process cannot spread
+over cores. Pass --redis to run the workers in USE_REDIS mode.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = 'bench-api-key'
+
+
+def make_image(width=1600, height=1200):
+    """A noisy JPEG, so resizing and re-encoding are not trivially cheap"""
+    image = Image.frombytes('RGB', (width, height), random.randbytes(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, port, redis, extra_env=None):
+    env = dict(
+        os.environ,
+        WEBSOCKET_API_KEY=API_KEY,
+        # The benchmark is one client IP, keep the limits out of the way
+        RATE_LIMIT_CONNECTIONS_PER_MINUTE='1000000',
+        RATE_LIMIT_CONNECTIONS_BURST='1000000',
+        RATE_LIMIT_MESSAGES_PER_MINUTE='1000000',
+        RATE_LIMIT_MESSAGES_BURST='1000000',
+        USE_REDIS='True' if redis else os.environ.get('USE_REDIS', 'False'),
+        **(extra_env or {}),
+    )
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'image_analyzer.asgi:application', '--host', '127.0.0.1',
+         '--port', str(port), '--workers', str(workers), '--lifespan', 'on', '--log-level', 'warning'],
+        cwd=ROOT, env=env,
+    )
+
+
+async def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(url):
+                return
+        except (OSError, websockets.exceptions.WebSocketException):
+            await asyncio.sleep(0.5)
+    raise RuntimeError("Server did not start")
+
+
+async def client(url, image, stop_at, latencies):
+    async with websockets.connect(url, max_size=None) as ws:
+        request_id = 0
+        while time.monotonic() < stop_at:
+            request_id += 1
+            start = time.perf_counter()
+            await ws.send(json.dumps({'request_id': str(request_id), 'image_data': image, 'country': 'Bench'}))
+            while True:
+                frame = json.loads(await ws.recv())
+                if frame.get('type') == 'result' and frame.get('request_id') == str(request_id):
+                    break
+            latencies.append(time.perf_counter() - start)
+
+
+async def measure(port, clients, duration, image):
+    url = f'ws://127.0.0.1:{port}/ws/analyze/?api_key={API_KEY}&session=1&protocol=v2'
+    await wait_ready(url)
+    # Warm up every worker's caches and imports before timing
+    await asyncio.gather(*(client(url, image, time.monotonic() + 2, []) for _ in range(clients)))
+
+    latencies = []
+    start = time.monotonic()
+    await asyncio.gather(*(client(url, image, start + duration, latencies) for _ in range(clients)))
+    elapsed = time.monotonic() - start
+    latencies.sort()
+    return {
+        'scans': len(latencies),
+        'scans_per_second': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--redis', action='store_true', help="Run the workers with USE_REDIS=True")
+    args = parser.parse_args()
+
+    image = make_image()
+    results = []
+    for workers in args.workers:
+        port = free_port()
+        server = start_server(workers, port, args.redis, {'ADMISSION_CAPACITY': '1000'})
+        try:
+            result = asyncio.run(measure(port, args.clients, args.duration, image))
+        finally:
+            server.terminate()
+            server.wait()
+        result['workers'] = workers
+        results.append(result)
+        print(
+            f"{workers} worker(s): {result['scans_per_second']:.1f} scans/s, "
+            f"p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms"
+        )
+
+    base = results[0]['scans_per_second']
+    for result in results[1:]:
+        print(f"{result['workers']} workers: {result['scans_per_second'] / base:.2f}x of {results[0]['workers']}")
+
+
+if __name__ == '__main__':
+    main()
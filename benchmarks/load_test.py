@@ -0,0 +1,288 @@
+"""
+End-to-end WebSocket load test.
+
+Opens `--sessions` concurrent session-mode connections (protocol v2 with
+streamed results), each keeping one text or image request in flight for
+`--duration` seconds, and reports throughput, the status of every result,
+client-side latencies (connect, first verdict, full result) and, from
+/metrics, server-side p50/p95/p99 per analysis stage.
+
+Against a local server with the simulated provider (analyzer/API/stub_provider.py):
+
+    python benchmarks/load_test.py --stub "stub?latency_ms=1500&jitter_ms=500&dist=lognormal&p429=0.02" \\
+        --workers 2 --sessions 100 --duration 60 --image-share 0.3
+
+--stub stores the spec as the model_name of a ProviderCompany named "stub"
+with one API key, in the database of DJANGO_SETTINGS_MODULE, and refuses to
+run when that database holds keys of real providers: point the settings at
+a throwaway database, e.g. USE_POSTGRES_DB=True with a sqlite DATABASE_URL.
+The spawned server keeps its admission and deadline settings; only the
+per-IP rate limits are raised, since every session comes from one address.
+
+Against a running server, e.g. staging, pass its URL and WebSocket key:
+
+    python benchmarks/load_test.py --url ws://staging:8000 --api-key KEY --sessions 50
+
+Server-side stages need METRICS_ENABLED (and --metrics-token when the server
+has METRICS_TOKEN). With several workers each scrape reaches one of them, so
+the stage percentiles are a sample of that worker's share of the load.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_workers import API_KEY, ROOT, free_port, make_image, start_server, wait_ready  # noqa: E402
+
+STUB_API_KEY = 'stub-load-test-key'
+COMPANY_NAMES = ['Starbucks', 'Coca-Cola', 'Nestle', 'PepsiCo', 'McDonalds', 'Samsung', 'Puma', 'Carrefour',
+                 'Danone', 'Unilever', 'Sabra', 'Ahava', 'Intel', 'HP', 'Siemens', 'Burger King', 'Pizza Hut']
+
+
+def setup_stub(spec):
+    """Point the provider configuration of the local database at the stub provider"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_analyzer.settings')
+    import django
+    django.setup()
+    from analyzer.models import ApiKeys, ProviderCompany
+
+    others = ApiKeys.objects.exclude(provider_company__company_name__iexact='stub')
+    if others.exists():
+        sys.exit("The database has API keys of real providers; run --stub against a throwaway database")
+    provider, _ = ProviderCompany.objects.update_or_create(company_name='stub', defaults={'model_name': spec})
+    ApiKeys.objects.update_or_create(api_key=STUB_API_KEY, defaults={'provider_company': provider, 'stop_date': None})
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000  # noqa: E731
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'count': len(values)}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.queued = 0
+
+    def record(self, kind, status, total, verdict):
+        self.statuses[status] += 1
+        self.latencies[f'{kind}_total'].append(total)
+        if verdict is not None:
+            self.latencies[f'{kind}_verdict'].append(verdict)
+
+
+async def request(ws, request_id, payload, stats, timeout):
+    """Send one request and wait for its final delta; returns (status, total, verdict) seconds"""
+    start = time.perf_counter()
+    await ws.send(json.dumps(dict(payload, request_id=request_id)))
+    fields, verdict = {}, None
+    while True:
+        frame = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+        if frame.get('request_id') != request_id:
+            continue
+        if frame['type'] == 'queue':
+            stats.queued += 1
+        elif frame['type'] == 'error':
+            stats.errors[frame.get('value') or 'error'] += 1
+            return 'rejected', time.perf_counter() - start, None
+        elif frame['type'] == 'delta':
+            fields.update(frame['fields'])
+            if verdict is None and 'status' in fields:
+                verdict = time.perf_counter() - start
+            if frame.get('done'):
+                return fields.get('status', 'error'), time.perf_counter() - start, verdict
+
+
+async def session(url, payloads, image_share, stop_at, stats, rng, timeout):
+    """One client: reconnects after a dropped connection until stop_at"""
+    request_number = 0
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        try:
+            ws = await websockets.connect(url, max_size=None)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            stats.errors[f'connect: {type(e).__name__}'] += 1
+            await asyncio.sleep(0.5)
+            continue
+        stats.latencies['connect'].append(time.perf_counter() - start)
+        try:
+            async with ws:
+                while time.monotonic() < stop_at:
+                    request_number += 1
+                    kind = 'image' if rng.random() < image_share else 'text'
+                    payload = payloads[kind] if kind == 'image' else dict(
+                        payloads['text'], company_name=rng.choice(COMPANY_NAMES))
+                    status, total, verdict = await request(ws, str(request_number), payload, stats, timeout)
+                    stats.record(kind, status, total, verdict)
+        except asyncio.TimeoutError:
+            stats.errors['no result within --timeout'] += 1
+        except websockets.exceptions.ConnectionClosed as e:
+            stats.errors[f'closed: {e.code}'] += 1
+
+
+async def scrape(http_url, token):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(f'{http_url}/metrics', headers=headers)
+    except httpx.HTTPError:
+        return None
+    return response.text if response.status_code == 200 else None
+
+
+def stage_buckets(text):
+    """{stage: [(upper bound, cumulative count), ...]} from gaza_stage_seconds_bucket lines"""
+    stages = defaultdict(list)
+    for line in (text or '').splitlines():
+        if not line.startswith('gaza_stage_seconds_bucket{'):
+            continue
+        labels, value = line[len('gaza_stage_seconds_bucket{'):].rsplit('} ', 1)
+        parsed = dict(pair.split('=', 1) for pair in labels.split(','))
+        le = parsed['le'].strip('"')
+        stages[parsed['stage'].strip('"')].append((float('inf') if le == '+Inf' else float(le), float(value)))
+    return stages
+
+
+def bucket_quantile(buckets, q):
+    """Quantile from cumulative histogram buckets, interpolating linearly inside a bucket"""
+    total = buckets[-1][1]
+    if total <= 0:
+        return None
+    target = q * total
+    lower, below = 0.0, 0.0
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            if bound == float('inf'):
+                return lower
+            in_bucket = cumulative - below
+            return lower + (bound - lower) * ((target - below) / in_bucket if in_bucket else 1)
+        lower, below = bound, cumulative
+    return lower
+
+
+def stage_percentiles(before, after):
+    old = stage_buckets(before)
+    report = {}
+    for stage, buckets in stage_buckets(after).items():
+        previous = dict(old.get(stage, []))
+        diff = [(bound, count - previous.get(bound, 0)) for bound, count in buckets]
+        if diff[-1][1] <= 0:
+            continue
+        report[stage] = {f'p{int(q * 100)}': bucket_quantile(diff, q) * 1000 for q in (0.5, 0.95, 0.99)}
+        report[stage]['count'] = int(diff[-1][1])
+    return report
+
+
+async def run(args, ws_url, http_url):
+    rng = random.Random(args.seed)
+    payloads = {
+        'text': {'country': args.country},
+        'image': {'image_data': make_image(*args.image_size), 'country': args.country},
+    }
+    await wait_ready(ws_url)
+    before = await scrape(http_url, args.metrics_token)
+
+    stats = Stats()
+    start = time.monotonic()
+    stop_at = start + args.duration
+    await asyncio.gather(*(
+        session(ws_url, payloads, args.image_share, stop_at, stats, random.Random(rng.random()), args.timeout)
+        for _ in range(args.sessions)
+    ))
+    elapsed = time.monotonic() - start
+
+    after = await scrape(http_url, args.metrics_token)
+    completed = sum(stats.statuses.values())
+    return {
+        'sessions': args.sessions,
+        'seconds': elapsed,
+        'requests': completed,
+        'requests_per_second': completed / elapsed,
+        'statuses': dict(stats.statuses),
+        'rates': {status: count / completed for status, count in stats.statuses.items()} if completed else {},
+        'queued': stats.queued,
+        'errors': dict(stats.errors),
+        'client_ms': {name: percentiles(values) for name, values in sorted(stats.latencies.items())},
+        'server_stage_ms': stage_percentiles(before, after) if before and after else None,
+    }
+
+
+def print_report(report):
+    print(f"{report['requests']} results in {report['seconds']:.1f}s from {report['sessions']} sessions: "
+          f"{report['requests_per_second']:.1f} req/s, {report['queued']} queue notices")
+    for status, count in sorted(report['statuses'].items()):
+        print(f"  {status:16s} {count:8d}  {report['rates'][status]:7.2%}")
+    for error, count in sorted(report['errors'].items()):
+        print(f"  error: {error} x{count}")
+    sections = [('client', report['client_ms'])]
+    if report['server_stage_ms']:
+        sections.append(('server stage', report['server_stage_ms']))
+    else:
+        print("  no server-side stages: /metrics is disabled or unreachable")
+    for title, rows in sections:
+        for name, row in rows.items():
+            if row:
+                print(f"  {title} {name:24s} p50 {row['p50']:9.1f} ms  p95 {row['p95']:9.1f} ms  "
+                      f"p99 {row['p99']:9.1f} ms  n={row['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Base ws:// URL of a running server; without it one is started locally')
+    parser.add_argument('--api-key', default=API_KEY, help='WebSocket API key of the server at --url')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes of the local server')
+    parser.add_argument('--redis', action='store_true', help='Run the local server with USE_REDIS=True')
+    parser.add_argument('--stub', help='Stub provider spec to configure before starting the local server')
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--image-share', type=float, default=0.3, help='Share of requests sending an image')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[1600, 1200], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--country', default='Palestine')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for a result')
+    parser.add_argument('--metrics-token', default=os.getenv('METRICS_TOKEN'))
+    parser.add_argument('--seed', type=int, default=1948)
+    parser.add_argument('--json', help='Also write the report to this path')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        if args.stub:
+            setup_stub(args.stub)
+        port = free_port()
+        server = start_server(args.workers, port, args.redis, {'METRICS_ENABLED': 'True'})
+        base = f'ws://127.0.0.1:{port}'
+    parts = urlsplit(base)
+    http_url = f"{'https' if parts.scheme == 'wss' else 'http'}://{parts.netloc}"
+    ws_url = f'{base}/ws/analyze/?api_key={args.api_key}&session=1&protocol=v2&stream=1'
+
+    try:
+        report = asyncio.run(run(args, ws_url, http_url))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
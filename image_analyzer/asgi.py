@@ -1,16 +1,31 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_analyzer.settings')
+
+# Set up Django before importing the analyzer, whose modules read settings on import
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import analyzer.routing
+from analyzer import startup
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_analyzer.settings')
+startup.check_configuration()
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+# Servers without lifespan support start the background tasks on the first connection
+application = startup.with_background_tasks(ProtocolTypeRouter({
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             analyzer.routing.websocket_urlpatterns
         )
     ),
-})
+    # Uvicorn warms up in the lifespan startup, before accepting connections
+    "lifespan": startup.lifespan,
+}))
+
+# Servers without lifespan support (Daphne) import the application before
+# their event loop runs, so the warm-up can run here
+if not startup.in_event_loop():
+    startup.warm_up()
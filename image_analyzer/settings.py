@@ -89,12 +89,32 @@ TEMPLATES = [
 WSGI_APPLICATION = 'image_analyzer.wsgi.application'
 
 ASGI_APPLICATION = "image_analyzer.asgi.application"
+
+# Multi-worker mode: with USE_REDIS the channel layer, cache and rate limits
+# are shared through Redis so several worker processes can serve together
+USE_REDIS = os.getenv('USE_REDIS', 'False').lower() == 'true'
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
 CHANNEL_LAYERS = {
     "default": {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [REDIS_URL]},
+    } if USE_REDIS else {
         "BACKEND": "channels.layers.InMemoryChannelLayer",
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if USE_REDIS else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # Room for cached verdicts and translations, the default is 300 entries
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', '10000'))},
+    }
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -111,6 +131,9 @@ DATABASES = {
     }
 }
 
+# Threads (and database connections) per process for read-only lookups
+DB_READ_WORKERS = int(os.getenv('DB_READ_WORKERS', '4'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -151,6 +174,60 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Content addressed image store inside MEDIA_ROOT, served by analyzer.views.image_view.
+# PUBLIC_BASE_URL (e.g. https://example.com) is the absolute base of stored image URLs, which the
+# app loads as is; on Render it defaults to RENDER_EXTERNAL_URL. The server refuses to start
+# without one unless DEBUG is on. `manage.py prune_images` deletes the images no alternative
+# uses once they are IMAGE_UNUSED_MAX_AGE seconds old.
+IMAGE_STORE_DIR = 'images'
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', str(365 * 24 * 60 * 60)))
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', os.getenv('RENDER_EXTERNAL_URL', 'http://localhost:8000' if DEBUG else ''))
+IMAGE_UNUSED_MAX_AGE = int(os.getenv('IMAGE_UNUSED_MAX_AGE', str(7 * 24 * 60 * 60)))
+
+# Offline catalog bundles inside MEDIA_ROOT, written by `manage.py export_catalog`
+# and served by analyzer.views.catalog_view; deltas are kept from the last CATALOG_KEEP_VERSIONS versions
+CATALOG_DIR = 'catalog'
+CATALOG_KEEP_VERSIONS = int(os.getenv('CATALOG_KEEP_VERSIONS', '10'))
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', '300'))
+
+
+# Fuzzy company matching: the database proposes COMPANY_SEARCH_CANDIDATES names, which are
+# rescored in Python. Backend: auto (by database vendor), sqlite (FTS5), postgres (pg_trgm) or python.
+# COMPANY_SEARCH_MIN_SIMILARITY is the pg_trgm similarity a candidate needs
+COMPANY_SEARCH_BACKEND = os.getenv('COMPANY_SEARCH_BACKEND', 'auto')
+COMPANY_SEARCH_CANDIDATES = int(os.getenv('COMPANY_SEARCH_CANDIDATES', '50'))
+COMPANY_SEARCH_MIN_SIMILARITY = float(os.getenv('COMPANY_SEARCH_MIN_SIMILARITY', '0.2'))
+
+# Startup warm-up (analyzer.startup): caches, database connections and one provider connection
+# are made ready before the worker accepts traffic. System messages are cached for
+# PROMPT_CACHE_SECONDS and at most PROVIDER_IDLE_CLIENTS provider clients are kept per key
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'True').lower() == 'true'
+WARMUP_PROVIDER_TIMEOUT = float(os.getenv('WARMUP_PROVIDER_TIMEOUT', '5'))
+PROMPT_CACHE_SECONDS = float(os.getenv('PROMPT_CACHE_SECONDS', '60'))
+PROVIDER_IDLE_CLIENTS = int(os.getenv('PROVIDER_IDLE_CLIENTS', '8'))
+
+# Prompt profile (analyzer.API.prompts) for providers without their own prompt_profile
+PROMPT_PROFILE = os.getenv('PROMPT_PROFILE', 'verbose')
+
+# Verdicts are analyzed in VERDICT_LANGUAGE and cached for every language; the texts clients
+# read in other languages are translated and cached per language
+VERDICT_LANGUAGE = os.getenv('VERDICT_LANGUAGE', 'English')
+VERDICT_CACHE_SECONDS = int(os.getenv('VERDICT_CACHE_SECONDS', str(24 * 3600)))
+TRANSLATION_CACHE_SECONDS = int(os.getenv('TRANSLATION_CACHE_SECONDS', str(7 * 24 * 3600)))
+# Cached verdicts older than this are stale: still served, and refreshed in the background
+VERDICT_REFRESH_AFTER_SECONDS = int(os.getenv('VERDICT_REFRESH_AFTER_SECONDS', str(18 * 3600)))
+
+# Popularity sketch (analyzer.utils.popularity) and background refresh of popular verdicts
+# (analyzer.utils.refresh). REFRESH_WINDOWS are off-peak times in TIME_ZONE, e.g. "01:00-06:00";
+# empty means any time
+POPULARITY_CAPACITY = int(os.getenv('POPULARITY_CAPACITY', '2000'))
+POPULARITY_HALF_LIFE = float(os.getenv('POPULARITY_HALF_LIFE', '3600'))
+REFRESH_ENABLED = os.getenv('REFRESH_ENABLED', 'True').lower() == 'true'
+REFRESH_INTERVAL_SECONDS = float(os.getenv('REFRESH_INTERVAL_SECONDS', '60'))
+REFRESH_TOP_N = int(os.getenv('REFRESH_TOP_N', '100'))
+REFRESH_MIN_HITS = int(os.getenv('REFRESH_MIN_HITS', '5'))
+REFRESH_CALLS_PER_HOUR = int(os.getenv('REFRESH_CALLS_PER_HOUR', '120'))
+REFRESH_WINDOWS = os.getenv('REFRESH_WINDOWS', '')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -168,6 +245,95 @@ REST_FRAMEWORK = {
 # Get your client ID from https://api.imgur.com/oauth2/addclient
 
 IMGUR_CLIENT_ID = os.getenv('IMGUR_CLIENT_ID')
+# Mirror stored images to Imgur in the background (off by default)
+IMGUR_MIRROR_ENABLED = os.getenv('IMGUR_MIRROR_ENABLED', 'False').lower() == 'true'
+
+# Write-behind queue for alternative saves and image uploads
+# Overflow policy when the queue is full: drop_newest, drop_oldest or spill (to WRITE_BEHIND_SPILL_PATH)
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '100'))
+WRITE_BEHIND_WORKERS = int(os.getenv('WRITE_BEHIND_WORKERS', '1'))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '3'))
+WRITE_BEHIND_BACKOFF_SECONDS = float(os.getenv('WRITE_BEHIND_BACKOFF_SECONDS', '1.0'))
+WRITE_BEHIND_OVERFLOW = os.getenv('WRITE_BEHIND_OVERFLOW', 'spill')
+WRITE_BEHIND_SPILL_PATH = os.getenv('WRITE_BEHIND_SPILL_PATH', os.path.join(BASE_DIR, 'write_behind_spill.jsonl'))
+
+# Learned alternatives are buffered and written in batches of ALTERNATIVE_FLUSH_SIZE
+# or every ALTERNATIVE_FLUSH_INTERVAL seconds
+ALTERNATIVE_FLUSH_SIZE = int(os.getenv('ALTERNATIVE_FLUSH_SIZE', '50'))
+ALTERNATIVE_FLUSH_INTERVAL = float(os.getenv('ALTERNATIVE_FLUSH_INTERVAL', '5.0'))
 
 # WebSocket API Key
-WEBSOCKET_API_KEY = os.getenv('WEBSOCKET_API_KEY', 'your-secret-api-key-here')
\ No newline at end of file
+WEBSOCKET_API_KEY = os.getenv('WEBSOCKET_API_KEY', 'your-secret-api-key-here')
+
+# Rate limiting (token buckets per client IP)
+# Backend: memory (per process), redis (REDIS_URL) or sqlite (shared by the workers of one host)
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'redis' if USE_REDIS else 'memory')
+RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', os.path.join(BASE_DIR, 'rate_limit.sqlite3'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000'))
+RATE_LIMIT_CONNECTIONS_PER_MINUTE = float(os.getenv('RATE_LIMIT_CONNECTIONS_PER_MINUTE', '10'))
+RATE_LIMIT_CONNECTIONS_BURST = float(os.getenv('RATE_LIMIT_CONNECTIONS_BURST', '10'))
+RATE_LIMIT_MESSAGES_PER_MINUTE = float(os.getenv('RATE_LIMIT_MESSAGES_PER_MINUTE', '20'))
+RATE_LIMIT_MESSAGES_BURST = float(os.getenv('RATE_LIMIT_MESSAGES_BURST', '10'))
+
+# Admission control for LLM calls: at most ADMISSION_CAPACITY cost units run at once,
+# an image query costs ADMISSION_COST_IMAGE units and a text query ADMISSION_COST_TEXT
+ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY', '8'))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '100'))
+ADMISSION_COST_TEXT = int(os.getenv('ADMISSION_COST_TEXT', '1'))
+ADMISSION_COST_IMAGE = int(os.getenv('ADMISSION_COST_IMAGE', '3'))
+
+# WebSocket session mode (?session=1): the socket stays open for several tagged requests
+WEBSOCKET_IDLE_TIMEOUT = float(os.getenv('WEBSOCKET_IDLE_TIMEOUT', '120'))
+WEBSOCKET_HEARTBEAT_INTERVAL = float(os.getenv('WEBSOCKET_HEARTBEAT_INTERVAL', '25'))
+WEBSOCKET_MAX_IN_FLIGHT = int(os.getenv('WEBSOCKET_MAX_IN_FLIGHT', '4'))
+
+# Bulk company check endpoint (POST /api/check/): names per request and names analyzed at once per request
+BULK_CHECK_MAX_NAMES = int(os.getenv('BULK_CHECK_MAX_NAMES', '50'))
+BULK_CHECK_CONCURRENCY = int(os.getenv('BULK_CHECK_CONCURRENCY', '4'))
+
+# Alternatives snapshots are rebuilt after ALTERNATIVES_SNAPSHOT_MAX_AGE seconds, even without an invalidation.
+# Without Redis, workers check the version stamp in the database every ALTERNATIVES_VERSION_CHECK_SECONDS
+# to see changes made by other processes, e.g. `manage.py import_dataset`
+ALTERNATIVES_SNAPSHOT_MAX_AGE = int(os.getenv('ALTERNATIVES_SNAPSHOT_MAX_AGE', '600'))
+ALTERNATIVES_VERSION_CHECK_SECONDS = float(os.getenv('ALTERNATIVES_VERSION_CHECK_SECONDS', '5'))
+
+# Alternatives HTTP API (GET /api/alternatives/): seconds shared caches may serve a response, page sizes
+ALTERNATIVES_CACHE_MAX_AGE = int(os.getenv('ALTERNATIVES_CACHE_MAX_AGE', '300'))
+ALTERNATIVES_PAGE_SIZE = int(os.getenv('ALTERNATIVES_PAGE_SIZE', '20'))
+ALTERNATIVES_MAX_PAGE_SIZE = int(os.getenv('ALTERNATIVES_MAX_PAGE_SIZE', '100'))
+
+# Prometheus metrics on /metrics; METRICS_ENABLED=False turns every timer and counter into a no-op.
+# With METRICS_TOKEN set, scrapers must send "Authorization: Bearer <token>"
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Logging: records are queued and written by a background thread, so the event loop never
+# blocks on log I/O. Per-row messages (extra=SAMPLED) are kept one in LOG_SAMPLE_EVERY;
+# LOG_SAMPLE_RATES overrides that per logger, e.g. "analyzer.Boycott=1" to keep them all
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '100'))
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {'()': 'analyzer.utils.logs.RequestContextFilter'},
+        'sample': {
+            '()': 'analyzer.utils.logs.SampleFilter',
+            'every': LOG_SAMPLE_EVERY,
+            'rates': LOG_SAMPLE_RATES,
+        },
+    },
+    'formatters': {
+        'default': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+    },
+    'handlers': {
+        'queue': {
+            '()': 'analyzer.utils.logs.QueuedStreamHandler',
+            'formatter': 'default',
+            'filters': ['sample', 'request_context'],
+        },
+    },
+    'root': {'handlers': ['queue'], 'level': LOG_LEVEL},
+}
@@ -3,5 +3,13 @@ echo "Running migrations..."
 python manage.py migrate --noinput
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
-echo "Starting Daphne server..."
-daphne -b 0.0.0.0 -p ${PORT:-8000} image_analyzer.asgi:application
\ No newline at end of file
+WORKERS=${WEB_CONCURRENCY:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    # Several workers need the shared Redis channel layer, cache and rate limits
+    export USE_REDIS=${USE_REDIS:-True}
+    echo "Starting $WORKERS Uvicorn workers..."
+    uvicorn image_analyzer.asgi:application --host 0.0.0.0 --port ${PORT:-8000} --workers $WORKERS --lifespan on
+else
+    echo "Starting Daphne server..."
+    daphne -b 0.0.0.0 -p ${PORT:-8000} image_analyzer.asgi:application
+fi